@@ -0,0 +1,127 @@
+"""
+Минимальный HTTP/1.1-сервер на asyncio для фейковых сервисов бенчмарка.
+Без внешних зависимостей: keep-alive, Content-Length и chunked-тела,
+разбор query, urlencoded- и multipart-форм, имитация обрыва соединения.
+"""
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+
+    def form(self) -> Dict[str, object]:
+        """Поля формы: строки для обычных полей, bytes для файлов."""
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + self.body
+            )
+            fields: Dict[str, object] = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True) or b""
+                fields[name] = payload if part.get_filename() else payload.decode("utf-8", errors="ignore")
+            return fields
+        if content_type.startswith("application/json"):
+            return json.loads(self.body or b"{}")
+        return dict(parse_qsl(self.body.decode("utf-8", errors="ignore")))
+
+
+# Обработчик возвращает (статус, тело, content-type) или (статус, тело, content-type, заголовки).
+# Заголовок DROP_AFTER: отправить столько байт тела и закрыть соединение
+Response = Union[Tuple[int, bytes, str], Tuple[int, bytes, str, Dict[str, str]]]
+DROP_AFTER = "X-Fake-Drop-After"
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+def json_response(payload, status: int = 200) -> Response:
+    return status, json.dumps(payload).encode(), "application/json"
+
+
+class FakeHTTPServer:
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "FakeHTTPServer":
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await self._read_body(reader, headers)
+
+                try:
+                    status, payload, content_type, *rest = await self.handler(Request(method, target, headers, body))
+                except Exception as e:
+                    logger.exception(f"Фейковый сервер: ошибка обработки {target}: {e}")
+                    status, payload, content_type, rest = 500, str(e).encode(), "text/plain", []
+                extra = dict(rest[0]) if rest else {}
+                drop_after = extra.pop(DROP_AFTER, None)
+
+                head = f"HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                head += "".join(f"{name}: {value}\r\n" for name, value in extra.items())
+                if drop_after is not None:
+                    writer.write(f"{head}\r\n".encode() + payload[:int(drop_after)])
+                    await writer.drain()
+                    break
+                writer.write(f"{head}\r\n".encode() + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).strip().split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        length = int(headers.get("content-length", "0") or 0)
+        return await reader.readexactly(length) if length else b""
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Фейковый `rip` для бенчмарка: принимает те же аргументы, что и streamrip
+(`-f DIR -q N --no-db --no-progress url URL`), и пишет синтетический FLAC
+с заданной скоростью, как будто трек качается из сети.
+
+Переменные окружения:
+  FAKE_RIP_SPEED_MBPS  — скорость «загрузки», МБ/с (по умолчанию 20)
+  FAKE_RIP_SIZE_MB     — размер трека, МБ (по умолчанию 30)
+  FAKE_RIP_STARTUP     — задержка запуска процесса и входа в Qobuz, с (по умолчанию 0.3)
+  FAKE_RIP_FAIL_RATE   — доля загрузок, завершающихся ошибкой (по умолчанию 0)
+"""
+from pathlib import Path
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from synth import flac_header  # noqa: E402
+
+CHUNK = 256 * 1024
+QUALITY_FORMATS = {1: (16, 44100), 2: (16, 44100), 3: (24, 96000), 4: (24, 192000)}
+
+
+def fake_download(folder: str, quality: int, url: str) -> bool:
+    """Пишет синтетический трек в folder с заданной скоростью; False — имитация ошибки."""
+    speed = float(os.getenv("FAKE_RIP_SPEED_MBPS", "20")) * 1024 * 1024
+    size = int(float(os.getenv("FAKE_RIP_SIZE_MB", "30")) * 1024 * 1024)
+    if random.random() < float(os.getenv("FAKE_RIP_FAIL_RATE", "0")):
+        return False
+
+    match = re.search(r"/(?:track|album)/(\w+)", url)
+    track_id = match.group(1) if match else "0"
+    bits, rate = QUALITY_FORMATS.get(quality, (16, 44100))
+    artist, album, title = f"Artist {track_id}", f"Album {track_id}", f"Track {track_id}"
+
+    target_dir = Path(folder) / f"{artist} - {album} (2020) [FLAC] [{bits}B-{rate // 1000}kHz]"
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / f"01. {title}.flac"
+    header = flac_header({"title": title, "artist": artist, "album": album, "date": "2020"}, duration=200, sample_rate=rate, bits=bits)
+
+    print(f"Downloading {title}", file=sys.stderr)
+    started = time.monotonic()
+    with open(target, "wb") as f:
+        f.write(header)
+        written = len(header)
+        chunk = os.urandom(CHUNK)
+        while written < size:
+            n = min(CHUNK, size - written)
+            f.write(chunk[:n])
+            written += n
+            # Держим заданную скорость
+            ahead = written / speed - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    print(f"Downloaded {target.name}", file=sys.stderr)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", dest="folder", required=True)
+    parser.add_argument("-q", dest="quality", type=int, default=3)
+    parser.add_argument("--no-db", action="store_true")
+    parser.add_argument("--no-progress", action="store_true")
+    parser.add_argument("command")
+    parser.add_argument("url")
+    args = parser.parse_args()
+
+    time.sleep(float(os.getenv("FAKE_RIP_STARTUP", "0.3")))
+    if not fake_download(args.folder, args.quality, args.url):
+        print("ERROR: Simulated download failure")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Фейковый воркер streamrip для бенчмарка: тот же протокол, что у
+services/rip_worker.py (JSON по строкам), но «загрузку» делает fake_rip.
+Задержка FAKE_RIP_STARTUP оплачивается один раз — при запуске воркера.
+"""
+from pathlib import Path
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from fake_rip import fake_download  # noqa: E402
+
+
+def main():
+    time.sleep(float(os.getenv("FAKE_RIP_STARTUP", "0.3")))
+    print(json.dumps({"event": "ready"}), flush=True)
+    for line in sys.stdin:
+        job = json.loads(line)
+        if fake_download(job["folder"], job["quality"], job["url"]):
+            reply = {"id": job["id"], "ok": True}
+        else:
+            reply = {"id": job["id"], "ok": False, "error": "Simulated download failure", "auth": False}
+        print(json.dumps(reply), flush=True)
+
+
+if __name__ == "__main__":
+    main()
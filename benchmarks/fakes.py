@@ -0,0 +1,225 @@
+"""
+Фейковые внешние сервисы бенчмарка на одном локальном HTTP-сервере:
+  /qobuz/...      — API Qobuz (album/get, track/get, track/getFileUrl, catalog/search) и обложки
+  /qobuz/files/   — файлы треков с поддержкой Range, скоростью на соединение и обрывами
+  /audd/          — AudD: всегда «распознаёт» трек из фейкового каталога
+  /bot<token>/... — Bot API, как у локального telegram-bot-api (base_url в main.py)
+  /file/bot<token>/... — скачивание файлов, присланных пользователем
+"""
+from collections import Counter
+from typing import Dict
+import asyncio
+import hashlib
+import itertools
+import random
+import re
+import time
+import zlib
+from urllib.parse import unquote
+
+from benchmarks.fake_http import DROP_AFTER, FakeHTTPServer, Request, Response, json_response
+from benchmarks.synth import cover_bytes, flac_header, wav_bytes
+
+# Размер фейкового каталога треков
+CATALOG_SIZE = 100_000
+# format_id -> (бит, Гц) файла, который отдаёт /qobuz/files/
+STREAM_FORMATS = {5: (16, 44100), 6: (16, 44100), 7: (24, 96000), 27: (24, 192000)}
+
+
+class FakeServices:
+    def __init__(self, api_latency: float = 0.05, tg_latency: float = 0.03, upload_mbps: float = 50.0, album_size: int = 12,
+                 track_size_mb: float = 30.0, stream_mbps: float = 20.0, stream_drop_rate: float = 0.0, app_secret: str = "bench"):
+        self.api_latency = api_latency
+        self.tg_latency = tg_latency
+        self.upload_speed = upload_mbps * 1024 * 1024
+        self.album_size = album_size
+        self.server = FakeHTTPServer(self.handle)
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._cover = cover_bytes()
+        self._voice = wav_bytes()
+        # Скорость — на одно соединение, как у CDN: параллельные Range-запросы её складывают
+        self.stream_speed = stream_mbps * 1024 * 1024
+        self.stream_drop_rate = stream_drop_rate
+        self.app_secret = app_secret
+        self.stream_size = int(track_size_mb * 1024 * 1024)
+        self._stream_filler: bytes = b""
+
+    async def start(self) -> "FakeServices":
+        await self.server.start()
+        return self
+
+    async def stop(self):
+        await self.server.stop()
+
+    @property
+    def url(self) -> str:
+        return self.server.url
+
+    async def handle(self, request: Request) -> Response:
+        path = request.path
+        if path.startswith("/qobuz/files/"):
+            return await self._stream_file(request, path[len("/qobuz/files/"):])
+        if path.startswith("/qobuz/"):
+            await asyncio.sleep(self.api_latency)
+            return self._qobuz(request, path[len("/qobuz"):])
+        if path.startswith("/audd"):
+            self.calls["audd"] += 1
+            await asyncio.sleep(self.api_latency * 4)
+            track_id = random.randrange(CATALOG_SIZE)
+            return json_response({"status": "success", "result": {"artist": f"Artist {track_id}", "title": f"Track {track_id}"}})
+        if path.startswith("/file/bot"):
+            self.calls["file_download"] += 1
+            return 200, self._voice, "audio/wav"
+        if path.startswith("/bot"):
+            method = path.rsplit("/", 1)[-1]
+            return await self._bot_api(method, request)
+        return 404, b"not found", "text/plain"
+
+    # --- Qobuz ---
+
+    def _track(self, track_id: int) -> Dict:
+        return {
+            "id": track_id,
+            "title": f"Track {track_id}",
+            "performer": {"name": f"Artist {track_id}"},
+            "album": {
+                "title": f"Album {track_id}", "release_date_original": "2020-01-01",
+                "image": {"large": f"{self.url}/qobuz/covers/{track_id}.jpg"},
+            },
+            "track_number": 1,
+            "isrc": f"BENCH{track_id:07d}",
+            "duration": 180 + track_id % 120,
+            "maximum_bit_depth": 24,
+            "maximum_sampling_rate": 96,
+            "hires_streamable": True,
+            "streamable": True,
+        }
+
+    def _qobuz(self, request: Request, path: str) -> Response:
+        self.calls[f"qobuz{path}"] += 1
+        if path.endswith("/album/get"):
+            album_id = int(zlib.crc32(request.query.get("album_id", "").encode())) % 10_000
+            offset = int(request.query.get("offset", 0))
+            limit = int(request.query.get("limit", 500))
+            ids = [album_id * 100 + i for i in range(self.album_size)]
+            return json_response({
+                "title": f"Album {album_id}",
+                "artist": {"name": f"Artist {album_id}"},
+                "release_date_original": "2020-01-01",
+                "image": {"large": f"{self.url}/qobuz/covers/{album_id}.jpg"},
+                "maximum_bit_depth": 24,
+                "maximum_sampling_rate": 96,
+                "hires_streamable": True,
+                "streamable": True,
+                "tracks": {"total": len(ids), "items": [self._track(i) for i in ids[offset:offset + limit]]},
+            })
+        if path.endswith("/track/get"):
+            return json_response(self._track(int(request.query.get("track_id", "0") or 0)))
+        if path.endswith("/track/getFileUrl"):
+            return self._file_url(request.query)
+        if path.endswith("/catalog/search"):
+            track_id = zlib.crc32(request.query.get("query", "").encode()) % CATALOG_SIZE
+            return json_response({"tracks": {"items": [self._track(track_id)]}})
+        if path.startswith("/covers/"):
+            return 200, self._cover, "image/jpeg"
+        return 404, b"not found", "text/plain"
+
+    def _file_url(self, query: Dict) -> Response:
+        track_id, format_id, timestamp = query.get("track_id", ""), query.get("format_id", ""), query.get("request_ts", "")
+        expected = hashlib.md5(
+            f"trackgetFileUrlformat_id{format_id}intentstreamtrack_id{track_id}{timestamp}{self.app_secret}".encode()
+        ).hexdigest()
+        if query.get("request_sig") != expected:
+            return json_response({"status": "error", "code": 400, "message": "Invalid Request Signature parameter (request_sig)"}, 400)
+        format_id = int(format_id or 27)
+        return json_response({
+            "track_id": int(track_id or 0),
+            "format_id": format_id,
+            "mime_type": "audio/mpeg" if format_id == 5 else "audio/flac",
+            "url": f"{self.url}/qobuz/files/{track_id}-{format_id}.flac",
+        })
+
+    async def _stream_file(self, request: Request, name: str) -> Response:
+        self.calls["qobuz_stream"] += 1
+        track_id, _, format_id = name.rsplit(".", 1)[0].partition("-")
+        bits, rate = STREAM_FORMATS.get(int(format_id or 27), (24, 96000))
+        # Поток Qobuz приходит без тегов — их пишет сам бот
+        header = flac_header({}, duration=200, sample_rate=rate, bits=bits)
+        size = self.stream_size
+        if len(self._stream_filler) != size:
+            self._stream_filler = bytes(range(256)) * (size // 256 + 1)
+
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("range", ""))
+        if not match:
+            return 200, header + self._stream_filler[len(header):size], "audio/flac"
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            return 416, b"", "text/plain", {"Content-Range": f"bytes */{size}"}
+        body = header[start:end + 1] + self._stream_filler[max(start, len(header)):end + 1]
+        await asyncio.sleep(len(body) / self.stream_speed)
+        headers = {"Content-Range": f"bytes {start}-{end}/{size}", "Accept-Ranges": "bytes"}
+        if len(body) > 1 and random.random() < self.stream_drop_rate:
+            self.calls["qobuz_stream_drop"] += 1
+            headers[DROP_AFTER] = str(len(body) // 2)
+        return 206, body, "audio/flac", headers
+
+    # --- Bot API ---
+
+    def _message(self, form: Dict, **extra) -> Dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(form.get("chat_id", 0)), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "bench"},
+            **extra,
+        }
+
+    def _file(self, size: int, **extra) -> Dict:
+        file_no = next(self._file_ids)
+        return {"file_id": f"F{file_no}", "file_unique_id": f"U{file_no}", "file_size": size, **extra}
+
+    async def _bot_api(self, method: str, request: Request) -> Response:
+        self.calls[f"bot:{method}"] += 1
+        form = request.form()
+        await asyncio.sleep(self.tg_latency)
+
+        # Имитация отправки файла: время пропорционально размеру.
+        # В local_mode бот передаёт file://-путь — файл читаем сами, как сервер с --local
+        upload_size = sum(len(v) for v in form.values() if isinstance(v, bytes))
+        for value in form.values():
+            if isinstance(value, str) and value.startswith("file://"):
+                self.calls["bot:local_file"] += 1
+                upload_size += await asyncio.to_thread(_read_local_file, value[len("file://"):])
+        if upload_size:
+            self.uploaded_bytes += upload_size
+            await asyncio.sleep(upload_size / self.upload_speed)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(form, text=form.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(form, photo=[self._file(upload_size, width=600, height=600)])
+        elif method == "sendAudio":
+            result = self._message(form, audio=self._file(upload_size, duration=200))
+        elif method == "sendDocument":
+            result = self._message(form, document=self._file(upload_size))
+        elif method == "getFile":
+            result = {"file_id": form.get("file_id"), "file_unique_id": "voice", "file_size": len(self._voice), "file_path": "voice/file.wav"}
+        else:
+            # sendChatAction, deleteMessage, answerCallbackQuery, setMyCommands...
+            result = True
+        return json_response({"ok": True, "result": result})
+
+
+def _read_local_file(path: str) -> int:
+    """Читает файл целиком, как это делает Bot API сервер; размер в байтах."""
+    size = 0
+    with open(unquote(path), "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            size += len(chunk)
+    return size
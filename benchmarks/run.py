@@ -0,0 +1,251 @@
+"""
+Офлайн-бенчмарк бота: фейковые Qobuz, rip, AudD и Bot API, настоящие хендлеры.
+
+    python -m benchmarks.run --users 20 --requests 5 --scenario mixed
+
+N пользователей параллельно шлют по R запросов (каждый — следующий после
+завершения предыдущего). В конце печатается пропускная способность,
+перцентили задержек по сценариям и этапам и пиковый RSS.
+"""
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fakes import CATALOG_SIZE, FakeServices  # noqa: E402
+
+BENCH_TOKEN = "123456:bench"
+SCENARIOS = ("track", "album", "recognition")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # На Linux ru_maxrss — в килобайтах
+    return {
+        "bot": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def configure_environment(fakes: FakeServices, workdir: Path, args):
+    """Направляет бота на фейковые сервисы. Вызывается до импорта config."""
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "QOBUZ_API_URL": f"{fakes.url}/qobuz/api.json/0.2",
+        "QOBUZ_AUTH_TOKEN": "bench",
+        "AUDD_API_URL": f"{fakes.url}/audd/",
+        "AUDD_API_TOKEN": "bench",
+        "RIP_PATH": str(Path(__file__).resolve().parent / "fake_rip.py"),
+        "RIP_WORKER_PATH": str(Path(__file__).resolve().parent / "fake_rip_worker.py"),
+        "RIP_WORKERS": "0" if args.rip_cli else os.getenv("RIP_WORKERS", "3"),
+        # С секретом приложения бот качает треки сам, Range-запросами к фейковому файловому серверу
+        "QOBUZ_APP_SECRET": fakes.app_secret if args.native else "",
+        "METADATA_CACHE_PERSIST": "0",
+        "FAKE_RIP_SPEED_MBPS": str(args.rip_speed),
+        "FAKE_RIP_SIZE_MB": str(args.track_size),
+        "BOT_API_LOCAL_MODE": "1" if args.local_mode else "0",
+    })
+    from config import Config
+    # Рабочие папки и кэши — во временной папке, чтобы не трогать рабочие файлы бота
+    Config.DOWNLOAD_DIR = workdir / "downloads"
+    Config.DELIVERY_CACHE_FILE = workdir / "delivery_cache.json"
+    Config.STATE_DB_FILE = workdir / "state.db"
+    Config.WHITELIST_FILE = workdir / "whitelist.json"
+    Config.RECOGNITION_CACHE_FILE = workdir / "recognition_cache.json"
+    Config.SPOTIFY_MAP_FILE = workdir / "spotify_map.json"
+    Config.METRICS_PORT = 0
+
+
+class Driver:
+    def __init__(self, app, fakes: FakeServices, popular: int = 0):
+        self.app = app
+        self.fakes = fakes
+        # Сколько треков и альбомов запрашивают все пользователи (0 — весь каталог)
+        self.popular = popular
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.latencies: Dict[str, List[float]] = {name: [] for name in SCENARIOS}
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, user_id: int, **content) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **content,
+        }
+
+    async def _process(self, payload: dict):
+        from telegram import Update
+        update = Update.de_json({"update_id": next(self._update_ids), **payload}, self.app.bot)
+        await self.app.process_update(update)
+
+    async def track(self, user_id: int):
+        track_id = random.randrange(self.popular or CATALOG_SIZE)
+        await self._process({"message": self._message(user_id, text=f"https://open.qobuz.com/track/{track_id}")})
+
+    async def album(self, user_id: int):
+        # Ссылка на альбом -> выбор трека -> кнопка «Скачать весь альбом»
+        album_url = f"https://open.qobuz.com/album/bench{random.randrange(self.popular or 10_000)}"
+        await self._process({"message": self._message(user_id, text=album_url)})
+        await self._process({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": "qdl:all",
+            "message": self._message(1, text="💿 album"),
+        }})
+
+    async def recognition(self, user_id: int):
+        unique = next(self._update_ids)
+        await self._process({"message": self._message(user_id, audio={
+            "file_id": f"A{unique}", "file_unique_id": f"AU{unique}",
+            "duration": 15, "file_size": 240_000,
+        })})
+
+    async def user_session(self, user_id: int, requests: int, scenario: str):
+        for _ in range(requests):
+            name = random.choice(SCENARIOS) if scenario == "mixed" else scenario
+            started = time.monotonic()
+            await getattr(self, name)(user_id)
+            self.latencies[name].append(time.monotonic() - started)
+
+
+async def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="musicbot_bench_"))
+    fakes = await FakeServices(
+        api_latency=args.api_latency / 1000,
+        tg_latency=args.tg_latency / 1000,
+        upload_mbps=args.upload_speed,
+        album_size=args.album_size,
+        track_size_mb=args.track_size,
+        stream_mbps=args.rip_speed,
+        stream_drop_rate=args.stream_drop_rate,
+    ).start()
+    configure_environment(fakes, workdir, args)
+
+    from telegram.ext import ApplicationBuilder
+    from services import whitelist, metrics
+    import main as bot_main
+
+    app = (
+        ApplicationBuilder()
+        .token(BENCH_TOKEN)
+        .base_url(f"{fakes.url}/bot")
+        .base_file_url(f"{fakes.url}/file/bot")
+        .concurrent_updates(True)
+        .local_mode(args.local_mode)
+        .build()
+    )
+    bot_main.register_handlers(app)
+    user_ids = [10_000 + i for i in range(args.users)]
+
+    await app.initialize()
+    await bot_main.post_init(app)
+    for user_id in user_ids:
+        # Хранилище состояния бенчмарка — во временной папке
+        await whitelist.add(user_id)
+    driver = Driver(app, fakes, args.popular)
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(driver.user_session(uid, args.requests, args.scenario) for uid in user_ids))
+    finally:
+        elapsed = time.monotonic() - started
+        await bot_main.post_shutdown(app)
+        await app.shutdown()
+        await fakes.stop()
+
+    completed = sum(len(v) for v in driver.latencies.values())
+    return {
+        "users": args.users,
+        "requests": completed,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(completed / elapsed, 3) if elapsed else 0.0,
+        "latency_s": {
+            name: {
+                "n": len(values),
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "p99": round(percentile(values, 99), 3),
+            }
+            for name, values in driver.latencies.items() if values
+        },
+        "stages": {
+            stage: {k: (round(v, 3) if isinstance(v, float) else v) for k, v in s.items()}
+            for stage, s in metrics.summary().items()
+        },
+        "audio_sent": fakes.calls["bot:sendAudio"] + fakes.calls["bot:sendDocument"],
+        "uploaded_mb": round(fakes.uploaded_bytes / 1024 / 1024, 1),
+        "peak_rss_mb": {k: round(v, 1) for k, v in peak_rss_mb().items()},
+    }
+
+
+def print_report(report: dict):
+    print(f"\nПользователей: {report['users']}, запросов: {report['requests']} за {report['elapsed_s']} с")
+    print(f"Пропускная способность: {report['throughput_rps']} запросов/с")
+    print(f"Отправлено аудио: {report['audio_sent']} ({report['uploaded_mb']} МБ)")
+    print(f"Пиковый RSS: бот {report['peak_rss_mb']['bot']} МБ, дочерние процессы {report['peak_rss_mb']['children']} МБ")
+    print(f"\n{'сценарий':<14}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in report["latency_s"].items():
+        print(f"{name:<14}{s['n']:>6}{s['p50']:>9}{s['p95']:>9}{s['p99']:>9}")
+    print(f"\n{'этап':<26}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'ош.':>6}")
+    for stage, s in report["stages"].items():
+        fmt = lambda v: "—" if v is None else v  # noqa: E731
+        print(f"{stage:<26}{s['count']:>6}{fmt(s['p50']):>9}{fmt(s['p95']):>9}{fmt(s['p99']):>9}{s['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк бота на фейковых сервисах")
+    parser.add_argument("--users", type=int, default=10, help="одновременных пользователей")
+    parser.add_argument("--requests", type=int, default=3, help="запросов на пользователя")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("mixed",), default="mixed")
+    parser.add_argument("--album-size", type=int, default=8, help="треков в фейковом альбоме")
+    parser.add_argument("--track-size", type=float, default=30, help="размер трека, МБ")
+    parser.add_argument("--rip-speed", type=float, default=20, help="скорость фейкового rip, МБ/с")
+    parser.add_argument("--upload-speed", type=float, default=50, help="скорость отправки в фейковый Bot API, МБ/с")
+    parser.add_argument("--api-latency", type=float, default=50, help="задержка фейкового API Qobuz, мс")
+    parser.add_argument("--tg-latency", type=float, default=30, help="задержка фейкового Bot API, мс")
+    parser.add_argument("--local-mode", action="store_true", help="отдавать файлы по пути (file://), как серверу с --local")
+    parser.add_argument("--rip-cli", action="store_true", help="запускать rip на каждый трек вместо резидентных воркеров")
+    parser.add_argument("--native", action="store_true", help="качать треки Range-запросами без rip (track/getFileUrl)")
+    parser.add_argument("--stream-drop-rate", type=float, default=0.0, help="доля Range-ответов, обрывающихся на середине")
+    parser.add_argument("--popular", type=int, default=0, help="запрашивать только N треков и альбомов (одновременные одинаковые запросы)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="сохранить отчёт в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="логи бота в консоль")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
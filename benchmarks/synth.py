@@ -0,0 +1,49 @@
+"""Синтетические медиафайлы для бенчмарка: FLAC с тегами, WAV для распознавания, «обложка»."""
+from typing import Dict
+import io
+import struct
+import wave
+
+
+def _block_header(block_type: int, length: int, last: bool) -> bytes:
+    return bytes([(0x80 if last else 0) | block_type]) + length.to_bytes(3, "big")
+
+
+def flac_header(tags: Dict[str, str], duration: float, sample_rate: int = 96000, bits: int = 24, channels: int = 2) -> bytes:
+    """
+    Метаданные валидного FLAC (STREAMINFO + VORBIS_COMMENT + PADDING).
+    mutagen читает из них теги и формат; аудиокадры после заголовка — просто байты.
+    """
+    total_samples = int(duration * sample_rate)
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | total_samples
+    streaminfo = struct.pack(">HH", 4096, 4096) + (0).to_bytes(3, "big") * 2 + packed.to_bytes(8, "big") + b"\0" * 16
+
+    vendor = b"musicbot-bench"
+    comments = [f"{key.upper()}={value}".encode() for key, value in tags.items()]
+    vorbis = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    vorbis += b"".join(struct.pack("<I", len(c)) + c for c in comments)
+
+    # Запас под обложку, чтобы встраивание не переписывало весь файл
+    padding = b"\0" * 8192
+    return (
+        b"fLaC"
+        + _block_header(0, len(streaminfo), False) + streaminfo
+        + _block_header(4, len(vorbis), False) + vorbis
+        + _block_header(1, len(padding), True) + padding
+    )
+
+
+def wav_bytes(seconds: float = 15.0, sample_rate: int = 8000) -> bytes:
+    """Тишина в WAV — ffmpeg нарежет из неё фрагмент для «распознавания»."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def cover_bytes(size: int = 64 * 1024) -> bytes:
+    """Байты с сигнатурой JPEG — для тегов и send_photo этого достаточно."""
+    return b"\xff\xd8\xff\xe0" + b"\0" * (size - 6) + b"\xff\xd9"
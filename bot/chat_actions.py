@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional
+from telegram.constants import ChatAction
+from telegram.error import RetryAfter
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram показывает chat action ~5 секунд, обновляем чуть чаще
+CHAT_ACTION_INTERVAL = 4.0
+
+
+class ChatActionRegistration:
+    """Регистрация одной задачи в heartbeat; action можно менять по ходу задачи."""
+
+    def __init__(self, heartbeat: "ChatActionHeartbeat", chat_id: int, action: str):
+        self._heartbeat = heartbeat
+        self.chat_id = chat_id
+        self.action = action
+
+    def close(self):
+        self._heartbeat._unregister(self)
+
+    def __enter__(self) -> "ChatActionRegistration":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ChatActionHeartbeat:
+    """
+    Одна фоновая задача на всё приложение вместо _typing_loop на каждую загрузку.
+    Держит набор активных чатов и раз в CHAT_ACTION_INTERVAL шлёт в каждый чат
+    ровно один send_chat_action — сколько бы задач в нём ни шло.
+    Действие чата — от последней зарегистрированной в нём задачи.
+    Цикл запускается с первой регистрацией и останавливается, когда чатов не осталось.
+    """
+
+    def __init__(self, bot, interval: float = CHAT_ACTION_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self._chats: Dict[int, List[ChatActionRegistration]] = {}
+        self._next_due: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, chat_id: int, action: str = ChatAction.UPLOAD_DOCUMENT) -> ChatActionRegistration:
+        registration = ChatActionRegistration(self, chat_id, action)
+        if chat_id not in self._chats:
+            self._chats[chat_id] = []
+            # Новый чат получает action сразу, не дожидаясь следующего тика
+            self._next_due[chat_id] = 0.0
+            self._wakeup.set()
+        self._chats[chat_id].append(registration)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return registration
+
+    def _unregister(self, registration: ChatActionRegistration):
+        registrations = self._chats.get(registration.chat_id)
+        if not registrations or registration not in registrations:
+            return
+        registrations.remove(registration)
+        if not registrations:
+            del self._chats[registration.chat_id]
+            self._next_due.pop(registration.chat_id, None)
+            self._wakeup.set()
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chats)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._chats.clear()
+        self._next_due.clear()
+
+    async def _run(self):
+        while self._chats:
+            # Сбрасываем до отправки: регистрация во время gather разбудит следующий тик
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [chat_id for chat_id, at in self._next_due.items() if at <= now]
+            for chat_id in due:
+                self._next_due[chat_id] = now + self.interval
+            if due:
+                await asyncio.gather(*(self._send(chat_id, self._chats[chat_id][-1].action) for chat_id in due if chat_id in self._chats))
+
+            if not self._next_due:
+                continue
+            timeout = max(0.0, min(self._next_due.values()) - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, chat_id: int, action: str):
+        try:
+            await self.bot.send_chat_action(chat_id=chat_id, action=action)
+        except RetryAfter as e:
+            if chat_id in self._next_due:
+                self._next_due[chat_id] = time.monotonic() + float(e.retry_after)
+        except Exception as e:
+            logger.debug(f"send_chat_action в {chat_id} не удался: {e}")
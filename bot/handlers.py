@@ -1,20 +1,29 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ChatAction
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from services.downloader import QobuzDownloader, QobuzAuthError
-from services import whitelist
-from services.savify_downloader import SavifyDownloader
+from services.downloader import QobuzAPIError, QobuzAuthError, track_url, track_metadata
+from services.audio_probe import AudioProbe
+from services.delivery_cache import DeliveryCache
+from services.recognition_cache import RecognitionCache
+from services.recognizer import RecognitionError
+from services import whitelist, metrics
+from services.container import ServiceContainer
+from services.scheduler import Job, QueueFullError, JobCancelledError
 from services.file_manager import FileManager
-from services.recognizer import AudioRecognizer
+from services.media import TranscodePlan
+from services.inflight import Flight, SharedFiles
+from services.workspace import JobWorkspace
+from bot.progress import ProgressUpdater, transfer_progress
+from bot.chat_actions import ChatActionHeartbeat
 from config import Config
 import logging
+import os
 import re
-import subprocess
 from pathlib import Path
-from typing import Optional, Tuple
-import shutil
-import mutagen
+from typing import Dict, List, Optional, Tuple
 import asyncio
+import time
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
@@ -24,56 +33,46 @@ def _is_allowed(user_id: int) -> bool:
     return whitelist.is_allowed(user_id, Config.ADMIN_USER_ID)
 
 
-async def _typing_loop(bot, chat_id: int, stop_event: asyncio.Event):
-    """Шлёт chat action каждые 4 сек пока идёт загрузка."""
-    while not stop_event.is_set():
-        try:
-            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_DOCUMENT)
-        except Exception:
-            pass
-        try:
-            await asyncio.wait_for(stop_event.wait(), timeout=4)
-        except asyncio.TimeoutError:
-            pass
+def _services(context: ContextTypes.DEFAULT_TYPE) -> ServiceContainer:
+    """Общие сервисы приложения, созданные в post_init."""
+    return context.application.bot_data["services"]
 
 
-# --- Вспомогательные функции ---
+def _chat_actions(context: ContextTypes.DEFAULT_TYPE) -> ChatActionHeartbeat:
+    """Общий heartbeat chat action ("отправляет файл..."), созданный в post_init."""
+    return context.application.bot_data["chat_actions"]
 
-def embed_cover_art(audio_path: Path, cover_path: Optional[Path]):
-    if not all([audio_path, cover_path, audio_path.exists(), cover_path.exists()]):
-        return
-    logger.info(f"🖼️ Встраивание обложки {cover_path.name} в файл {audio_path.name}...")
-    temp_output_path = audio_path.with_suffix(f".temp{audio_path.suffix}")
-    try:
-        command = [
-            "ffmpeg", "-i", str(audio_path), "-i", str(cover_path), "-map", "0:a",
-            "-map", "1:v", "-c", "copy", "-disposition:v:0", "attached_pic",
-            "-id3v2_version", "3", str(temp_output_path)
-        ]
-        subprocess.run(command, check=True, capture_output=True)
-        shutil.move(str(temp_output_path), str(audio_path))
-        logger.info("✅ Обложка успешно встроена.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Не удалось встроить обложку с помощью ffmpeg: {e.stderr.decode()}")
-    except Exception as e:
-        logger.error(f"❌ Не удалось встроить обложку: {e}")
-    finally:
-        if temp_output_path.exists(): temp_output_path.unlink()
 
-def convert_to_mp3(file_path: Path) -> Optional[Path]:
-    mp3_path = file_path.with_suffix(".mp3")
-    logger.info(f"🎵 Конвертация файла {file_path.name} в MP3...")
+async def _run_as_job(update: Update, context: ContextTypes.DEFAULT_TYPE, label: str, flow, *args, **kwargs):
+    """Регистрирует задачу пользователя в планировщике и выполняет flow(..., job=job)."""
+    scheduler = _services(context).scheduler
+    message = update.effective_message
     try:
-        command = [
-            "ffmpeg", "-i", str(file_path), "-map", "0:a:0", "-b:a", "320k",
-            "-map", "0:v?", "-c:v", "copy", "-id3v2_version", "3", str(mp3_path),
-        ]
-        subprocess.run(command, check=True, capture_output=True)
-        logger.info(f"✅ Файл успешно сконвертирован в {mp3_path.name}")
-        return mp3_path
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Ошибка конвертации ffmpeg: {e.stderr.decode()}")
-        return None
+        async with scheduler.job(update.effective_user.id, label) as job:
+            try:
+                await flow(update, context, *args, job=job, **kwargs)
+            except JobCancelledError:
+                await message.reply_text(f"🚫 Задача #{job.id} отменена.")
+    except QueueFullError:
+        await message.reply_text(
+            f"⚠️ У вас уже {scheduler.max_jobs_per_user} задач(и) в работе. "
+            "Дождитесь их завершения или отмените: /cancel"
+        )
+
+
+def _queue_notifier(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, text: str, job: Job):
+    """Колбэк планировщика: пока задача ждёт слот, показывает её место в очереди."""
+    async def notify(position: int):
+        await context.bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id,
+            text=f"{text}\n🕒 В очереди: {position}-я (отменить: /cancel {job.id})",
+        )
+    return notify
+
+
+# --- Вспомогательные функции ---
+
+JOB_STATUS_NAMES = {"done": "✅ готово", "failed": "❌ ошибка", "cancelled": "🚫 отменена"}
 
 QUALITY_HIERARCHY = {
     "HI-RES (Max)": 27,
@@ -82,6 +81,17 @@ QUALITY_HIERARCHY = {
     "MP3 (320 kbps)": 5,
 }
 
+# Сколько треков показывать на одной странице выбора
+ALBUM_PAGE_SIZE = 40
+
+QUALITY_NAMES = {quality_id: name for name, quality_id in QUALITY_HIERARCHY.items()}
+
+# Качество в ключе кэша доставки: запрос «лучшее доступное» для трека
+CACHE_QUALITY = QUALITY_HIERARCHY["HI-RES (Max)"]
+
+# Статус запроса, который ждёт уже идущую загрузку того же трека
+FOLLOWER_STATUS = "👥 Этот трек уже качается по другому запросу — пришлю, как только будет готов"
+
 # --- Команды Start/Help ---
 
 def _token_expired_message() -> str:
@@ -113,37 +123,30 @@ async def set_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /settoken <токен>")
         return
 
-    # Обновляем .env
-    env_path = Path(__file__).resolve().parent.parent / ".env"
-    lines = env_path.read_text().splitlines()
-    updated = False
-    for i, line in enumerate(lines):
-        if line.startswith("QOBUZ_AUTH_TOKEN="):
-            lines[i] = f"QOBUZ_AUTH_TOKEN={token}"
-            updated = True
-            break
-    if not updated:
-        lines.append(f"QOBUZ_AUTH_TOKEN={token}")
-    env_path.write_text("\n".join(lines) + "\n")
-
-    # Обновляем конфиг streamrip
-    streamrip_cfg = Path("/root/.config/streamrip/config.toml")
-    if streamrip_cfg.exists():
-        cfg_text = streamrip_cfg.read_text()
-        cfg_text = re.sub(
-            r'(password_or_token\s*=\s*)"[^"]*"',
-            f'\\1"{token}"',
-            cfg_text,
-        )
-        streamrip_cfg.write_text(cfg_text)
-
-    # Обновляем в памяти без перезапуска
+    # Токен хранится в хранилище состояния и при старте важнее значения из .env
     Config.QOBUZ_AUTH_TOKEN = token
+    await _services(context).update_qobuz_token(token)
+    # rip читает токен из своего конфига — переписываем его атомарно и вне event loop
+    await asyncio.to_thread(_update_streamrip_token, token)
 
     await update.message.reply_text("✅ Токен Qobuz обновлён.")
     logger.info(f"🔑 Токен Qobuz обновлён пользователем {update.effective_user.id}")
 
 
+def _update_streamrip_token(token: str):
+    streamrip_cfg = Path("/root/.config/streamrip/config.toml")
+    if not streamrip_cfg.exists():
+        return
+    cfg_text = re.sub(
+        r'(password_or_token\s*=\s*)"[^"]*"',
+        lambda m: f'{m.group(1)}"{token}"',
+        streamrip_cfg.read_text(),
+    )
+    tmp_path = streamrip_cfg.with_suffix(".tmp")
+    tmp_path.write_text(cfg_text)
+    os.replace(tmp_path, streamrip_cfg)
+
+
 async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != Config.ADMIN_USER_ID:
         await update.message.reply_text("⛔ Нет доступа.")
@@ -152,7 +155,7 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /adduser <user_id>")
         return
     user_id = int(context.args[0])
-    if whitelist.add(user_id):
+    if await whitelist.add(user_id):
         await update.message.reply_text(f"✅ Пользователь `{user_id}` добавлен в whitelist.", parse_mode="Markdown")
         logger.info(f"➕ Добавлен в whitelist: {user_id}")
     else:
@@ -170,7 +173,7 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id == Config.ADMIN_USER_ID:
         await update.message.reply_text("⛔ Нельзя удалить администратора.")
         return
-    if whitelist.remove(user_id):
+    if await whitelist.remove(user_id):
         await update.message.reply_text(f"✅ Пользователь `{user_id}` удалён из whitelist.", parse_mode="Markdown")
         logger.info(f"➖ Удалён из whitelist: {user_id}")
     else:
@@ -192,10 +195,100 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lines.append(f"\n➕ /adduser <id>\n➖ /removeuser <id>")
     await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
 
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != Config.ADMIN_USER_ID:
+        await update.message.reply_text("⛔ Нет доступа.")
+        return
+    stats = _services(context).delivery_cache.stats()
+    recognition = _services(context).recognition_cache.stats()
+    await update.message.reply_text(
+        "📦 *Кэш доставки*\n"
+        f"Записей: `{stats['entries']}`\n"
+        f"Попаданий: `{stats['hits']}`\n"
+        f"Промахов: `{stats['misses']}`\n"
+        f"Сброшено file\\_id: `{stats['invalidations']}`\n"
+        f"Hit rate: `{stats['hit_rate']:.1f}%`\n\n"
+        "🎧 *Кэш распознавания*\n"
+        f"Записей: `{recognition['entries']}`\n"
+        f"Попаданий по файлу: `{recognition['file_hits']}`\n"
+        f"Попаданий по хэшу: `{recognition['hash_hits']}`\n"
+        f"Промахов: `{recognition['misses']}`\n"
+        f"Hit rate: `{recognition['hit_rate']:.1f}%`",
+        parse_mode="Markdown",
+    )
+
+async def cancel_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/cancel — список активных задач, /cancel <id> — отменить задачу (свою или любую для админа)."""
+    user_id = update.effective_user.id
+    if not _is_allowed(user_id):
+        await update.message.reply_text("⛔ Нет доступа.")
+        return
+    scheduler = _services(context).scheduler
+    is_admin = user_id == Config.ADMIN_USER_ID
+
+    if not context.args:
+        jobs = list(scheduler.jobs.values()) if is_admin else scheduler.user_jobs(user_id)
+        if not jobs:
+            lines = ["📭 Активных задач нет."]
+            history = await _services(context).state.recent_jobs(None if is_admin else user_id)
+            if history:
+                lines.append("\n🕘 Последние задачи:")
+                for entry in history:
+                    lines.append(f"#{entry['job_id']} — {entry['label']}: {JOB_STATUS_NAMES.get(entry['status'], entry['status'])}, {entry['duration']:.0f} с")
+            await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+            return
+        lines = ["🗂️ Активные задачи:"]
+        for job in jobs:
+            owner = f" (user {job.user_id})" if is_admin else ""
+            lines.append(f"#{job.id} — {job.label}{owner}: {job.stage or 'в очереди'}")
+        lines.append("\nОтменить: /cancel <номер>")
+        await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+        return
+
+    try:
+        job_id = int(context.args[0].lstrip("#"))
+    except ValueError:
+        await update.message.reply_text("❌ Номер задачи должен быть числом.")
+        return
+    job = scheduler.jobs.get(job_id)
+    if not job or (job.user_id != user_id and not is_admin):
+        await update.message.reply_text(f"❌ Задача #{job_id} не найдена.")
+        return
+    scheduler.cancel(job_id)
+    await update.message.reply_text(f"🛑 Отменяю задачу #{job_id}...")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != Config.ADMIN_USER_ID:
+        await update.message.reply_text("⛔ Нет доступа.")
+        return
+
+    def fmt(seconds: Optional[float]) -> str:
+        return "—" if seconds is None else f"{seconds:.2f}"
+
+    summary = metrics.summary()
+    if not summary:
+        await update.message.reply_text("📈 Замеров пока нет.")
+        return
+    lines = [f"{'этап':<24}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'ош.':>5}"]
+    for stage, s in summary.items():
+        lines.append(f"{stage:<24}{s['count']:>6}{fmt(s['p50']):>8}{fmt(s['p95']):>8}{fmt(s['p99']):>8}{s['errors']:>5}")
+    traffic = [
+        f"{stage.replace('_', chr(92) + '_')}: {FileManager.format_size(s['bytes'])}"
+        for stage, s in summary.items() if s['bytes']
+    ]
+    pools = _services(context).scheduler.stats()
+    queues = [f"{name}: {p['running']}/{p['limit']} в работе, {p['queued']} в очереди" for name, p in pools.items()]
+    text = "📈 *Этапы (секунды)*\n```\n" + "\n".join(lines) + "\n```"
+    if traffic:
+        text += "\n📦 *Трафик*\n" + "\n".join(traffic)
+    text += "\n🚦 *Пулы*\n" + "\n".join(queues)
+    await update.message.reply_text(text, parse_mode="Markdown")
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "/start — приветствие\n"
         "/download <ссылка> — скачать трек (Qobuz или Spotify)\n"
+        "/cancel — активные задачи и их отмена\n"
         "Или просто отправь аудио для распознавания."
     )
 
@@ -212,29 +305,43 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if "/album/" in url:
             await _show_qobuz_album_tracks(update, context, url)
         else:
-            await _download_qobuz(update, context, url)
+            await _run_as_job(update, context, "Qobuz: трек", _download_qobuz, url)
     elif re.search(r"spotify\.com/", url):
-        await _download_spotify(update, context, url)
+        await _run_as_job(update, context, "Spotify: трек", _download_spotify, url)
     else:
         await update.message.reply_text("❌ Пожалуйста, отправьте корректную ссылку на Qobuz или Spotify.")
 
 
 async def _show_qobuz_album_tracks(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str):
     """Показывает список треков альбома с кнопками."""
-    downloader = QobuzDownloader()
+    downloader = _services(context).qobuz
     sent_message = await update.message.reply_text("⏳ Получаю список треков альбома...")
     
     album_info = await downloader.get_album_info(url)
     if not album_info or not album_info['tracks']:
-        await sent_message.edit_text("⚠️ Не удалось получить список треков. Начинаю скачивание всего релиза...")
-        await _download_qobuz(update, context, url)
+        await sent_message.edit_text("⚠️ Не удалось получить список треков. Пробую скачать весь релиз...")
+        # Список треков недоступен и для загрузки по трекам — отдаём ссылку на релиз rip целиком
+        await _run_as_job(update, context, "Qobuz: релиз", _download_qobuz, url, sent_message=sent_message)
         return
 
+    context.user_data['last_album_url'] = url
+    text, reply_markup = _album_picker(album_info, page=0)
+    await sent_message.edit_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+
+def _album_picker(album_info: dict, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура выбора трека; длинные альбомы листаются страницами."""
+    tracks = album_info['tracks']
+    pages = max(1, (len(tracks) + ALBUM_PAGE_SIZE - 1) // ALBUM_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+
     text = f"💿 **{album_info['artist']} — {album_info['title']}**\n\nВыберите трек для скачивания:"
-    
+    if pages > 1:
+        text += f"\n_Страница {page + 1}/{pages}, всего треков: {len(tracks)}_"
+
     keyboard = []
     current_row = []
-    for track in album_info['tracks']:
+    for track in tracks[page * ALBUM_PAGE_SIZE:(page + 1) * ALBUM_PAGE_SIZE]:
         button = InlineKeyboardButton(f"{track['index']}. {track['title']}", callback_data=f"qdl:{track['index']}")
         current_row.append(button)
         if len(current_row) == 2:
@@ -242,11 +349,17 @@ async def _show_qobuz_album_tracks(update: Update, context: ContextTypes.DEFAULT
             current_row = []
     if current_row:
         keyboard.append(current_row)
+
+    if pages > 1:
+        nav_row = []
+        if page > 0:
+            nav_row.append(InlineKeyboardButton("◀️", callback_data=f"qpage:{page - 1}"))
+        if page < pages - 1:
+            nav_row.append(InlineKeyboardButton("▶️", callback_data=f"qpage:{page + 1}"))
+        keyboard.append(nav_row)
     
     keyboard.append([InlineKeyboardButton("📥 Скачать весь альбом", callback_data="qdl:all")])
-    context.user_data['last_album_url'] = url
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await sent_message.edit_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    return text, InlineKeyboardMarkup(keyboard)
 
 
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -256,70 +369,439 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text("⛔ Нет доступа.")
         return
     data = query.data
-    if not data.startswith("qdl:"): return
+    if not data.startswith(("qdl:", "qpage:")): return
     url = context.user_data.get('last_album_url')
     if not url:
         await query.edit_message_text("❌ Ошибка: ссылка потеряна. Отправьте её заново.")
         return
+    if data.startswith("qpage:"):
+        # Список треков берётся из кэша метаданных, повторного запроса к API нет
+        album_info = await _services(context).qobuz.get_album_info(url)
+        if not album_info:
+            await query.edit_message_text("❌ Не удалось получить список треков. Отправьте ссылку заново.")
+            return
+        text, reply_markup = _album_picker(album_info, int(data.split(":")[1]))
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        return
     action = data.split(":")[1]
     if action == "all":
         await query.edit_message_text("⏳ Начинаю скачивание всего альбома...")
-        await _download_qobuz(update, context, url)
+        await _run_as_job(update, context, "Qobuz: альбом", _download_qobuz_album, url)
     else:
         track_index = int(action)
         await query.edit_message_text(f"⏳ Начинаю скачивание трека №{track_index}...")
-        await _download_qobuz(update, context, url, track_index=track_index)
+        await _run_as_job(update, context, f"Qobuz: трек №{track_index}", _download_qobuz, url, track_index=track_index)
 
 
-async def _download_qobuz(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, track_index: Optional[int] = None):
-    downloader = QobuzDownloader()
-    file_manager = FileManager()
+async def _download_qobuz(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, track_index: Optional[int] = None, *, job: Job, sent_message=None) -> bool:
+    """Трек Qobuz по ссылке. True — трек отправлен (False даёт Spotify-ссылке уйти в Savify)."""
+    downloader = _services(context).qobuz
+    scheduler = _services(context).scheduler
+    inflight = _services(context).inflight
     target_update = update.callback_query if update.callback_query else update
     chat_id = target_update.message.chat_id
-    sent_message = await context.bot.send_message(chat_id=chat_id, text="⏳ Подготовка к скачиванию...")
+    if sent_message is None:
+        sent_message = await context.bot.send_message(chat_id=chat_id, text="⏳ Подготовка к скачиванию...")
     
-    stop_typing = asyncio.Event()
-    typing_task = asyncio.create_task(_typing_loop(context.bot, chat_id, stop_typing))
+    chat_action = _chat_actions(context).register(chat_id, ChatAction.UPLOAD_DOCUMENT)
+    # Рейс, который ведёт этот запрос, и запись кэша доставки для ждущих
+    flight, entry = None, None
     try:
-        for quality_name, quality_id in QUALITY_HIERARCHY.items():
-            base_text = f"💿 Qobuz: Качество {quality_name}\n"
-            if track_index: base_text += f"🎵 Трек №{track_index}\n"
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text=f"{base_text}⏳ Скачиваю...")
+        track_id = await downloader.resolve_track_id(url, track_index)
+        cache_key = DeliveryCache.make_key("qobuz", track_id, CACHE_QUALITY) if track_id else None
+        if cache_key and await _try_deliver_from_cache(context, chat_id, sent_message, cache_key):
+            return True
 
-            audio_file, cover_file = await downloader.download_track(url, quality_id, track_index=track_index)
-            if audio_file:
-                await process_and_send_audio(update, context, sent_message, audio_file, cover_file, url, "Qobuz")
-                return
-        await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Qobuz: Не удалось скачать файл.")
+        # Тот же трек уже качается по другому запросу — ждём его результат
+        handoff = None
+        if cache_key:
+            joined, leading = inflight.join(cache_key)
+            while not leading:
+                delivered, handoff = await _follow_flight(context, chat_id, sent_message, joined, job)
+                if delivered:
+                    return True
+                # Между claim() и join() нет await: забравший файл становится ведущим нового рейса
+                joined, leading = inflight.join(cache_key)
+                if handoff and not leading:
+                    handoff[0].release()
+                    handoff = None
+            flight = joined
+        if handoff and not handoff[1].exists():
+            # Ведущий успел передать файл локальному серверу — качаем заново
+            handoff[0].release()
+            handoff = None
+        if handoff:
+            shared, audio_file, cover_file, metadata = handoff
+            flight.offer(*handoff)
+            entry = await process_and_send_audio(update, context, sent_message, audio_file, cover_file, url, "Qobuz", cache_key=cache_key, job=job, metadata=metadata, shared=shared, flight=flight)
+            return entry is not None
+
+        # Спрашиваем у API максимальный формат и запускаем rip один раз.
+        # Если API не ответил — перебираем качества по старинке.
+        probe = await downloader.probe_quality(url, track_id)
+        if probe and not probe["streamable"]:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Qobuz: Релиз недоступен для скачивания.")
+            return False
+        if probe:
+            qualities = [(QUALITY_NAMES[probe["quality_id"]], probe["quality_id"])]
+        else:
+            qualities = list(QUALITY_HIERARCHY.items())
+
+        # ID трека уже известен — rip качает его напрямую, без повторного запроса альбома
+        download_url = track_url(track_id) if track_id else url
+        # track/get уже в кэше после probe_quality — теги подписи не читаются из файла
+        track_info = await downloader.get_track_info(track_id) if probe and track_id else None
+        metadata = track_metadata(track_info) if track_info else None
+
+        workspace = JobWorkspace()
+        async with workspace as job_dir:
+            shared = None
+            try:
+                for quality_name, quality_id in qualities:
+                    base_text = f"💿 Qobuz: Качество {quality_name}\n"
+                    if track_index: base_text += f"🎵 Трек №{track_index}\n"
+                    status_text = f"{base_text}⏳ Скачиваю..."
+                    await _set_status(context, chat_id, sent_message, status_text, flight)
+
+                    # Каждая попытка качает в свою подпапку, чтобы не подхватить огрызки предыдущей
+                    attempt_dir = job_dir / f"q{quality_id}"
+                    async with ProgressUpdater(context.bot, chat_id, sent_message.message_id, mirror=flight.publish if flight else None) as progress:
+                        audio_file, cover_file = await scheduler.run(
+                            job, "download",
+                            lambda: downloader.download_track(download_url, quality_id, attempt_dir, transfer_progress(progress, status_text)),
+                            on_queue=_queue_notifier(context, chat_id, sent_message.message_id, base_text, job),
+                        )
+                    if audio_file:
+                        shared = SharedFiles(audio_file, cover_file, folder=job_dir)
+                        if flight:
+                            # Не получится отправить — файл заберёт один из ждущих
+                            flight.offer(shared, audio_file, cover_file, metadata)
+                        entry = await process_and_send_audio(update, context, sent_message, audio_file, cover_file, url, "Qobuz", cache_key=cache_key, job=job, metadata=metadata, shared=shared, flight=flight)
+                        return entry is not None
+                await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Qobuz: Не удалось скачать файл.")
+            finally:
+                if shared and not shared.released:
+                    # Файл ещё может забрать ждущий запрос — папку удалит последний, кто его отпустит
+                    workspace.keep()
+    except JobCancelledError:
+        raise
     except QobuzAuthError:
         await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text=_token_expired_message())
     except Exception as e:
         logger.exception(f"❌ Qobuz: Ошибка: {e}")
         await context.bot.send_message(chat_id=chat_id, text=f"❌ Qobuz: Ошибка: {e}")
     finally:
-        stop_typing.set()
-        typing_task.cancel()
+        # Единственное место, где ведущий завершает рейс: ждущие получают entry
+        # или, если его нет, забирают скачанный файл либо качают сами
+        if flight:
+            inflight.finish(flight, entry)
+        chat_action.close()
+    return False
 
 
-async def _download_spotify(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str):
-    downloader = SavifyDownloader()
-    sent_message = await update.message.reply_text("⏳ Начинаю поиск на Spotify...")
+async def _follow_flight(context: ContextTypes.DEFAULT_TYPE, chat_id: int, sent_message, flight: Flight, job: Job):
+    """
+    Ждёт загрузку того же трека по чужому запросу, показывая её статус в своём чате.
+    (True, None) — трек отправлен по file_id; (False, файлы) — ведущий не смог
+    отправить скачанный файл и передал его сюда; (False, None) — качать самим.
+    """
+    scheduler = _services(context).scheduler
+    try:
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text=FOLLOWER_STATUS)
+        async with ProgressUpdater(context.bot, chat_id, sent_message.message_id) as progress:
+            unsubscribe = flight.subscribe(lambda text: progress.push(f"{FOLLOWER_STATUS}\n{text}"))
+            try:
+                entry = await scheduler.wait(job, flight.wait(), stage="ждёт чужую загрузку")
+            finally:
+                unsubscribe()
+        if entry and await _send_cached_delivery(context, chat_id, entry):
+            logger.info(f"👥 Отправлено по file_id из чужой загрузки: {flight.key}")
+            await context.bot.delete_message(chat_id=chat_id, message_id=sent_message.message_id)
+            return True, None
+        return False, flight.claim()
+    finally:
+        flight.leave()
+
+
+async def _set_status(context: ContextTypes.DEFAULT_TYPE, chat_id: int, sent_message, text: str, flight: Optional[Flight] = None):
+    """Статусное сообщение запроса; с flight тот же статус видят ждущие этого трека."""
+    if flight:
+        flight.publish(text)
+    await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text=text)
+
+
+async def _download_qobuz_album(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, *, job: Job):
+    """
+    Скачивает весь альбом: треки качаются параллельно (не больше ALBUM_PARALLEL_TRACKS),
+    а отправляются строго по порядку, каждый — как только готов он и все предыдущие.
+    """
+    downloader = _services(context).qobuz
+    scheduler = _services(context).scheduler
+    delivery_cache = _services(context).delivery_cache
+    inflight = _services(context).inflight
+    media = _services(context).media
+    target_update = update.callback_query if update.callback_query else update
+    chat_id = target_update.message.chat_id
+    sent_message = await context.bot.send_message(chat_id=chat_id, text="⏳ Получаю список треков альбома...")
+
+    chat_action = _chat_actions(context).register(chat_id, ChatAction.UPLOAD_DOCUMENT)
     try:
-        await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=sent_message.message_id, text="💿 Spotify: Ищу и скачиваю...")
-        audio_file, cover_file = await downloader.download_track(url)
-        if audio_file:
-            await process_and_send_audio(update, context, sent_message, audio_file, cover_file, url, "Spotify")
+        album_info = await downloader.get_album_info(url)
+        if not album_info:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Qobuz: Не удалось получить список треков альбома.")
+            return
+        tracks = album_info["tracks"]
+        total = len(tracks)
+        probe = await downloader.probe_quality(url)
+        if probe and not probe["streamable"]:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Qobuz: Релиз недоступен для скачивания.")
+            return
+        quality_id = probe["quality_id"] if probe else CACHE_QUALITY
+        header = f"💿 {album_info['artist']} — {album_info['title']}\n✨ Качество: {QUALITY_NAMES[quality_id]}\n"
+        progress = {"downloaded": 0, "sent": 0}
+        failed = []
+
+        # Статус правится из всех задач треков сразу — через общий троттлинг правок,
+        # чтобы не упереться во flood control Telegram
+        status = ProgressUpdater(context.bot, chat_id, sent_message.message_id)
+
+        def update_status():
+            status.push(f"{header}📥 Скачано: {progress['downloaded']}/{total}\n📤 Отправлено: {progress['sent']}/{total}")
+
+        async with status, JobWorkspace() as album_dir:
+            # Обложку качаем и отправляем один раз на весь альбом
+            cover_file = await downloader.download_cover(album_info.get("cover_url"), album_dir)
+            album_caption = (
+                f"💿 **{album_info['artist']} — {album_info['title']}**\n"
+                f"🎵 **Треков:** {total}\n"
+                f"✨ **Качество:** {QUALITY_NAMES[quality_id]}\n"
+                f"━━━━━━━━━━━━━━━━━━━━\n"
+                f"📥 [Скачано с Qobuz]({url})"
+            )
+            album_photo_id = None
+            if cover_file:
+                async def send_album_photo():
+                    with open(cover_file, 'rb') as img:
+                        return await context.bot.send_photo(chat_id=chat_id, photo=img, caption=album_caption, parse_mode='Markdown')
+                photo_message = await scheduler.run(job, "upload", send_album_photo)
+                album_photo_id = photo_message.photo[-1].file_id if photo_message.photo else None
+            else:
+                await context.bot.send_message(chat_id=chat_id, text=album_caption, parse_mode='Markdown')
+            update_status()
+
+            parallel = asyncio.Semaphore(max(1, Config.ALBUM_PARALLEL_TRACKS))
+
+            async def prepare_track(track: dict, flight: Optional[Flight] = None) -> Optional[AudioProbe]:
+                if flight:
+                    flight.publish(f"💽 Качается в составе альбома «{album_info['title']}»")
+                # Каждый трек занимает и слот альбома, и слот пула загрузок планировщика,
+                # где треки альбома чередуются с задачами других пользователей
+                async with parallel:
+                    track_dir = album_dir / f"{track['index']:03d}"
+                    audio_file, _ = await scheduler.run(
+                        job, "download",
+                        lambda: downloader.download_track(track_url(track["id"]), quality_id, track_dir),
+                    )
+                probe = None
+                if audio_file:
+                    probe = AudioProbe(audio_file, track_metadata(track, album_info))
+                    await media.embed_cover(audio_file, cover_file, probe)
+                    if FileManager.get_file_size_mb(audio_file) > Config.MAX_FILE_SIZE_MB:
+                        # Готовые треки ждут своей очереди в буфере, поэтому результат —
+                        # файл на диске, а не буфер в памяти
+                        transcoded = await scheduler.run(job, "transcode", lambda: media.transcode_to_fit(audio_file, probe, _size_limit()))
+                        FileManager.safe_remove(audio_file)
+                        probe = AudioProbe(transcoded.path, {**probe.tags, "quality": transcoded.plan.quality}) if transcoded else None
+                if flight and probe:
+                    flight.publish(f"💽 Скачан, альбом «{album_info['title']}» отправляется по порядку")
+                progress["downloaded"] += 1
+                update_status()
+                return probe
+
+            # Буфер переупорядочивания: задачи запущены все сразу, а ждём их по порядку.
+            # Трек, готовый раньше предыдущих, просто лежит в своей завершённой задаче.
+            cache_keys = [DeliveryCache.make_key("qobuz", t["id"], CACHE_QUALITY) for t in tracks]
+            cached_entries = [delivery_cache.get(key) for key in cache_keys]
+            # Треки, которые уже качаются по другим запросам (тот же альбом у другого
+            # пользователя), не качаем — ждём их file_id. Присоединяемся ко всем трекам
+            # сразу, без await: так два альбома не могут ждать друг друга по кругу.
+            flights: List[Optional[Flight]] = [None] * total
+            leading = [False] * total
+            for i, entry in enumerate(cached_entries):
+                if not entry:
+                    flights[i], leading[i] = inflight.join(cache_keys[i], takes_files=False)
+            tasks = [
+                asyncio.create_task(prepare_track(track, flights[i])) if leading[i] else None
+                for i, track in enumerate(tracks)
+            ]
+
+            try:
+                for i, track in enumerate(tracks):
+                    entry = cached_entries[i]
+                    while entry is None and flights[i] and not leading[i]:
+                        try:
+                            entry = await scheduler.wait(job, flights[i].wait(), stage="ждёт чужую загрузку")
+                        finally:
+                            flights[i].leave(takes_files=False)
+                        flights[i] = None
+                        if entry is None:
+                            # Чужая загрузка не удалась — пробуем сами (или ждём нового ведущего)
+                            flights[i], leading[i] = inflight.join(cache_keys[i], takes_files=False)
+                            if leading[i]:
+                                tasks[i] = asyncio.create_task(prepare_track(track, flights[i]))
+                    if entry:
+                        if await _send_cached_delivery(context, chat_id, entry, with_caption=False):
+                            progress["downloaded"] += 1
+                            progress["sent"] += 1
+                            update_status()
+                            continue
+                        delivery_cache.invalidate(cache_keys[i])
+                        tasks[i] = asyncio.create_task(prepare_track(track))
+
+                    probe = await tasks[i]
+                    if not probe:
+                        if leading[i]:
+                            inflight.finish(flights[i])
+                            flights[i] = None
+                        failed.append(track["index"])
+                        continue
+                    audio_file = probe.path
+                    caption_text, custom_filename = _build_caption(probe, "Qobuz", track_url(track["id"]))
+
+                    audio_message = await scheduler.run(
+                        job, "upload",
+                        lambda: _send_audio_file(context, chat_id, audio_file, custom_filename),
+                    )
+                    entry = _remember_delivery(context, cache_keys[i], audio_message, album_photo_id, caption_text, custom_filename)
+                    if leading[i]:
+                        inflight.finish(flights[i], entry)
+                        flights[i] = None
+                    FileManager.safe_remove(audio_file)
+                    progress["sent"] += 1
+                    update_status()
+            finally:
+                # Останавливаем оставшиеся загрузки до удаления папки альбома
+                started = [task for task in tasks if task]
+                for task in started:
+                    task.cancel()
+                await asyncio.gather(*started, return_exceptions=True)
+                # Ждущие недоставленных треков качают их сами
+                for i, flight in enumerate(flights):
+                    if flight is None:
+                        continue
+                    if leading[i]:
+                        inflight.finish(flight)
+                    else:
+                        flight.leave(takes_files=False)
+
+        if failed:
+            await context.bot.edit_message_text(
+                chat_id=chat_id, message_id=sent_message.message_id,
+                text=f"{header}⚠️ Не удалось скачать треки: {', '.join(map(str, failed))}",
+            )
         else:
-            await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=sent_message.message_id, text="❌ Spotify: Не удалось скачать.")
+            await context.bot.delete_message(chat_id=chat_id, message_id=sent_message.message_id)
+    except JobCancelledError:
+        raise
+    except QobuzAuthError:
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text=_token_expired_message())
+    except Exception as e:
+        logger.exception(f"❌ Qobuz: Ошибка при скачивании альбома: {e}")
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Qobuz: Ошибка: {e}")
+    finally:
+        chat_action.close()
+
+
+async def _download_spotify(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, *, job: Job):
+    resolver = _services(context).spotify
+    scheduler = _services(context).scheduler
+    sent_message = await update.message.reply_text("⏳ Начинаю поиск на Spotify...")
+    spotify_id = resolver.extract_id(url)
+    if spotify_id:
+        # Тот же трек на Qobuz — lossless и без перекодирования с YouTube
+        qobuz_id = await resolver.resolve(spotify_id)
+        if qobuz_id and await _download_qobuz(update, context, track_url(qobuz_id), job=job, sent_message=sent_message):
+            return
+        if qobuz_id:
+            logger.info(f"🔁 Spotify {spotify_id}: с Qobuz не вышло, качаю через Savify")
+
+    chat_action = _chat_actions(context).register(update.effective_chat.id, ChatAction.UPLOAD_DOCUMENT)
+    try:
+        cache_key = DeliveryCache.make_key("spotify", spotify_id, "mp3") if spotify_id else None
+        if cache_key and await _try_deliver_from_cache(context, update.effective_chat.id, sent_message, cache_key):
+            return
+
+        downloader = _services(context).savify
+        async with JobWorkspace() as job_dir:
+            status_text = "💿 Spotify: Ищу и скачиваю..."
+            await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=sent_message.message_id, text=status_text)
+            audio_file, cover_file = await scheduler.run(
+                job, "download",
+                lambda: downloader.download_track(url, job_dir),
+                on_queue=_queue_notifier(context, update.effective_chat.id, sent_message.message_id, status_text, job),
+            )
+            if audio_file:
+                await process_and_send_audio(update, context, sent_message, audio_file, cover_file, url, "Spotify", cache_key=cache_key, job=job)
+            else:
+                await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=sent_message.message_id, text="❌ Spotify: Не удалось скачать.")
+    except JobCancelledError:
+        raise
     except Exception as e:
         logger.exception(f"❌ Spotify: Ошибка: {e}")
         await update.message.reply_text(f"❌ Spotify: Ошибка: {e}")
+    finally:
+        chat_action.close()
+
+
+async def _send_cached_delivery(context: ContextTypes.DEFAULT_TYPE, chat_id: int, entry: dict, with_caption: bool = True) -> bool:
+    """Повторно отправляет трек по сохранённым file_id. False — Telegram отклонил file_id."""
+    try:
+        if not with_caption:
+            pass
+        elif entry.get("photo_file_id"):
+            await context.bot.send_photo(chat_id=chat_id, photo=entry["photo_file_id"], caption=entry["caption"], parse_mode='Markdown')
+        else:
+            await context.bot.send_message(chat_id=chat_id, text=entry["caption"], parse_mode='Markdown')
+        if entry.get("audio_kind") == "document":
+            await context.bot.send_document(chat_id=chat_id, document=entry["audio_file_id"])
+        else:
+            await context.bot.send_audio(chat_id=chat_id, audio=entry["audio_file_id"])
+        return True
+    except BadRequest as e:
+        logger.warning(f"⚠️ Telegram отклонил сохранённый file_id: {e}")
+        return False
+
+
+async def _try_deliver_from_cache(context: ContextTypes.DEFAULT_TYPE, chat_id: int, sent_message, cache_key: str) -> bool:
+    """Отдаёт трек из кэша доставки, если он там есть. Отклонённые записи удаляются."""
+    cache = _services(context).delivery_cache
+    entry = cache.get(cache_key)
+    if not entry:
+        return False
+    if await _send_cached_delivery(context, chat_id, entry):
+        logger.info(f"⚡ Отправлено из кэша доставки: {cache_key}")
+        await context.bot.delete_message(chat_id=chat_id, message_id=sent_message.message_id)
+        return True
+    cache.invalidate(cache_key)
+    return False
 
 
-async def process_and_send_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, sent_message, initial_audio_file: Path, initial_cover_file: Optional[Path], url_for_caption: str, source: str):
+async def process_and_send_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, sent_message, initial_audio_file: Path, initial_cover_file: Optional[Path], url_for_caption: str, source: str, cache_key: Optional[str] = None, *, job: Job, metadata: Optional[Dict] = None, shared: Optional[SharedFiles] = None, flight: Optional[Flight] = None) -> Optional[Dict]:
+    """
+    Обложка, при необходимости конвертация, подпись и отправка.
+    metadata — известные из API теги (см. track_metadata): с ними теги из файла
+    не читаются, а формат, обложку и остальное AudioProbe берёт за одно открытие.
+    shared — скачанные файлы, нужные и другим запросам: вместо удаления
+    отпускается ссылка. flight — рейс, ждущие которого видят статус.
+    Возвращает запись доставки (None, если трек не отправлен); с cache_key она
+    же запоминается в кэше доставки.
+    """
     file_manager = FileManager()
-    files_to_delete = {initial_audio_file}
-    if initial_cover_file: files_to_delete.add(initial_cover_file)
+    scheduler = _services(context).scheduler
+    files_to_delete = set()
+    if not shared:
+        files_to_delete.add(initial_audio_file)
+        if initial_cover_file: files_to_delete.add(initial_cover_file)
     target_update = update.callback_query if update.callback_query else update
     chat_id = target_update.message.chat_id
 
@@ -328,146 +810,262 @@ async def process_and_send_audio(update: Update, context: ContextTypes.DEFAULT_T
             await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Аудиофайл не найден.")
             return
 
-        embed_cover_art(initial_audio_file, initial_cover_file)
-        await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="💿 Обработка файла...")
+        media = _services(context).media
+        probe = AudioProbe(initial_audio_file, metadata)
+        await _set_status(context, chat_id, sent_message, "💿 Обработка файла...", flight)
+        if not initial_cover_file:
+            # Отдельного файла обложки нет — берём встроенную, чтобы отправить фото
+            initial_cover_file = await asyncio.to_thread(probe.extract_cover)
+            if initial_cover_file:
+                files_to_delete.add(initial_cover_file)
+        await media.embed_cover(initial_audio_file, initial_cover_file, probe)
         size_mb = file_manager.get_file_size_mb(initial_audio_file)
-        audio_file_to_send = initial_audio_file
+        audio_to_send = initial_audio_file
+        plan = None
         
         if size_mb > Config.MAX_FILE_SIZE_MB: 
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="🎧 Файл слишком большой. Конвертирую...")
-            converted_file = convert_to_mp3(initial_audio_file)
-            if converted_file:
-                files_to_delete.add(converted_file)
-                audio_file_to_send = converted_file
+            status_text = "🎧 Файл слишком большой. Подбираю формат..."
+            await _set_status(context, chat_id, sent_message, status_text, flight)
+            async with ProgressUpdater(context.bot, chat_id, sent_message.message_id, mirror=flight.publish if flight else None) as progress:
+                async def conversion_progress(percent: float):
+                    progress.push(f"{status_text}\n{file_manager.format_progress_bar(percent)}")
+
+                # Результат пишется в рабочую папку задачи и удаляется вместе с исходником
+                transcoded = await scheduler.run(
+                    job, "transcode",
+                    lambda: media.transcode_to_fit(initial_audio_file, probe, _size_limit(), progress_callback=conversion_progress),
+                    on_queue=_queue_notifier(context, chat_id, sent_message.message_id, status_text, job),
+                )
+            if transcoded:
+                plan = transcoded.plan
+                files_to_delete.add(transcoded.path)
+                audio_to_send = transcoded.path
             else:
-                await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Ошибка конвертации.")
+                await context.bot.edit_message_text(chat_id=chat_id, message_id=sent_message.message_id, text="❌ Файл не удалось уместить в лимит Telegram.")
                 return
 
-        track_details = _get_metadata_from_file(audio_file_to_send)
-        if not track_details.get('title') or track_details.get('title') == 'N/A':
-            track_details = _get_metadata_from_qobuz_path(audio_file_to_send)
-        
-        real_quality = file_manager.get_audio_quality(audio_file_to_send) or "N/A"
-        custom_filename = f"{track_details.get('artist', 'Unknown')} - {track_details.get('title', 'Unknown')}{audio_file_to_send.suffix}"
-
-        caption_text = (
-            f"🎼 **{track_details.get('title', 'N/A')}**\n"
-            f"👤 `{track_details.get('artist', 'N/A')}`\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n"
-            f"💿 **Альбом:** {track_details.get('album', 'N/A')}\n"
-            f"📅 **Год:** {track_details.get('year', 'N/A')}\n"
-            f"✨ **Качество:** {real_quality}\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n"
-            f"📥 [Скачано с {source}]({url_for_caption})"
-        )
+        caption_text, custom_filename = await asyncio.to_thread(_build_caption, probe, source, url_for_caption, plan)
 
-        # 1. ОТПРАВЛЯЕМ ОБЛОЖКУ С КРАСИВОЙ ПОДПИСЬЮ
-        if initial_cover_file and initial_cover_file.exists():
-            with open(initial_cover_file, 'rb') as img:
-                await context.bot.send_photo(
+        async def send_all():
+            # 1. ОТПРАВЛЯЕМ ОБЛОЖКУ С КРАСИВОЙ ПОДПИСЬЮ
+            photo_message = None
+            if initial_cover_file and initial_cover_file.exists():
+                with open(initial_cover_file, 'rb') as img:
+                    photo_message = await context.bot.send_photo(
+                        chat_id=chat_id, 
+                        photo=img, 
+                        caption=caption_text, 
+                        parse_mode='Markdown'
+                    )
+            else:
+                # Если обложки нет, отправляем только текст
+                await context.bot.send_message(
                     chat_id=chat_id, 
-                    photo=img, 
-                    caption=caption_text, 
+                    text=caption_text, 
                     parse_mode='Markdown'
                 )
-        else:
-            # Если обложки нет, отправляем только текст
-            await context.bot.send_message(
-                chat_id=chat_id, 
-                text=caption_text, 
-                parse_mode='Markdown'
-            )
 
-        # 2. ОТПРАВЛЯЕМ АУДИОФАЙЛ
-        with open(audio_file_to_send, 'rb') as f:
-            await context.bot.send_audio(
-                chat_id=chat_id, 
-                audio=f, 
-                filename=custom_filename
-            )
+            # 2. ОТПРАВЛЯЕМ АУДИОФАЙЛ
+            audio_message = await _send_audio_file(context, chat_id, audio_to_send, custom_filename)
+            return photo_message, audio_message
+
+        photo_message, audio_message = await scheduler.run(job, "upload", send_all)
+
+        # 3. ЗАПОМИНАЕМ file_id, чтобы повторные запросы не качать заново
+        photo_file_id = photo_message.photo[-1].file_id if photo_message and photo_message.photo else None
+        entry = _remember_delivery(context, cache_key, audio_message, photo_file_id, caption_text, custom_filename)
         
         # Удаляем сервисное сообщение
         await context.bot.delete_message(chat_id=chat_id, message_id=sent_message.message_id)
+        return entry
     finally:
         for f in files_to_delete: file_manager.safe_remove(f)
+        if shared: shared.release()
 
 
-def _get_metadata_from_file(file_path: Path) -> dict:
-    details = {}
-    try:
-        audio = mutagen.File(file_path)
-        if not audio: return {}
-        details['artist'] = audio.get('artist', ['N/A'])[0]
-        details['title'] = audio.get('title', ['N/A'])[0]
-        details['album'] = audio.get('album', ['N/A'])[0]
-        year = audio.get('date', []) or audio.get('TDRC', []) or ['N/A']
-        details['year'] = re.sub(r'[^0-9]', '', str(year[0]))[:4]
-        return details
-    except Exception: return {}
-
-
-def _get_metadata_from_qobuz_path(audio_file: Path) -> dict:
+def _size_limit() -> int:
+    return Config.MAX_FILE_SIZE_MB * 1024 * 1024
+
+
+async def _send_audio_file(context: ContextTypes.DEFAULT_TYPE, chat_id: int, audio_file: Path, filename: str):
+    """
+    Отправляет аудиофайл. С локальным Bot API сервером в режиме --local
+    передаётся только путь (file://) — сервер читает файл сам, байты не идут
+    через Python. Файл при этом переезжает в outbox и удаляется, когда сервер
+    его забрал; остальной код должен считать его уже удалённым.
+    """
+    metrics.add_bytes("send_audio", audio_file.stat().st_size)
+    if not context.bot.local_mode:
+        with metrics.timer("send_audio"), open(audio_file, 'rb') as f:
+            return await context.bot.send_audio(chat_id=chat_id, audio=f, filename=filename)
+
+    outbox = _services(context).outbox
+    staged = await asyncio.to_thread(outbox.stage, audio_file, filename)
+    delivered = False
     try:
-        original_name = Path(str(audio_file).replace(".mp3", ".flac")).name
-        album_folder = audio_file.parent.name
-        match = re.match(r"(?P<artist>.+?) - (?P<album>.+?) \((?P<year>\d{4})", album_folder)
-        details = {}
-        details.update(zip(['artist', 'album', 'year'], match.groups()) if match else zip(['artist', 'album', 'year'], ["Unknown"]*3))
-        details['title'] = re.sub(r"^\d+\.\s*", "", original_name.rsplit(".", 1)[0]).strip()
-        return details
-    except Exception: return {}
+        with metrics.timer("send_audio"):
+            # Path в local_mode превращается в file://; имя файла берётся из пути
+            message = await context.bot.send_audio(chat_id=chat_id, audio=staged)
+        delivered = True
+        return message
+    finally:
+        outbox.release(staged, delivered)
+
+
+def _build_caption(probe: AudioProbe, source: str, url_for_caption: str, plan: Optional[TranscodePlan] = None) -> Tuple[str, str]:
+    """Подпись к обложке и имя файла для отправки; plan — во что файл перекодирован."""
+    track_details = probe.tags
+    real_quality = (plan.quality if plan else probe.quality) or "N/A"
+    suffix = plan.suffix if plan else probe.path.suffix
+    custom_filename = f"{track_details.get('artist', 'Unknown')} - {track_details.get('title', 'Unknown')}{suffix}"
+
+    caption_text = (
+        f"🎼 **{track_details.get('title', 'N/A')}**\n"
+        f"👤 `{track_details.get('artist', 'N/A')}`\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"💿 **Альбом:** {track_details.get('album', 'N/A')}\n"
+        f"📅 **Год:** {track_details.get('year', 'N/A')}\n"
+        f"✨ **Качество:** {real_quality}\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"📥 [Скачано с {source}]({url_for_caption})"
+    )
+    return caption_text, custom_filename
+
+
+def _remember_delivery(context: ContextTypes.DEFAULT_TYPE, cache_key: Optional[str], audio_message, photo_file_id: Optional[str], caption_text: str, filename: str) -> Dict:
+    """Запись доставки по ответу Telegram; с cache_key она сохраняется в кэш."""
+    sent_audio = audio_message.audio or audio_message.document
+    if not sent_audio:
+        return {}
+    entry = {
+        "audio_file_id": sent_audio.file_id,
+        "audio_kind": "audio" if audio_message.audio else "document",
+        "photo_file_id": photo_file_id,
+        "caption": caption_text,
+        "filename": filename,
+    }
+    if cache_key:
+        _services(context).delivery_cache.put(cache_key, entry)
+    return entry
 
 
 async def handle_audio_recognition(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _is_allowed(update.effective_user.id):
         await update.message.reply_text("⛔ Нет доступа.")
         return
+    if not (update.message.audio or update.message.voice): return
+    await _run_as_job(update, context, "Распознавание", _recognize_and_download)
+
+
+async def _recognize_and_download(update: Update, context: ContextTypes.DEFAULT_TYPE, *, job: Job):
     message = update.message
     audio_source = message.audio or message.voice
-    if not audio_source: return
+    scheduler = _services(context).scheduler
     sent_message = await message.reply_text("🔎 Пытаюсь распознать...")
-    temp_file_path = None
-    converted_file_path = None 
+    recognition_cache = _services(context).recognition_cache
+    file_unique_id = audio_source.file_unique_id
+    content_hash = None
     try:
-        file_obj = await audio_source.get_file()
-        file_bytes = await file_obj.download_as_bytearray() 
-        temp_file_path = Path(f"{file_obj.file_id}{Path(file_obj.file_path).suffix or '.ogg'}")
-        temp_file_path.write_bytes(bytes(file_bytes))
-        converted_file_path = temp_file_path.with_suffix(".mp3")
-        subprocess.run(["ffmpeg", "-i", str(temp_file_path), "-vn", "-acodec", "libmp3lame", "-b:a", "192k", str(converted_file_path)], check=True, capture_output=True)
-        
-        recognizer = AudioRecognizer()
-        track_info = recognizer.recognize(str(converted_file_path))
-        if not track_info:
+        # Этот файл уже присылали — не скачиваем его и не ходим в AudD
+        entry = recognition_cache.get_by_file(file_unique_id)
+        if entry is None:
+            try:
+                with _chat_actions(context).register(update.effective_chat.id, ChatAction.TYPING):
+                    entry, content_hash = await scheduler.run(
+                        job, "recognition",
+                        lambda: _recognize_audio(context, audio_source),
+                        on_queue=_queue_notifier(context, update.effective_chat.id, sent_message.message_id, "🔎 Пытаюсь распознать...", job),
+                    )
+            except RecognitionError:
+                # Сбой AudD — не «не найдено»: не кэшируем, повтор сразу пойдёт в AudD
+                await sent_message.edit_text("❌ Сервис распознавания не ответил. Попробуйте позже.")
+                return
+            if not entry["found"]:
+                recognition_cache.put(file_unique_id, content_hash, entry)
+        if not entry["found"]:
             await sent_message.edit_text("❌ Не удалось распознать.")
             return
 
-        artist, title = track_info['artist'], track_info['title']
+        artist, title = entry['artist'], entry['title']
         await sent_message.edit_text(f"✅ `{artist} - {title}`. Ищу на Qobuz...", parse_mode='Markdown')
         
-        downloader = QobuzDownloader()
-        file_manager = FileManager()
-        async def progress_callback(percent):
-            try:
-                await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=sent_message.message_id, text=f"✅ `{artist} - {title}`\n💿 {file_manager.format_progress_bar(percent)}", parse_mode='Markdown')
-            except Exception: pass
+        downloader = _services(context).qobuz
 
-        stop_typing = asyncio.Event()
-        typing_task = asyncio.create_task(_typing_loop(context.bot, update.effective_chat.id, stop_typing))
+        chat_action = _chat_actions(context).register(update.effective_chat.id, ChatAction.UPLOAD_DOCUMENT)
         try:
-            audio_file, cover_file = await downloader.search_and_download_lucky(artist, title)
-            if audio_file:
-                await process_and_send_audio(update, context, sent_message, audio_file, cover_file, "https://qobuz.com", "Qobuz")
-            else:
+            if "track_id" not in entry:
+                try:
+                    entry = {**entry, "track_id": await downloader.search_track(artist, title)}
+                except QobuzAPIError:
+                    # Поиск не удался — запоминаем только распознанное (без track_id), искать будем заново
+                    recognition_cache.put(file_unique_id, content_hash, entry)
+                    raise
+            # Запоминаем и под file_unique_id, и под хэшем фрагмента
+            recognition_cache.put(file_unique_id, content_hash, entry)
+            track_id = entry["track_id"]
+            if not track_id:
                 await sent_message.edit_text("❌ Не найдено на Qobuz.")
+                return
+            qobuz_url = track_url(track_id)
+            cache_key = DeliveryCache.make_key("qobuz", track_id, CACHE_QUALITY)
+            if await _try_deliver_from_cache(context, update.effective_chat.id, sent_message, cache_key):
+                return
+
+            probe = await downloader.probe_quality(qobuz_url, track_id)
+            quality_id = probe["quality_id"] if probe else CACHE_QUALITY
+            track_info = await downloader.get_track_info(track_id) if probe else None
+            async with JobWorkspace() as job_dir, ProgressUpdater(context.bot, update.effective_chat.id, sent_message.message_id, parse_mode='Markdown') as progress:
+                audio_file, cover_file = await scheduler.run(
+                    job, "download",
+                    lambda: downloader.download_track(qobuz_url, quality_id, job_dir, transfer_progress(progress, f"✅ `{artist} - {title}`")),
+                    on_queue=_queue_notifier(context, update.effective_chat.id, sent_message.message_id, f"✅ {artist} - {title}", job),
+                )
+                progress.close()
+                if audio_file:
+                    await process_and_send_audio(update, context, sent_message, audio_file, cover_file, qobuz_url, "Qobuz", cache_key=cache_key, job=job, metadata=track_metadata(track_info) if track_info else None)
+                else:
+                    await sent_message.edit_text("❌ Не удалось скачать с Qobuz.")
         except QobuzAuthError:
             await sent_message.edit_text(_token_expired_message())
+        except QobuzAPIError:
+            await sent_message.edit_text("❌ Qobuz не ответил. Попробуйте позже.")
         finally:
-            stop_typing.set()
-            typing_task.cancel()
+            chat_action.close()
+    except JobCancelledError:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка: {e}")
         await sent_message.edit_text("❌ Ошибка.")
-    finally:
-        if temp_file_path and temp_file_path.exists(): temp_file_path.unlink()
-        if converted_file_path and converted_file_path.exists(): converted_file_path.unlink()
+
+
+async def _recognize_audio(context: ContextTypes.DEFAULT_TYPE, audio_source) -> Tuple[dict, Optional[str]]:
+    """
+    Скачивает голосовое/аудио прямо на диск, вырезает короткий фрагмент
+    и отправляет в AudD только его. Время и размер запроса пишутся в лог.
+    Возвращает (запись для кэша распознавания, хэш фрагмента).
+    """
+    started = time.monotonic()
+    async with JobWorkspace() as job_dir:
+        file_obj = await audio_source.get_file()
+        source_path = job_dir / f"source{Path(file_obj.file_path or '').suffix or '.ogg'}"
+        with metrics.timer("tg_download"):
+            await file_obj.download_to_drive(source_path)
+        metrics.add_bytes("tg_download", source_path.stat().st_size)
+        snippet_path = await _services(context).media.extract_recognition_snippet(source_path, job_dir / "snippet.mp3", audio_source.duration)
+
+        # Тот же звук под другим file_unique_id (перезалитый файл) — узнаём по хэшу фрагмента
+        content_hash = await asyncio.to_thread(RecognitionCache.hash_file, snippet_path)
+        cached = _services(context).recognition_cache.get_by_hash(content_hash)
+        if cached is not None:
+            logger.info(f"⚡ Распознавание из кэша по хэшу фрагмента: {time.monotonic() - started:.2f} с")
+            return cached, content_hash
+
+        payload_kb = snippet_path.stat().st_size / 1024
+        track_info = await _services(context).recognizer.recognize(str(snippet_path))
+
+    logger.info(
+        f"⏱️ Распознавание: {time.monotonic() - started:.2f} с, "
+        f"в AudD отправлено {payload_kb:.0f} КБ (исходник {audio_source.file_size or 0} байт)"
+    )
+    entry = {"found": True, **track_info} if track_info else {"found": False}
+    return entry, content_hash
@@ -0,0 +1,124 @@
+from typing import Callable, Dict, Optional
+from telegram.error import BadRequest, RetryAfter
+from services.file_manager import FileManager
+from config import Config
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> момент, раньше которого чат не редактируем (общий для всех статусов чата)
+_next_edit_at: Dict[int, float] = {}
+# chat_id -> сколько ProgressUpdater сейчас открыто в чате
+_active: Dict[int, int] = {}
+
+
+class ProgressUpdater:
+    """
+    Коалесцирующее обновление статусного сообщения.
+    push() только запоминает последний текст; в Telegram он уходит не чаще
+    раза в PROGRESS_UPDATE_INTERVAL секунд на чат, одинаковый текст не отправляется.
+    Используется как `async with`: на выходе неотправленный прогресс отбрасывается,
+    чтобы он не затёр следующий статус.
+    mirror получает каждый push — так статус видят и ждущие того же трека.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, parse_mode: Optional[str] = None, interval: Optional[float] = None, mirror: Optional[Callable[[str], None]] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.parse_mode = parse_mode
+        self.interval = Config.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self._pending: Optional[str] = None
+        self._last_text: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self.mirror = mirror
+
+    async def __aenter__(self) -> "ProgressUpdater":
+        _active[self.chat_id] = _active.get(self.chat_id, 0) + 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        if _active.get(self.chat_id, 0) > 1:
+            _active[self.chat_id] -= 1
+        else:
+            _active.pop(self.chat_id, None)
+        _forget_idle_chats()
+
+    def push(self, text: str):
+        if self.mirror:
+            self.mirror(text)
+        if text == self._last_text:
+            self._pending = None
+            return
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    def close(self):
+        self._pending = None
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _flush(self):
+        while self._pending is not None:
+            wait = _next_edit_at.get(self.chat_id, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            text, self._pending = self._pending, None
+            if text == self._last_text:
+                continue
+            _next_edit_at[self.chat_id] = time.monotonic() + self.interval
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id, message_id=self.message_id,
+                    text=text, parse_mode=self.parse_mode,
+                )
+                self._last_text = text
+            except RetryAfter as e:
+                # Telegram просит подождать — откладываем этот же текст (если новее нет)
+                _next_edit_at[self.chat_id] = time.monotonic() + float(e.retry_after)
+                if self._pending is None:
+                    self._pending = text
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self._last_text = text
+                else:
+                    logger.debug(f"Не удалось обновить статус: {e}")
+            except Exception as e:
+                logger.debug(f"Не удалось обновить статус: {e}")
+
+
+def _forget_idle_chats():
+    """
+    Убирает паузы чатов без открытых статусов, когда пауза уже прошла:
+    иначе словарь растёт на каждый чат за всё время работы бота.
+    """
+    now = time.monotonic()
+    for chat_id, next_edit in list(_next_edit_at.items()):
+        if next_edit <= now and chat_id not in _active:
+            del _next_edit_at[chat_id]
+
+
+def transfer_progress(updater: ProgressUpdater, header: str):
+    """
+    progress_callback загрузки (скачано байт, ожидаемый размер):
+    рисует прогресс-бар со скоростью и ETA и отдаёт его в updater.
+    """
+    started = time.monotonic()
+
+    async def callback(done: int, expected: Optional[int]):
+        elapsed = time.monotonic() - started
+        speed = done / elapsed if done and elapsed > 0 else None
+        if expected:
+            percent = done * 100 / expected
+            eta = (expected - done) / speed if speed and expected > done else None
+            updater.push(f"{header}\n💿 {FileManager.format_progress_bar(percent, speed=speed, eta=eta)}")
+        else:
+            speed_text = f" • {FileManager.format_size(speed)}/с" if speed else ""
+            updater.push(f"{header}\n💿 Скачано {FileManager.format_size(done)}{speed_text}")
+
+    return callback
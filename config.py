@@ -24,6 +24,25 @@ class Config:
 
     QOBUZ_AUTH_TOKEN = os.getenv("QOBUZ_AUTH_TOKEN", "")
 
+    # Адрес API Qobuz и путь к rip можно подменить (бенчмарк с фейковыми сервисами)
+    QOBUZ_API_URL = os.getenv("QOBUZ_API_URL", "https://www.qobuz.com/api.json/0.2")
+    RIP_PATH = os.getenv("RIP_PATH")
+    # Резидентные воркеры streamrip: вход в Qobuz и соединения живут между загрузками.
+    # 0 — каждый трек отдельным запуском rip. Упавший воркер заменяется запуском rip
+    RIP_WORKERS = int(os.getenv("RIP_WORKERS", os.getenv("MAX_CONCURRENT_DOWNLOADS", "3")))
+    RIP_WORKER_PATH = os.getenv("RIP_WORKER_PATH")
+    RIP_WORKER_START_TIMEOUT = float(os.getenv("RIP_WORKER_START_TIMEOUT", "60"))
+    # Воркер не запустился (нет streamrip, сломан конфиг) — столько секунд качаем через rip
+    RIP_WORKER_RETRY_SECONDS = float(os.getenv("RIP_WORKER_RETRY_SECONDS", "300"))
+
+    # Собственная загрузка с Qobuz параллельными Range-запросами с докачкой.
+    # Ссылку на файл (track/getFileUrl) подписывает секрет приложения; пусто — только rip
+    QOBUZ_APP_SECRET = os.getenv("QOBUZ_APP_SECRET", "")
+    QOBUZ_STREAM_CONNECTIONS = int(os.getenv("QOBUZ_STREAM_CONNECTIONS", "4"))
+    QOBUZ_STREAM_CHUNK_MB = int(os.getenv("QOBUZ_STREAM_CHUNK_MB", "8"))
+    # Недокачанные файлы (DOWNLOAD_DIR/partial) ждут докачки столько секунд
+    QOBUZ_PARTIAL_TTL = int(os.getenv("QOBUZ_PARTIAL_TTL", str(24 * 3600)))
+
     ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
     ALLOWED_USERS: set = {
@@ -57,3 +76,86 @@ class Config:
     MAX_FILE_SIZE_MB = 2000
 
     LOG_FILE = BASE_DIR / "logs/bot.log"
+
+    # Локальный Bot API сервер запущен с --local: файлы отдаются ему по пути (file://),
+    # без загрузки через HTTP. Недоставленный файл удаляется через OUTBOX_GRACE_SECONDS
+    BOT_API_LOCAL_MODE = os.getenv("BOT_API_LOCAL_MODE", "0") == "1"
+    OUTBOX_GRACE_SECONDS = float(os.getenv("OUTBOX_GRACE_SECONDS", "600"))
+
+    # Каждая загрузка получает свою рабочую папку внутри DOWNLOAD_DIR,
+    # поэтому несколько загрузок могут идти параллельно.
+    # Глобальный лимит одновременно выполняемых загрузок (пул "download" планировщика):
+    MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "3"))
+
+    # Планировщик задач: лимиты остальных пулов этапов
+    MAX_CONCURRENT_TRANSCODES = int(os.getenv("MAX_CONCURRENT_TRANSCODES", "2"))
+    MAX_CONCURRENT_RECOGNITIONS = int(os.getenv("MAX_CONCURRENT_RECOGNITIONS", "4"))
+    MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "4"))
+    # Сколько задач один пользователь может держать в работе и в очереди одновременно
+    MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "3"))
+
+    # Хранилище состояния (SQLite): whitelist, токены, кэши, журнал задач
+    STATE_DB_FILE = Path(os.getenv("STATE_DB_FILE", str(BASE_DIR / "state.db")))
+    # Старый whitelist в JSON — переносится в хранилище при первом запуске
+    WHITELIST_FILE = BASE_DIR / "whitelist.json"
+
+    # Кэш file_id уже отправленных в Telegram треков
+    # (JSON-файл — старый формат, переносится в хранилище состояния)
+    DELIVERY_CACHE_FILE = BASE_DIR / "delivery_cache.json"
+
+    # Сколько треков одного альбома качается параллельно
+    ALBUM_PARALLEL_TRACKS = int(os.getenv("ALBUM_PARALLEL_TRACKS", "3"))
+
+    # Кэш метаданных Qobuz (альбомы, треки)
+    METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", str(6 * 3600)))
+    METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "2000"))
+    # Сохранять ли кэш метаданных на диск между перезапусками
+    METADATA_CACHE_PERSIST = os.getenv("METADATA_CACHE_PERSIST", "1") == "1"
+    METADATA_CACHE_FILE = BASE_DIR / "metadata_cache.json"
+
+    # AudD: адрес API можно подменить на локальный фейковый сервер для нагрузочных тестов
+    AUDD_API_URL = os.getenv("AUDD_API_URL", "https://api.audd.io/")
+    AUDD_TIMEOUT = float(os.getenv("AUDD_TIMEOUT", "30"))
+    AUDD_RETRIES = int(os.getenv("AUDD_RETRIES", "2"))
+    AUDD_MAX_CONCURRENT = int(os.getenv("AUDD_MAX_CONCURRENT", "4"))
+    # Офлайн-режим: JSON-файл со списком готовых ответов AudD, сеть не используется
+    AUDD_FIXTURES_FILE = os.getenv("AUDD_FIXTURES_FILE")
+
+    # Распознавание: в AudD уходит короткий фрагмент, а не весь файл
+    RECOGNITION_SNIPPET_SECONDS = int(os.getenv("RECOGNITION_SNIPPET_SECONDS", "12"))
+    RECOGNITION_BITRATE = os.getenv("RECOGNITION_BITRATE", "64k")
+
+    # Не чаще чем раз в столько секунд правим статусное сообщение в одном чате
+    PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", "3"))
+
+    # Локальный эндпоинт метрик Prometheus (/metrics); 0 — выключен
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+    # Импортировать тяжёлые бэкенды (savify, mutagen) в фоне сразу после старта
+    WARMUP_BACKENDS = os.getenv("WARMUP_BACKENDS", "1") == "1"
+
+    # Пул Savify (Spotify): 0 — по числу ядер, но не больше 4; таймаут одной загрузки, с
+    SAVIFY_WORKERS = int(os.getenv("SAVIFY_WORKERS", "0"))
+    SAVIFY_TIMEOUT = float(os.getenv("SAVIFY_TIMEOUT", "300"))
+
+    # Spotify -> Qobuz: ищем трек на Qobuz по ISRC, Savify — только при промахе
+    SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com/api/token")
+    SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+    SPOTIFY_MAP_FILE = BASE_DIR / "spotify_map.json"
+    SPOTIFY_MAP_TTL = int(os.getenv("SPOTIFY_MAP_TTL", str(90 * 24 * 3600)))
+    # Трека нет на Qobuz — переспросим через сутки: каталог пополняется
+    SPOTIFY_MAP_NEGATIVE_TTL = int(os.getenv("SPOTIFY_MAP_NEGATIVE_TTL", str(24 * 3600)))
+
+    # Пул ffmpeg: 0 — по числу ядер
+    FFMPEG_WORKERS = int(os.getenv("FFMPEG_WORKERS", "0"))
+    FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "600"))
+    # Файл больше лимита перекодируется в лучший формат, который в него влезет;
+    # оценка размера должна уложиться в эту долю лимита
+    TRANSCODE_SIZE_MARGIN = float(os.getenv("TRANSCODE_SIZE_MARGIN", "0.95"))
+
+    # Кэш результатов распознавания (file_unique_id / хэш фрагмента -> трек)
+    RECOGNITION_CACHE_FILE = BASE_DIR / "recognition_cache.json"
+    RECOGNITION_CACHE_TTL = int(os.getenv("RECOGNITION_CACHE_TTL", str(30 * 24 * 3600)))
+    # «Не распознано» кэшируем ненадолго: AudD могли дообучить
+    RECOGNITION_NEGATIVE_TTL = int(os.getenv("RECOGNITION_NEGATIVE_TTL", "3600"))
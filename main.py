@@ -1,16 +1,29 @@
 # main.py
 
+import sys
+from services import startup
+# --profile-startup: время импортов и фаз запуска пишется в лог
+if "--profile-startup" in sys.argv:
+    startup.enable()
+
+import asyncio
 import logging
 from telegram import BotCommand
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 # HTTPXRequest больше не нужен, если мы используем base_url
 # from telegram.request import HTTPXRequest 
 
-from bot.handlers import start, help_command, handle_download, handle_audio_recognition, set_token, add_user, remove_user, list_users
+from bot.handlers import start, help_command, handle_download, handle_audio_recognition, set_token, add_user, remove_user, list_users, cache_stats, cancel_job, stats_command
 from services import whitelist
+from services.workspace import JobWorkspace
+from services import metrics
+from services.container import ServiceContainer
+from bot.chat_actions import ChatActionHeartbeat
 from config import Config
 from dotenv import load_dotenv
 
+startup.mark("импорт модулей")
+
 def setup_logging():
     # ... (Оставьте функцию setup_logging без изменений)
     Config.LOG_FILE.parent.mkdir(exist_ok=True)
@@ -25,13 +38,83 @@ def setup_logging():
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("telegram.ext").setLevel(logging.WARNING)
 
+def register_handlers(app):
+    """Регистрирует хендлеры бота (используется и в main, и в бенчмарке)."""
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("download", handle_download))
+    app.add_handler(CommandHandler("settoken", set_token))
+    app.add_handler(CommandHandler("adduser", add_user))
+    app.add_handler(CommandHandler("removeuser", remove_user))
+    app.add_handler(CommandHandler("users", list_users))
+    app.add_handler(CommandHandler("cachestats", cache_stats))
+    app.add_handler(CommandHandler("cancel", cancel_job))
+    app.add_handler(CommandHandler("stats", stats_command))
+
+    # Добавляем обработчик callback-запросов (нажатия кнопок)
+    from bot.handlers import handle_callback_query
+    app.add_handler(CallbackQueryHandler(handle_callback_query))
+
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND & filters.Regex(r"https?:\/\/(open|play)\.(qobuz|spotify)\.com\/"), 
+        handle_download
+    ))
+
+    app.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, handle_audio_recognition))
+
+
+async def post_init(application):
+    # Один набор сервисов (и один пул HTTP-соединений) на всё приложение
+    services = ServiceContainer()
+    application.bot_data["services"] = services
+    whitelist.load(services.state)
+    # Один фоновый цикл chat action на все чаты
+    application.bot_data["chat_actions"] = ChatActionHeartbeat(application.bot)
+    if Config.METRICS_PORT:
+        application.bot_data["metrics_server"] = await metrics.start_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    await application.bot.set_my_commands([
+        BotCommand("start",       "Приветствие"),
+        BotCommand("help",        "Помощь"),
+        BotCommand("download",    "Скачать трек по ссылке"),
+        BotCommand("cancel",      "Активные задачи и отмена"),
+        BotCommand("users",       "Список разрешённых пользователей"),
+        BotCommand("adduser",     "Добавить пользователя в whitelist"),
+        BotCommand("removeuser",  "Удалить пользователя из whitelist"),
+        BotCommand("settoken",    "Обновить токен Qobuz"),
+        BotCommand("cachestats",  "Статистика кэша доставки"),
+        BotCommand("stats",       "Задержки по этапам (p50/p95/p99)"),
+    ])
+    startup.mark("post_init (бот готов)")
+    if Config.WARMUP_BACKENDS:
+        # savify, mutagen и т.п. подгружаются в фоне, пока бот уже принимает апдейты
+        application.bot_data["warmup"] = asyncio.create_task(startup.warm_up())
+    elif "--profile-startup" in sys.argv:
+        logging.getLogger(__name__).info(startup.report())
+
+
+async def post_shutdown(application):
+    warmup = application.bot_data.get("warmup")
+    if warmup and not warmup.done():
+        warmup.cancel()
+    metrics_server = application.bot_data.get("metrics_server")
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    chat_actions = application.bot_data.get("chat_actions")
+    if chat_actions:
+        await chat_actions.stop()
+    services = application.bot_data.get("services")
+    if services:
+        await services.aclose()
+
+
 def main():
     load_dotenv()
     setup_logging()
     
     logger = logging.getLogger(__name__)
     logger.info("🚀 Запуск бота...")
-    whitelist.load()
+    JobWorkspace.cleanup_stale()
     
     # --- НАЧАЛО ОКОНЧАТЕЛЬНОГО ИСПРАВЛЕНИЯ ---
     
@@ -44,43 +127,20 @@ def main():
         .token(Config.BOT_TOKEN)
         # КЛЮЧЕВОЕ ИСПРАВЛЕНИЕ: используем base_url для указания локального API
         .base_url(LOCAL_API_ROOT) 
+        # Сервер с --local забирает файлы по пути, а не через multipart-загрузку
+        .local_mode(Config.BOT_API_LOCAL_MODE)
         .connect_timeout(30)
         .read_timeout(120)
         .write_timeout(120)
+        # Апдейты обрабатываются параллельно; очередь и лимиты держит планировщик задач
+        .concurrent_updates(True)
         .build()
     )
     # --- ОКОНЧАТЕЛЬНОЕ ИСПРАВЛЕНИЕ ---
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("download", handle_download))
-    app.add_handler(CommandHandler("settoken", set_token))
-    app.add_handler(CommandHandler("adduser", add_user))
-    app.add_handler(CommandHandler("removeuser", remove_user))
-    app.add_handler(CommandHandler("users", list_users))
-    
-    # Добавляем обработчик callback-запросов (нажатия кнопок)
-    from bot.handlers import handle_callback_query
-    app.add_handler(CallbackQueryHandler(handle_callback_query))
-    
-    app.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND & filters.Regex(r"https?:\/\/(open|play)\.(qobuz|spotify)\.com\/"), 
-        handle_download
-    ))
-    
-    app.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, handle_audio_recognition))
-
-    async def post_init(application):
-        await application.bot.set_my_commands([
-            BotCommand("start",       "Приветствие"),
-            BotCommand("help",        "Помощь"),
-            BotCommand("download",    "Скачать трек по ссылке"),
-            BotCommand("users",       "Список разрешённых пользователей"),
-            BotCommand("adduser",     "Добавить пользователя в whitelist"),
-            BotCommand("removeuser",  "Удалить пользователя из whitelist"),
-            BotCommand("settoken",    "Обновить токен Qobuz"),
-        ])
-
+    register_handlers(app)
+    startup.mark("сборка приложения")
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
 
     app.run_polling(
         poll_interval=0,
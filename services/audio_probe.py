@@ -0,0 +1,172 @@
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Поля подписи к треку
+TAG_FIELDS = ("artist", "title", "album", "year")
+# Ключи тегов по форматам: Vorbis (FLAC), ID3 (MP3), MP4 (M4A)
+_TAG_KEYS = {
+    "artist": ("artist", "TPE1", "\xa9ART"),
+    "title": ("title", "TIT2", "\xa9nam"),
+    "album": ("album", "TALB", "\xa9alb"),
+    "year": ("date", "TDRC", "\xa9day"),
+}
+
+
+def format_quality(bit_depth: Optional[float], sample_rate_khz: Optional[float]) -> Optional[str]:
+    """'24-bit / 192 kHz', '16-bit / 44.1 kHz'"""
+    if not bit_depth or not sample_rate_khz:
+        return None
+    khz = round(float(sample_rate_khz), 1)
+    # Убираем .0 для целых чисел, например 44.1, но 96
+    rate = str(int(khz)) if khz.is_integer() else str(khz)
+    return f"{int(bit_depth)}-bit / {rate} kHz"
+
+
+class AudioProbe:
+    """
+    Всё, что конвейеру нужно знать об аудиофайле: теги, формат, длительность,
+    встроенная обложка. Файл открывается mutagen не больше одного раза и только
+    если чего-то нет в known — например, метаданных из API Qobuz.
+    """
+
+    __slots__ = ("path", "_known", "_tags", "_quality", "_audio", "_loaded")
+
+    def __init__(self, path: Path, known: Optional[Dict] = None):
+        self.path = path
+        self._known = known or {}
+        self._tags: Optional[Dict[str, str]] = None
+        if all(self._known.get(field) for field in TAG_FIELDS):
+            self._tags = {field: str(self._known[field]) for field in TAG_FIELDS}
+        self._quality: Optional[str] = self._known.get("quality")
+        self._audio = None
+        self._loaded = False
+
+    def _file(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import mutagen
+                self._audio = mutagen.File(self.path)
+            except Exception as e:
+                logger.error(f"Не удалось прочитать метаданные из файла {self.path}: {e}")
+        return self._audio
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        if self._tags is None:
+            tags = self._read_tags()
+            if not tags.get("title"):
+                tags = _tags_from_qobuz_path(self.path)
+            self._tags = tags
+        return self._tags
+
+    def _read_tags(self) -> Dict[str, str]:
+        audio = self._file()
+        if not audio or not audio.tags:
+            return {}
+        details = {}
+        for field, keys in _TAG_KEYS.items():
+            for key in keys:
+                value = audio.tags.get(key)
+                if not value:
+                    continue
+                # ID3-фрейм хранит значения в .text, Vorbis и MP4 — списком
+                values = getattr(value, "text", value)
+                details[field] = str(values[0]) if isinstance(values, list) else str(values)
+                break
+        if "year" in details:
+            details["year"] = re.sub(r"[^0-9]", "", details["year"])[:4]
+        return {k: v for k, v in details.items() if v}
+
+    @property
+    def quality(self) -> Optional[str]:
+        """'24-bit / 192 kHz' для lossless, 'MP3 / 320 kbps' для lossy."""
+        if self._quality is None:
+            audio = self._file()
+            if not audio:
+                return None
+            bit_depth = getattr(audio.info, "bits_per_sample", None)
+            if bit_depth:
+                self._quality = format_quality(bit_depth, audio.info.sample_rate / 1000)
+            else:
+                # Для MP3 и некоторых других форматов нет bits_per_sample,
+                # можно использовать bitrate в качестве альтернативы.
+                bitrate = getattr(audio.info, "bitrate", 0)
+                if bitrate > 0:
+                    self._quality = f"MP3 / {bitrate // 1000} kbps"
+        return self._quality
+
+    @property
+    def bit_depth(self) -> Optional[int]:
+        """Разрядность lossless-потока; None для lossy-форматов."""
+        if self._known.get("bit_depth"):
+            return int(self._known["bit_depth"])
+        audio = self._file()
+        return getattr(audio.info, "bits_per_sample", None) if audio else None
+
+    @property
+    def sample_rate(self) -> Optional[int]:
+        """Частота дискретизации, Гц."""
+        if self._known.get("sample_rate"):
+            return int(self._known["sample_rate"])
+        audio = self._file()
+        return getattr(audio.info, "sample_rate", None) if audio else None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self._known.get("duration"):
+            return float(self._known["duration"])
+        audio = self._file()
+        return audio.info.length if audio else None
+
+    def picture_data(self) -> Optional[bytes]:
+        """Первая встроенная картинка (FLAC, ID3 APIC, MP4 covr)."""
+        audio = self._file()
+        if not audio:
+            return None
+        pictures = getattr(audio, "pictures", None)
+        if pictures:
+            return pictures[0].data
+        tags = audio.tags
+        if tags is None:
+            return None
+        if hasattr(tags, "getall"):
+            frames = tags.getall("APIC")
+            return frames[0].data if frames else None
+        covers = tags.get("covr")
+        return bytes(covers[0]) if covers else None
+
+    @property
+    def has_picture(self) -> bool:
+        return self.picture_data() is not None
+
+    def extract_cover(self) -> Optional[Path]:
+        """Сохраняет встроенную обложку рядом с файлом, чтобы отправить её фото."""
+        data = self.picture_data()
+        if not data:
+            return None
+        cover_path = self.path.parent / ("cover.png" if data[:4] == b"\x89PNG" else "cover.jpg")
+        try:
+            cover_path.write_bytes(data)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось извлечь обложку: {e}")
+            return None
+        logger.info(f"🖼️ Обложка извлечена из {self.path.name}")
+        return cover_path
+
+
+def _tags_from_qobuz_path(audio_file: Path) -> Dict[str, str]:
+    """Запасной вариант: streamrip кладёт трек в «Artist - Album (Year) [...]/NN. Title.flac»."""
+    try:
+        original_name = Path(str(audio_file).replace(".mp3", ".flac")).name
+        album_folder = audio_file.parent.name
+        match = re.match(r"(?P<artist>.+?) - (?P<album>.+?) \((?P<year>\d{4})", album_folder)
+        details = {}
+        details.update(zip(['artist', 'album', 'year'], match.groups()) if match else zip(['artist', 'album', 'year'], ["Unknown"]*3))
+        details['title'] = re.sub(r"^\d+\.\s*", "", original_name.rsplit(".", 1)[0]).strip()
+        return details
+    except Exception: return {}
@@ -0,0 +1,148 @@
+from typing import Optional, TYPE_CHECKING
+from services.downloader import QobuzDownloader
+from services.delivery_cache import DeliveryCache
+from services.inflight import InflightRegistry
+from services.metadata_cache import TTLCache
+from services.media import MediaProcessor
+from services.recognition_cache import RecognitionCache
+from services.rip_pool import RipWorkerPool
+from services.scheduler import JobScheduler
+from services.spotify_resolver import SpotifyResolver
+from services.state_store import StateStore
+from services.workspace import Outbox
+from services import metrics
+from config import Config
+import asyncio
+import importlib.util
+import logging
+import httpx
+
+if TYPE_CHECKING:
+    # savify тянет spotipy и youtube-dl — импортируем только при первой Spotify-ссылке
+    from services.savify_downloader import SavifyDownloader
+    from services.recognizer import AudioRecognizer
+
+logger = logging.getLogger(__name__)
+
+QOBUZ_TOKEN_SETTING = "qobuz_auth_token"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Общий пул keep-alive соединений (HTTP/2, если установлен пакет h2)."""
+    http2 = importlib.util.find_spec("h2") is not None
+    logger.info(f"🌐 Общий HTTP-клиент (HTTP/2: {'да' if http2 else 'нет'})")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(15.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        headers={"User-Agent": USER_AGENT},
+        follow_redirects=True,
+    )
+
+
+class ServiceContainer:
+    """
+    Долгоживущие сервисы приложения: создаются один раз в post_init
+    и закрываются в post_shutdown.
+    """
+
+    def __init__(self):
+        self.state = StateStore(Config.STATE_DB_FILE)
+        # Токен, обновлённый через /settoken, важнее значения из .env
+        token = self.state.get_setting(QOBUZ_TOKEN_SETTING)
+        if token:
+            Config.QOBUZ_AUTH_TOKEN = token
+        self.http = build_http_client()
+        persist = Config.METADATA_CACHE_PERSIST
+        self.metadata_cache = TTLCache(
+            maxsize=Config.METADATA_CACHE_SIZE,
+            ttl=Config.METADATA_CACHE_TTL,
+            path=Config.METADATA_CACHE_FILE if persist else None,
+            store=self.state if persist else None,
+            namespace="metadata",
+        )
+        # Процессы воркеров стартуют при первой загрузке, а не здесь
+        self.rip_pool = RipWorkerPool()
+        self.qobuz = QobuzDownloader(self.http, self.metadata_cache, rip_pool=self.rip_pool)
+        self.spotify = SpotifyResolver(self.http, self.qobuz, Config.SPOTIFY_MAP_FILE, store=self.state)
+        self.delivery_cache = DeliveryCache(store=self.state)
+        # Одинаковые запросы, пришедшие во время загрузки, ждут её, а не качают заново
+        self.inflight = InflightRegistry()
+        self.media = MediaProcessor()
+        self.outbox = Outbox()
+        self.recognition_cache = RecognitionCache(Config.RECOGNITION_CACHE_FILE, store=self.state)
+        self.scheduler = JobScheduler(
+            limits={
+                "download": Config.MAX_CONCURRENT_DOWNLOADS,
+                "transcode": Config.MAX_CONCURRENT_TRANSCODES,
+                "recognition": Config.MAX_CONCURRENT_RECOGNITIONS,
+                "upload": Config.MAX_CONCURRENT_UPLOADS,
+            },
+            max_jobs_per_user=Config.MAX_JOBS_PER_USER,
+            on_finish=self.state.log_job,
+        )
+        self._savify: Optional["SavifyDownloader"] = None
+        self._recognizer: Optional["AudioRecognizer"] = None
+        metrics.register_collector(self._collect_metrics)
+        logger.info("✅ Сервисы приложения инициализированы.")
+
+    def _collect_metrics(self):
+        """Текущие глубины очередей и показатели кэшей для /metrics."""
+        for pool, stats in self.scheduler.stats().items():
+            yield "musicbot_pool_running", {"pool": pool}, stats["running"]
+            yield "musicbot_pool_queued", {"pool": pool}, stats["queued"]
+        yield "musicbot_jobs_active", {}, len(self.scheduler.jobs)
+        media = self.media.stats()
+        yield "musicbot_ffmpeg_running", {}, media["running"]
+        yield "musicbot_ffmpeg_queued", {}, media["queued"]
+        rip = self.rip_pool.stats()
+        yield "musicbot_rip_workers_alive", {}, rip["alive"]
+        yield "musicbot_rip_workers_running", {}, rip["running"]
+        inflight = self.inflight.stats()
+        yield "musicbot_inflight_downloads", {}, inflight["flights"]
+        yield "musicbot_inflight_followers", {}, inflight["followers"]
+        if self._savify is not None:
+            savify = self._savify.stats()
+            yield "musicbot_savify_running", {}, savify["running"]
+            yield "musicbot_savify_queued", {}, savify["queued"]
+        caches = {
+            "delivery": self.delivery_cache.stats(),
+            "metadata": self.metadata_cache.stats(),
+            "recognition": self.recognition_cache.stats(),
+            "spotify_map": self.spotify.stats(),
+        }
+        for name, stats in caches.items():
+            yield "musicbot_cache_entries", {"cache": name}, stats["entries"]
+            yield "musicbot_cache_hit_ratio", {"cache": name}, round(stats["hit_rate"] / 100, 4)
+
+    @property
+    def savify(self) -> "SavifyDownloader":
+        # Пул Savify поднимается при первой Spotify-ссылке и живёт до остановки бота
+        if self._savify is None:
+            from services.savify_downloader import SavifyDownloader
+            self._savify = SavifyDownloader()
+        return self._savify
+
+    @property
+    def recognizer(self) -> "AudioRecognizer":
+        if self._recognizer is None:
+            from services.recognizer import AudioRecognizer
+            self._recognizer = AudioRecognizer(self.http)
+        return self._recognizer
+
+    async def update_qobuz_token(self, token: str):
+        await self.state.set_setting(QOBUZ_TOKEN_SETTING, token)
+        self.qobuz.set_auth_token(token)
+
+    async def aclose(self):
+        if self._savify is not None:
+            self._savify.close()
+        await self.rip_pool.close()
+        self.metadata_cache.save()
+        self.recognition_cache.save()
+        self.spotify.save()
+        # Дожидаемся фоновых записей и закрываем базу
+        await asyncio.to_thread(self.state.close)
+        await self.http.aclose()
+        logger.info("🔌 HTTP-клиент закрыт.")
@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import Optional, Dict, TYPE_CHECKING
+from config import Config
+import json
+import logging
+import os
+import time
+
+if TYPE_CHECKING:
+    from services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+_NAMESPACE = "delivery"
+
+
+class DeliveryCache:
+    """
+    Постоянный кэш доставок: (источник, id трека, качество) -> file_id,
+    которые Telegram вернул при первой отправке, плюс подпись и имя файла.
+    Повторный запрос того же трека отправляется по file_id без скачивания.
+    Записи живут в памяти и в хранилище состояния (изменённая запись —
+    одна строка, а не весь файл); без store — в JSON-файле, как раньше.
+    """
+
+    def __init__(self, path: Optional[Path] = None, store: Optional["StateStore"] = None):
+        self.path = path or Config.DELIVERY_CACHE_FILE
+        self.store = store
+        self._entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._load()
+
+    @staticmethod
+    def make_key(source: str, track_id: str, quality) -> str:
+        return f"{source}:{track_id}:{quality}"
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def put(self, key: str, entry: dict):
+        self._entries[key] = {**entry, "created": int(time.time())}
+        if self.store:
+            self.store.write_cache(_NAMESPACE, {key: (self._entries[key], None)})
+        else:
+            self._save()
+
+    def invalidate(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+            logger.info(f"🗑️ Запись кэша доставки {key} удалена (file_id отклонён)")
+            if self.store:
+                self.store.write_cache(_NAMESPACE, {}, [key])
+            else:
+                self._save()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits / total * 100) if total else 0.0,
+        }
+
+    def _load(self):
+        if self.store:
+            self._load_store()
+            return
+        try:
+            if self.path.exists():
+                self._entries = json.loads(self.path.read_text())
+                logger.info(f"✅ Кэш доставки загружен: {len(self._entries)} записей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша доставки: {e}")
+            self._entries = {}
+
+    def _save(self):
+        # Пишем во временный файл и атомарно подменяем, чтобы не оставить битый JSON
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(json.dumps(self._entries, ensure_ascii=False))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш доставки: {e}")
+
+    def _load_store(self):
+        try:
+            if self.path.exists():
+                # Старый JSON переносим в хранилище одним пакетом
+                legacy = json.loads(self.path.read_text())
+                self.store.write_cache(_NAMESPACE, {key: (entry, None) for key, entry in legacy.items()}).result()
+                os.replace(self.path, self.path.with_suffix(".json.migrated"))
+                logger.info(f"📦 {self.path.name} перенесён в хранилище состояния ({len(legacy)} записей)")
+            self._entries = {key: entry for key, entry, _ in self.store.load_cache(_NAMESPACE)}
+            logger.info(f"✅ Кэш доставки загружен: {len(self._entries)} записей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша доставки: {e}")
+            self._entries = {}
@@ -1,147 +1,467 @@
 from pathlib import Path
-from typing import Optional, Tuple, Callable, Awaitable, Dict
+from typing import Optional, Tuple, Callable, Awaitable, Dict, TYPE_CHECKING
 from config import Config
+from services.metadata_cache import TTLCache
+from services import metrics
 import logging
 import sys
 import asyncio
+import os
 import re
 import shutil
 import httpx
 
+if TYPE_CHECKING:
+    from services.qobuz_stream import QobuzStreamDownloader
+    from services.rip_pool import RipWorkerPool
+
 logger = logging.getLogger(__name__)
 
-QOBUZ_API = "https://www.qobuz.com/api.json/0.2"
+QOBUZ_API = Config.QOBUZ_API_URL
+
+
+class QobuzAPIError(Exception):
+    """API Qobuz не ответил (сеть, HTTP-ошибка) — в отличие от пустого результата, не кэшируется."""
 
 
-class QobuzAuthError(Exception):
+class QobuzAuthError(QobuzAPIError):
     pass
+
+
 QOBUZ_TO_RIP_QUALITY = {27: 4, 7: 3, 6: 2, 5: 1}
+# Сколько треков запрашивать за одну страницу album/get
+ALBUM_PAGE_LIMIT = 500
+
+# Прогресс загрузки: (скачано байт, ожидаемый размер в байтах или None)
+ProgressCallback = Callable[[int, Optional[int]], Awaitable[None]]
+# Как часто смотреть, сколько rip уже записал в папку задачи
+PROGRESS_POLL_INTERVAL = 1.0
+# Во сколько раз FLAC в среднем меньше несжатого PCM (для оценки размера)
+FLAC_RATIO = 0.6
+# quality_id -> (бит, кГц) верхней границы формата
+QUALITY_FORMATS = {6: (16, 44.1), 7: (24, 96), 27: (24, 192)}
+
+
+def track_url(track_id: str) -> str:
+    return f"https://open.qobuz.com/track/{track_id}"
+
+
+def quality_from_format(bit_depth: Optional[float], sampling_rate: Optional[float], hires: bool = True) -> int:
+    """
+    Лучший quality_id Qobuz для максимального формата релиза.
+    sampling_rate — в кГц, как его отдаёт API (44.1, 96, 192...).
+    """
+    if bit_depth and bit_depth > 16 and hires:
+        return 27 if (sampling_rate or 0) > 96 else 7
+    if bit_depth:
+        return 6
+    return 5
+
+
+def estimate_size(
+    duration: Optional[float],
+    quality_id: int,
+    bit_depth: Optional[float] = None,
+    sampling_rate: Optional[float] = None,
+) -> Optional[int]:
+    """Примерный размер файла в байтах по длительности и качеству (для процентов и ETA)."""
+    if not duration:
+        return None
+    if quality_id not in QUALITY_FORMATS:
+        return int(duration * 320_000 / 8)
+    depth, rate = QUALITY_FORMATS[quality_id]
+    # Релиз может быть хуже запрошенного качества — rip скачает максимум релиза
+    if bit_depth:
+        depth = min(depth, bit_depth)
+    if sampling_rate:
+        rate = min(rate, sampling_rate)
+    return int(duration * rate * 1000 * depth / 8 * 2 * FLAC_RATIO)
+
+
+def track_metadata(track: Dict, album: Optional[Dict] = None) -> Dict:
+    """
+    Подпись к треку по данным API (track/get или трек из album/get):
+    {"artist", "title", "album", "year", "duration"}.
+    Неизвестные поля опускаются — их AudioProbe дочитает из файла.
+    Качество, разрядность и частоту API знает только как максимум релиза, а
+    скачанный файл может быть хуже (лимит подписки, другой format_id, запасной
+    путь через rip) — их AudioProbe берёт из самого файла.
+    """
+    album = album or {}
+    known = {
+        "artist": track.get("artist") or album.get("artist"),
+        "title": track.get("title"),
+        "album": track.get("album") or album.get("title"),
+        "year": track.get("year") or album.get("year"),
+        "duration": track.get("duration"),
+    }
+    return {k: v for k, v in known.items() if v}
+
+
+def _check_search_response(r: httpx.Response):
+    if r.status_code == 401:
+        raise QobuzAuthError("Токен Qobuz истёк или недействителен")
+    if r.status_code != 200:
+        logger.warning(f"⚠️ Поиск вернул {r.status_code}: {r.text[:200]}")
+        raise QobuzAPIError(f"catalog/search вернул {r.status_code}")
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # rip мог переименовать или удалить временный файл
+                pass
+    return total
 
 
 class QobuzDownloader:
-    def __init__(self):
+    def __init__(self, http: httpx.AsyncClient, metadata: Optional[TTLCache] = None, rip_pool: Optional["RipWorkerPool"] = None):
         self.download_dir = Config.DOWNLOAD_DIR
         self.download_dir.mkdir(parents=True, exist_ok=True)
-        self.rip_path = Path(sys.executable).parent / "rip"
+        self.rip_path = Path(Config.RIP_PATH) if Config.RIP_PATH else Path(sys.executable).parent / "rip"
+        # Резидентные воркеры streamrip; без них (или если воркер упал) — запуск rip на трек
+        self.rip_pool = rip_pool
+        # Собственная загрузка по подписанной ссылке; без секрета приложения — только rip
+        self.native: Optional["QobuzStreamDownloader"] = None
+        if Config.QOBUZ_APP_SECRET:
+            # Модуль движка сам импортирует этот, поэтому импорт здесь, а не наверху
+            from services import qobuz_stream
+            self.native = qobuz_stream.QobuzStreamDownloader(http, self)
+        # Общий пул соединений; заголовки Qobuz передаём в каждом запросе,
+        # чтобы токен не уходил на другие хосты (AudD и т.п.)
+        self.http = http
         self._headers = {
             "X-App-Id": Config.QOBUZ_APP_ID,
             "X-User-Auth-Token": Config.QOBUZ_AUTH_TOKEN,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0",
         }
+        # Метаданные альбомов и треков: "album:<id>" / "track:<id>"
+        self.metadata = metadata if metadata is not None else TTLCache(maxsize=Config.METADATA_CACHE_SIZE, ttl=Config.METADATA_CACHE_TTL)
         logger.info("✅ Сервис загрузки Qobuz (streamrip) инициализирован.")
 
+    @property
+    def auth_headers(self) -> Dict[str, str]:
+        return self._headers
+
+    def set_auth_token(self, token: str):
+        """Обновляет токен для всех последующих запросов без пересоздания клиента."""
+        self._headers["X-User-Auth-Token"] = token
+
     async def get_album_info(self, url: str) -> Optional[Dict]:
         album_id = self._extract_id(url)
         if not album_id:
             return None
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                r = await client.get(
-                    f"{QOBUZ_API}/album/get",
-                    params={"album_id": album_id, "app_id": Config.QOBUZ_APP_ID},
-                    headers=self._headers,
-                )
-                if r.status_code != 200:
-                    logger.warning(f"⚠️ Album API вернул {r.status_code}")
-                    return None
-                data = r.json()
-                tracks = [
-                    {"index": i + 1, "title": t["title"], "id": str(t["id"])}
-                    for i, t in enumerate(data.get("tracks", {}).get("items", []))
-                ]
-                if not tracks:
-                    return None
-                return {
-                    "title": data.get("title", "Unknown Album"),
-                    "artist": data.get("artist", {}).get("name", "Unknown Artist"),
-                    "tracks": tracks[:50],
-                }
+            return await self.metadata.get_or_fetch(f"album:{album_id}", lambda: self._fetch_album(album_id))
         except Exception as e:
             logger.error(f"❌ Ошибка при получении информации об альбоме: {e}")
             return None
 
+    @metrics.timed("qobuz_api")
+    async def _fetch_album(self, album_id: str) -> Optional[Dict]:
+        # album/get отдаёт треки страницами — собираем все, чтобы бокс-сеты не обрезались
+        items = []
+        data = {}
+        while True:
+            r = await self.http.get(
+                f"{QOBUZ_API}/album/get",
+                params={"album_id": album_id, "app_id": Config.QOBUZ_APP_ID,
+                        "limit": ALBUM_PAGE_LIMIT, "offset": len(items)},
+                headers=self._headers,
+            )
+            if r.status_code != 200:
+                logger.warning(f"⚠️ Album API вернул {r.status_code}")
+                return None
+            data = r.json()
+            page = data.get("tracks", {})
+            page_items = page.get("items", [])
+            items.extend(page_items)
+            if not page_items or len(items) >= page.get("total", 0):
+                break
+
+        tracks = [
+            {
+                "index": i + 1, "title": t["title"], "id": str(t["id"]), "duration": t.get("duration"),
+                "artist": t.get("performer", {}).get("name"),
+            }
+            for i, t in enumerate(items)
+        ]
+        if not tracks:
+            return None
+        logger.info(f"💿 Альбом {album_id}: {len(tracks)} треков")
+        return {
+            "title": data.get("title", "Unknown Album"),
+            "artist": data.get("artist", {}).get("name", "Unknown Artist"),
+            "year": (data.get("release_date_original") or "")[:4] or None,
+            "cover_url": data.get("image", {}).get("large"),
+            "maximum_bit_depth": data.get("maximum_bit_depth"),
+            "maximum_sampling_rate": data.get("maximum_sampling_rate"),
+            "hires_streamable": data.get("hires_streamable", True),
+            "streamable": data.get("streamable", True),
+            "tracks": tracks,
+        }
+
+    async def get_track_info(self, track_id: str) -> Optional[Dict]:
+        """Метаданные трека из track/get (через кэш)."""
+        try:
+            return await self.metadata.get_or_fetch(f"track:{track_id}", lambda: self._fetch_track(track_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось получить информацию о треке {track_id}: {e}")
+            return None
+
+    @metrics.timed("qobuz_api")
+    async def _fetch_track(self, track_id: str) -> Optional[Dict]:
+        r = await self.http.get(
+            f"{QOBUZ_API}/track/get",
+            params={"track_id": track_id, "app_id": Config.QOBUZ_APP_ID},
+            headers=self._headers,
+        )
+        if r.status_code != 200:
+            logger.warning(f"⚠️ track/get вернул {r.status_code}")
+            return None
+        data = r.json()
+        album = data.get("album") or {}
+        return {
+            "id": str(data.get("id", track_id)),
+            "title": data.get("title"),
+            "artist": (data.get("performer") or album.get("artist") or {}).get("name"),
+            "album": album.get("title"),
+            "year": (album.get("release_date_original") or "")[:4] or None,
+            "track_number": data.get("track_number"),
+            "isrc": data.get("isrc"),
+            "cover_url": (album.get("image") or {}).get("large"),
+            "duration": data.get("duration"),
+            "maximum_bit_depth": data.get("maximum_bit_depth"),
+            "maximum_sampling_rate": data.get("maximum_sampling_rate"),
+            "hires_streamable": data.get("hires_streamable", True),
+            "streamable": data.get("streamable", True),
+        }
+
+    async def download_cover(self, cover_url: Optional[str], dest_dir: Path) -> Optional[Path]:
+        """Скачивает обложку релиза в dest_dir/cover.jpg."""
+        if not cover_url:
+            return None
+        try:
+            r = await self.http.get(cover_url)
+            r.raise_for_status()
+            cover_path = dest_dir / "cover.jpg"
+            cover_path.write_bytes(r.content)
+            return cover_path
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось скачать обложку: {e}")
+            return None
+
+    @metrics.timed("qobuz_search")
+    async def search_track(self, artist: str, title: str) -> Optional[str]:
+        """
+        Ищет трек в каталоге Qobuz и возвращает ID первого результата,
+        None — если ничего не найдено. Ошибка запроса — QobuzAPIError.
+        """
+        clean_title = re.sub(r'\(.*?\)|\[.*?\]', '', title).strip()
+        query = f"{artist} {clean_title}"
+        logger.info(f"🔍 Поиск трека на Qobuz: '{query}'")
+        try:
+            r = await self.http.get(
+                f"{QOBUZ_API}/catalog/search",
+                params={"query": query, "type": "tracks", "limit": 1,
+                        "app_id": Config.QOBUZ_APP_ID},
+                headers=self._headers,
+            )
+            _check_search_response(r)
+            items = r.json().get("tracks", {}).get("items", [])
+        except QobuzAPIError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка при поиске трека: {e}")
+            raise QobuzAPIError(str(e)) from e
+        if not items:
+            logger.warning("⚠️ Треки не найдены")
+            return None
+        track_id = str(items[0]["id"])
+        logger.info(f"✅ Найден трек ID={track_id}")
+        return track_id
+
+    @metrics.timed("qobuz_search")
+    async def search_isrc(self, isrc: str) -> Optional[str]:
+        """
+        Ищет трек по ISRC: ID Qobuz только при точном совпадении кода,
+        None — если такого трека нет. Ошибка запроса — QobuzAPIError.
+        """
+        isrc = isrc.strip().upper()
+        logger.info(f"🔍 Поиск трека на Qobuz по ISRC {isrc}")
+        try:
+            r = await self.http.get(
+                f"{QOBUZ_API}/catalog/search",
+                params={"query": isrc, "type": "tracks", "limit": 10,
+                        "app_id": Config.QOBUZ_APP_ID},
+                headers=self._headers,
+            )
+            _check_search_response(r)
+            items = r.json().get("tracks", {}).get("items", [])
+        except QobuzAPIError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка при поиске по ISRC: {e}")
+            raise QobuzAPIError(str(e)) from e
+        for item in items:
+            if str(item.get("isrc", "")).upper() == isrc and item.get("streamable", True):
+                logger.info(f"✅ Найден трек ID={item['id']} по ISRC")
+                return str(item["id"])
+        logger.warning(f"⚠️ ISRC {isrc} на Qobuz не найден")
+        return None
+
     async def search_and_download_lucky(
         self,
         artist: str,
         title: str,
-        progress_callback: Optional[Callable[[float], Awaitable[None]]] = None,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
     ) -> Tuple[Optional[Path], Optional[Path]]:
-        clean_title = re.sub(r'\(.*?\)|\[.*?\]', '', title).strip()
-        query = f"{artist} {clean_title}"
-        logger.info(f"🔍 Поиск трека на Qobuz: '{query}'")
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                r = await client.get(
-                    f"{QOBUZ_API}/catalog/search",
-                    params={"query": query, "type": "tracks", "limit": 1,
-                            "app_id": Config.QOBUZ_APP_ID},
-                    headers=self._headers,
-                )
-                if r.status_code != 200:
-                    logger.warning(f"⚠️ Поиск вернул {r.status_code}: {r.text[:200]}")
-                    return None, None
-                items = r.json().get("tracks", {}).get("items", [])
-                if not items:
-                    logger.warning("⚠️ Треки не найдены")
-                    return None, None
-                track_id = items[0]["id"]
-                track_url = f"https://open.qobuz.com/track/{track_id}"
-                logger.info(f"✅ Найден трек ID={track_id}")
-
-            self._clear_download_dir()
-            command = [
-                str(self.rip_path), "-f", str(self.download_dir),
-                "-q", "4", "--no-db", "--no-progress", "url", track_url,
-            ]
-            return await self._run_rip(command, progress_callback)
+            track_id = await self.search_track(artist, title)
+            if not track_id:
+                return None, None
+            return await self.download_track(track_url(track_id), 27, job_dir, progress_callback)
+        except QobuzAuthError:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка при поиске и скачивании: {e}")
             return None, None
 
+    async def probe_quality(self, url: str, track_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Узнаёт через API максимальный формат трека (или альбома) до запуска rip:
+        {"quality_id", "bit_depth", "sampling_rate", "streamable"}.
+        None — если API не ответил, тогда вызывающий перебирает качества сам.
+        Ответы API кэшируются в self.metadata, так что повторная проба бесплатна.
+        """
+        if track_id:
+            info = await self.get_track_info(track_id)
+        elif "/album/" in url:
+            info = await self.get_album_info(url)
+        else:
+            item_id = self._extract_id(url)
+            info = await self.get_track_info(item_id) if item_id else None
+        if not info:
+            return None
+
+        bit_depth = info.get("maximum_bit_depth")
+        sampling_rate = info.get("maximum_sampling_rate")
+        return {
+            "quality_id": quality_from_format(bit_depth, sampling_rate, info.get("hires_streamable", True)),
+            "bit_depth": bit_depth,
+            "sampling_rate": sampling_rate,
+            "streamable": info.get("streamable", True),
+        }
+
+    async def resolve_track_id(self, url: str, track_index: Optional[int] = None) -> Optional[str]:
+        """ID конкретного трека по ссылке на трек или по ссылке на альбом + номеру трека."""
+        if "/track/" in url:
+            return self._extract_id(url)
+        if track_index is not None and "/album/" in url:
+            album_info = await self.get_album_info(url)
+            if album_info and len(album_info["tracks"]) >= track_index:
+                return album_info["tracks"][track_index - 1]["id"]
+        return None
+
     async def download_track(
         self,
         url: str,
         quality_id: int,
-        progress_callback: Optional[Callable[[float], Awaitable[None]]] = None,
-        track_index: Optional[int] = None,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
     ) -> Tuple[Optional[Path], Optional[Path]]:
+        if self.native is not None and "/track/" in url:
+            # Время собственной загрузки пишется в этап qobuz_stream, а не rip
+            audio_file, cover_file = await self.native.download(self._extract_id(url), quality_id, job_dir, progress_callback)
+            if audio_file:
+                return audio_file, cover_file
+
+        expected_size = None
+        if progress_callback and "/track/" in url:
+            info = await self.get_track_info(self._extract_id(url))
+            if info:
+                expected_size = estimate_size(info.get("duration"), quality_id, info.get("maximum_bit_depth"), info.get("maximum_sampling_rate"))
+        return await self._download_with_rip(url, quality_id, job_dir, progress_callback, expected_size)
+
+    @metrics.timed("rip")
+    async def _download_with_rip(
+        self,
+        download_url: str,
+        quality_id: int,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
+        expected_size: Optional[int] = None,
+    ) -> Tuple[Optional[Path], Optional[Path]]:
+        """Через резидентный воркер streamrip, а если его нет — запуском rip."""
         rip_quality = QOBUZ_TO_RIP_QUALITY.get(quality_id, 3)
-        logger.info(f"⬇️ Скачивание: {url} (rip quality={rip_quality})")
+        logger.info(f"⬇️ Скачивание: {download_url} (rip quality={rip_quality})")
 
-        download_url = url
-        if track_index is not None and "/album/" in url:
-            album_info = await self.get_album_info(url)
-            if album_info and len(album_info["tracks"]) >= track_index:
-                track_id = album_info["tracks"][track_index - 1]["id"]
-                download_url = f"https://open.qobuz.com/track/{track_id}"
-                logger.info(f"🎵 Трек №{track_index}: ID={track_id}")
+        if self.rip_pool is not None and self.rip_pool.available:
+            result = await self._run_worker(download_url, rip_quality, job_dir, progress_callback, expected_size)
+            if result is not None:
+                return result
 
-        self._clear_download_dir()
         command = [
-            str(self.rip_path), "-f", str(self.download_dir),
+            str(self.rip_path), "-f", str(job_dir),
             "-q", str(rip_quality), "--no-db", "--no-progress",
             "url", download_url,
         ]
-        return await self._run_rip(command, progress_callback)
+        return await self._run_rip(command, job_dir, progress_callback, expected_size)
 
     def _extract_id(self, url: str) -> Optional[str]:
         m = re.search(r'/(?:album|track)/(\w+)', url)
         return m.group(1) if m else None
 
-    def _clear_download_dir(self):
-        for item in self.download_dir.glob("**/*"):
-            if item.is_file():
-                item.unlink()
-            elif item.is_dir():
-                shutil.rmtree(item)
+    async def _run_worker(
+        self,
+        url: str,
+        rip_quality: int,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
+        expected_size: Optional[int] = None,
+    ) -> Optional[Tuple[Optional[Path], Optional[Path]]]:
+        """Загрузка через воркер streamrip; None — воркер недоступен, качаем через rip."""
+        if progress_callback:
+            await progress_callback(0, expected_size)
+        existing = set(job_dir.iterdir()) if job_dir.exists() else set()
+        watcher = asyncio.create_task(self._watch_progress(job_dir, expected_size, progress_callback)) if progress_callback else None
+        try:
+            reply = await self.rip_pool.download(url, rip_quality, job_dir)
+        finally:
+            if watcher:
+                watcher.cancel()
+
+        if reply is None:
+            # Недокачанное упавшим воркером убираем, чтобы rip не нашёл обрывок
+            leftovers = set(job_dir.iterdir()) - existing if job_dir.exists() else set()
+            for path in leftovers:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+            return None
+        if not reply.get("ok"):
+            logger.error(f"❌ Воркер streamrip не скачал {url}: {reply.get('error')}")
+            metrics.error("rip")
+            if reply.get("auth"):
+                raise QobuzAuthError("Токен Qobuz истёк или недействителен")
+            return None, None
+        logger.info("✅ Воркер streamrip завершил загрузку. Ищем файл...")
+        return await self._collect_download(job_dir, progress_callback)
 
     async def _run_rip(
         self,
         command: list,
-        progress_callback: Optional[Callable[[float], Awaitable[None]]] = None,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
+        expected_size: Optional[int] = None,
     ) -> Tuple[Optional[Path], Optional[Path]]:
         if progress_callback:
-            await progress_callback(5.0)
+            await progress_callback(0, expected_size)
 
         process = await asyncio.create_subprocess_exec(
             *command,
@@ -149,56 +469,75 @@ class QobuzDownloader:
             stderr=asyncio.subprocess.STDOUT,
         )
 
+        # Вывод rip без TTY не содержит байтового прогресса, поэтому считаем,
+        # сколько байт уже записано в папку задачи
+        watcher = asyncio.create_task(self._watch_progress(job_dir, expected_size, progress_callback)) if progress_callback else None
         all_output = []
-        while True:
-            line_bytes = await process.stdout.readline()
-            if not line_bytes:
-                break
-            line = re.sub(r'\x1b\[[0-9;]*[mGKHF]', '', line_bytes.decode("utf-8", errors="ignore")).strip()
-            if line:
-                all_output.append(line)
-                logger.debug(f"rip: {line}")
+        try:
+            while True:
+                line_bytes = await process.stdout.readline()
+                if not line_bytes:
+                    break
+                line = re.sub(r'\x1b\[[0-9;]*[mGKHF]', '', line_bytes.decode("utf-8", errors="ignore")).strip()
+                if line:
+                    all_output.append(line)
+                    logger.debug(f"rip: {line}")
 
-        await process.wait()
+            await process.wait()
+        except asyncio.CancelledError:
+            # Задачу отменили — не оставляем rip писать в уже удалённую папку
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        finally:
+            if watcher:
+                watcher.cancel()
 
         if process.returncode != 0:
             output_text = "\n".join(all_output)
             logger.error(f"❌ rip завершился с ошибкой (код {process.returncode}):\n{output_text}")
+            metrics.error("rip")
             if "AuthenticationError" in output_text or "Invalid credentials" in output_text or "authentication" in output_text.lower():
                 raise QobuzAuthError("Токен Qobuz истёк или недействителен")
             return None, None
 
         logger.info("✅ rip завершён. Ищем файл...")
-        if progress_callback:
-            await progress_callback(100.0)
-        return self._find_downloaded_files()
+        return await self._collect_download(job_dir, progress_callback)
+
+    async def _collect_download(self, job_dir: Path, progress_callback: Optional[ProgressCallback]) -> Tuple[Optional[Path], Optional[Path]]:
+        audio_file, cover_file = self._find_downloaded_files(job_dir)
+        if audio_file:
+            size = audio_file.stat().st_size
+            metrics.add_bytes("rip", size)
+            if progress_callback:
+                await progress_callback(size, size)
+        return audio_file, cover_file
+
+    @staticmethod
+    async def _watch_progress(job_dir: Path, expected_size: Optional[int], progress_callback: ProgressCallback):
+        last_size = 0
+        while True:
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+            size = await asyncio.to_thread(_dir_size, job_dir)
+            if size == last_size:
+                continue
+            last_size = size
+            try:
+                await progress_callback(size, expected_size)
+            except Exception as e:
+                logger.debug(f"Ошибка в progress_callback: {e}")
 
-    def _find_downloaded_files(self) -> Tuple[Optional[Path], Optional[Path]]:
-        for f in self.download_dir.glob("**/*.*"):
+    def _find_downloaded_files(self, job_dir: Path) -> Tuple[Optional[Path], Optional[Path]]:
+        # Ищем только внутри папки своей задачи — чужие загрузки сюда не попадают
+        for f in sorted(job_dir.glob("**/*.*")):
             if f.is_file() and f.suffix in {".flac", ".mp3", ".m4a", ".wav"}:
                 try:
-                    f.resolve().relative_to(self.download_dir.resolve())
+                    f.resolve().relative_to(job_dir.resolve())
                 except ValueError:
                     logger.warning(f"Попытка обхода каталога! Файл '{f}' вне директории.")
                     continue
+                # Обложку, встроенную в файл, при необходимости достаёт AudioProbe
                 cover_files = list(f.parent.glob("*.jpg")) + list(f.parent.glob("*.png"))
-                cover_file = cover_files[0] if cover_files else self._extract_cover(f)
-                return f, cover_file if cover_file and cover_file.exists() else None
+                return f, cover_files[0] if cover_files else None
         return None, None
-
-    def _extract_cover(self, audio_path: Path) -> Optional[Path]:
-        try:
-            import mutagen
-            audio = mutagen.File(audio_path)
-            if not audio:
-                return None
-            pictures = getattr(audio, "pictures", [])
-            if not pictures:
-                return None
-            cover_path = audio_path.parent / "cover.jpg"
-            cover_path.write_bytes(pictures[0].data)
-            logger.info(f"🖼️ Обложка извлечена из {audio_path.name}")
-            return cover_path
-        except Exception as e:
-            logger.warning(f"⚠️ Не удалось извлечь обложку: {e}")
-            return None
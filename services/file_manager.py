@@ -2,7 +2,6 @@ from pathlib import Path
 from typing import Optional
 import os
 import logging
-import mutagen
 
 logger = logging.getLogger(__name__)
 
@@ -24,40 +23,31 @@ class FileManager:
     def get_audio_quality(file_path: Path) -> Optional[str]:
         """
         Анализирует аудиофайл и возвращает строку с его качеством.
-        Например: '24-bit / 192.0 kHz'
+        Например: '24-bit / 192 kHz'
         """
-        try:
-            audio = mutagen.File(file_path)
-            if not audio:
-                return None
-            
-            bit_depth = getattr(audio.info, 'bits_per_sample', None)
-            sample_rate = audio.info.sample_rate
+        from services.audio_probe import AudioProbe
+        return AudioProbe(file_path).quality
 
-            if not bit_depth:
-                # Для MP3 и некоторых других форматов нет bits_per_sample,
-                # можно использовать bitrate в качестве альтернативы.
-                bitrate = getattr(audio.info, 'bitrate', 0)
-                if bitrate > 0:
-                    return f"MP3 / {bitrate // 1000} kbps"
-                return None
-
-            sample_rate_khz = sample_rate / 1000
-            # Убираем .0 для целых чисел, например 44.1, но 96
-            if sample_rate_khz.is_integer():
-                sample_rate_str = str(int(sample_rate_khz))
-            else:
-                sample_rate_str = str(sample_rate_khz)
-
-            return f"{bit_depth}-bit / {sample_rate_str} kHz"
-            
-        except Exception as e:
-            logger.error(f"Не удалось прочитать метаданные из файла {file_path}: {e}")
-            return None
+    @staticmethod
+    def format_size(size_bytes: float) -> str:
+        """Человекочитаемый размер: 512 КБ, 38.4 МБ"""
+        if size_bytes < 1024 * 1024:
+            return f"{size_bytes / 1024:.0f} КБ"
+        return f"{size_bytes / (1024 * 1024):.1f} МБ"
 
     @staticmethod
-    def format_progress_bar(percent: float, length: int = 10) -> str:
-        """Форматирует текстовый прогресс-бар: [████░░░░░░] 40%"""
+    def format_progress_bar(percent: float, length: int = 10, speed: Optional[float] = None, eta: Optional[float] = None) -> str:
+        """
+        Форматирует текстовый прогресс-бар: [████░░░░░░] 40.0%
+        Со скоростью (байт/с) и ETA (сек): [████░░░░░░] 40.0% • 2.4 МБ/с • ~0:41
+        """
+        percent = min(max(percent, 0.0), 100.0)
         filled_length = int(length * percent // 100)
         bar = '█' * filled_length + '░' * (length - filled_length)
-        return f"[{bar}] {percent:.1f}%"
+        text = f"[{bar}] {percent:.1f}%"
+        if speed:
+            text += f" • {FileManager.format_size(speed)}/с"
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            text += f" • ~{minutes}:{seconds:02d}"
+        return text
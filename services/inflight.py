@@ -0,0 +1,156 @@
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from services.file_manager import FileManager
+import asyncio
+import logging
+import shutil
+
+logger = logging.getLogger(__name__)
+
+StatusListener = Callable[[str], None]
+
+
+class SharedFiles:
+    """
+    Скачанные файлы, которыми может воспользоваться не только скачавший.
+    Каждый потребитель держит ссылку; FileManager.safe_remove вызывается,
+    когда отпущена последняя. folder — рабочая папка скачавшего: если он
+    закончил раньше остальных, папку удаляет последний отпустивший.
+    """
+
+    def __init__(self, *paths: Optional[Path], folder: Optional[Path] = None):
+        self.paths = [path for path in paths if path]
+        self.folder = folder
+        self._refs = 1
+
+    @property
+    def released(self) -> bool:
+        return self._refs == 0
+
+    def retain(self):
+        self._refs += 1
+
+    def release(self):
+        self._refs -= 1
+        if self._refs == 0:
+            for path in self.paths:
+                FileManager.safe_remove(path)
+            if self.folder:
+                shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class Flight:
+    """
+    Выполняющаяся загрузка трека, к которой присоединяются такие же запросы.
+    Ведущий публикует статус (его видят все ждущие) и по завершении отдаёт
+    запись кэша доставки — ждущие пересылают трек по file_id. Если ведущий
+    не смог отправить уже скачанный файл, файл забирает первый ждущий.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.status: Optional[str] = None
+        self.entry: Optional[Dict] = None
+        self.followers = 0
+        # Ждущие, готовые забрать файл ведущего (ждущие из альбома его не берут)
+        self._takers = 0
+        self._done = asyncio.Event()
+        self._listeners: List[StatusListener] = []
+        # Готовый файл для передачи: (файлы, audio, cover, metadata)
+        self._handoff: Optional[Tuple[SharedFiles, Path, Optional[Path], Optional[Dict]]] = None
+        # Держит ли сам рейс ссылку на файлы — для ждущих, которые их ещё не забрали
+        self._holds_files = False
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def publish(self, text: str):
+        self.status = text
+        for listener in list(self._listeners):
+            listener(text)
+
+    def subscribe(self, listener: StatusListener) -> Callable[[], None]:
+        self._listeners.append(listener)
+        if self.status:
+            listener(self.status)
+        return lambda: self._listeners.remove(listener)
+
+    def offer(self, files: SharedFiles, audio_file: Path, cover_file: Optional[Path], metadata: Optional[Dict]):
+        """Скачанный файл: пригодится ждущим, если ведущий не сможет его отправить."""
+        self._handoff = (files, audio_file, cover_file, metadata)
+        if self._takers:
+            self._hold_files()
+
+    def _hold_files(self):
+        if self._handoff and not self._holds_files:
+            self._handoff[0].retain()
+            self._holds_files = True
+
+    def _drop_files(self):
+        if self._holds_files:
+            self._holds_files = False
+            self._handoff[0].release()
+
+    def _join(self, takes_files: bool):
+        self.followers += 1
+        if takes_files:
+            self._takers += 1
+            self._hold_files()
+
+    def leave(self, takes_files: bool = True):
+        """Ждущий ушёл (получил трек, забрал файл или был отменён)."""
+        self.followers -= 1
+        if takes_files:
+            self._takers -= 1
+            if self._takers == 0 and self.done:
+                self._drop_files()
+
+    def claim(self) -> Optional[Tuple[SharedFiles, Path, Optional[Path], Optional[Dict]]]:
+        """Первый ждущий после неудачи ведущего забирает файл вместе со ссылкой рейса."""
+        if self.entry is not None or not self._holds_files:
+            return None
+        self._holds_files = False
+        handoff, self._handoff = self._handoff, None
+        return handoff
+
+    async def wait(self) -> Optional[Dict]:
+        await self._done.wait()
+        return self.entry
+
+    def _finish(self, entry: Optional[Dict]):
+        self.entry = entry
+        self._done.set()
+        if entry is not None or self._takers == 0:
+            self._drop_files()
+
+
+class InflightRegistry:
+    """Рейсы по ключу кэша доставки (источник, ID трека, качество)."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def join(self, key: str, takes_files: bool = True) -> Tuple[Flight, bool]:
+        """
+        (рейс, ведущий ли). Ведущий обязан один раз вызвать finish(), ждущий — leave()
+        с тем же takes_files: без него ждущий не держит и не забирает файл ведущего.
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            flight._join(takes_files)
+            logger.info(f"👥 Запрос присоединился к загрузке {key} (ждущих: {flight.followers})")
+            return flight, False
+        flight = self._flights[key] = Flight(key)
+        return flight, True
+
+    def finish(self, flight: Flight, entry: Optional[Dict] = None):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight._finish(entry)
+
+    def stats(self) -> dict:
+        return {
+            "flights": len(self._flights),
+            "followers": sum(flight.followers for flight in self._flights.values()),
+        }
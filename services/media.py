@@ -0,0 +1,360 @@
+from pathlib import Path
+from typing import List, Optional, Callable, Awaitable
+from config import Config
+from services import metrics
+from services.audio_probe import AudioProbe, format_quality
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Минимальный шаг прогресса (в процентах), о котором стоит сообщать
+_PROGRESS_STEP = 5.0
+# Lossy-варианты для файлов больше лимита Telegram, от лучшего к худшему
+_LOSSY_LADDER = (("mp3", 320), ("aac", 256), ("aac", 192), ("aac", 128))
+# Теги, обложка и заголовки контейнера поверх оценки по битрейту
+_CONTAINER_OVERHEAD = 1024 * 1024
+
+
+class MediaError(Exception):
+    pass
+
+
+class TranscodePlan:
+    """Во что перекодировать файл, чтобы он влез в лимит, и оценка размера результата."""
+
+    __slots__ = ("codec", "bit_depth", "sample_rate", "bitrate_kbps", "estimated_size")
+
+    _SUFFIXES = {"flac": ".flac", "aac": ".m4a", "mp3": ".mp3"}
+
+    def __init__(self, codec: str, estimated_size: int, bit_depth: Optional[int] = None,
+                 sample_rate: Optional[int] = None, bitrate_kbps: Optional[int] = None):
+        self.codec = codec
+        self.estimated_size = estimated_size
+        self.bit_depth = bit_depth
+        self.sample_rate = sample_rate
+        self.bitrate_kbps = bitrate_kbps
+
+    @property
+    def suffix(self) -> str:
+        return self._SUFFIXES[self.codec]
+
+    @property
+    def quality(self) -> str:
+        if self.codec == "flac":
+            return format_quality(self.bit_depth, self.sample_rate / 1000)
+        return f"{self.codec.upper()} / {self.bitrate_kbps} kbps"
+
+    def ffmpeg_args(self) -> list:
+        """Аргументы кодирования в файл."""
+        if self.codec == "flac":
+            return [
+                "-map", "0:a:0", "-map", "0:v?", "-c:v", "copy",
+                "-af", f"aresample={self.sample_rate}:dither_method=triangular",
+                "-sample_fmt", "s16", "-c:a", "flac", "-f", "flac",
+            ]
+        if self.codec == "aac":
+            # Обложку в MP4 через ffmpeg не копируем: она уходит отдельным фото
+            return [
+                "-map", "0:a:0", "-c:a", "aac", "-b:a", f"{self.bitrate_kbps}k", "-f", "mp4",
+                "-movflags", "+faststart",
+            ]
+        return [
+            "-map", "0:a:0", "-map", "0:v?", "-c:v", "copy",
+            "-c:a", "libmp3lame", "-b:a", f"{self.bitrate_kbps}k", "-id3v2_version", "3", "-f", "mp3",
+        ]
+
+
+def plan_transcode(size: int, limit: int, duration: Optional[float],
+                   bit_depth: Optional[int] = None, sample_rate: Optional[int] = None) -> Optional[TranscodePlan]:
+    """
+    Лучший формат, который по оценке влезет в limit: сначала FLAC 16 бит
+    (с исходной частотой, потом 48/44.1 кГц), затем AAC/MP3 с наибольшим
+    подходящим битрейтом. None — не влезет ничего, и кодировать незачем.
+    """
+    return next(iter(transcode_plans(size, limit, duration, bit_depth, sample_rate)), None)
+
+
+def transcode_plans(size: int, limit: int, duration: Optional[float],
+                    bit_depth: Optional[int] = None, sample_rate: Optional[int] = None) -> List[TranscodePlan]:
+    """Все форматы, которые по оценке влезут в limit, от лучшего к худшему."""
+    budget = limit * Config.TRANSCODE_SIZE_MARGIN
+    candidates = []
+    if bit_depth and sample_rate:
+        # Размер FLAC почти пропорционален разрядности и частоте; младшие биты
+        # хуже всего сжимаются, так что оценка получается с запасом
+        base_rate = 48000 if sample_rate % 48000 == 0 else 44100
+        for target_bits, target_rate in ((16, sample_rate), (16, min(sample_rate, base_rate))):
+            target_bits = min(target_bits, bit_depth)
+            if (target_bits, target_rate) == (bit_depth, sample_rate):
+                continue
+            ratio = target_bits / bit_depth * target_rate / sample_rate
+            candidates.append(TranscodePlan("flac", int(size * ratio), target_bits, target_rate))
+    if duration:
+        for codec, kbps in _LOSSY_LADDER:
+            estimated = int(duration * kbps * 1000 / 8) + _CONTAINER_OVERHEAD
+            candidates.append(TranscodePlan(codec, estimated, bitrate_kbps=kbps))
+    return [plan for plan in candidates if plan.estimated_size <= budget]
+
+
+class Transcoded:
+    """Результат перекодирования: файл рядом с исходником и план, по которому он получен."""
+
+    __slots__ = ("plan", "path")
+
+    def __init__(self, plan: TranscodePlan, path: Path):
+        self.plan = plan
+        self.path = path
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+
+def snippet_offset(duration: Optional[float], window: float) -> float:
+    """
+    С какого места резать фрагмент для распознавания.
+    Короткие записи (голосовые) берём с начала, у длинных пропускаем вступление:
+    примерно треть длительности, но так, чтобы фрагмент целиком влез.
+    """
+    if not duration or duration <= window + 5:
+        return 0.0
+    return max(0.0, min(duration * 0.3, duration - window))
+
+
+def _embed_cover_tags(audio_path: Path, cover_path: Path) -> bool:
+    """
+    Встраивает обложку правкой тегов на месте, без перекодирования аудиопотока.
+    False — формат не поддерживается, нужен ffmpeg.
+    """
+    data = cover_path.read_bytes()
+    is_png = cover_path.suffix.lower() == ".png"
+    mime = "image/png" if is_png else "image/jpeg"
+    suffix = audio_path.suffix.lower()
+
+    if suffix == ".flac":
+        from mutagen.flac import FLAC, Picture
+        audio = FLAC(audio_path)
+        picture = Picture()
+        picture.type = 3  # Front cover
+        picture.mime = mime
+        picture.data = data
+        audio.clear_pictures()
+        audio.add_picture(picture)
+        audio.save()
+    elif suffix == ".mp3":
+        from mutagen.id3 import ID3, APIC, ID3NoHeaderError
+        try:
+            tags = ID3(audio_path)
+        except ID3NoHeaderError:
+            tags = ID3()
+        tags.delall("APIC")
+        tags.add(APIC(encoding=3, mime=mime, type=3, desc="Cover", data=data))
+        tags.save(audio_path, v2_version=3)
+    elif suffix == ".m4a":
+        from mutagen.mp4 import MP4, MP4Cover
+        audio = MP4(audio_path)
+        image_format = MP4Cover.FORMAT_PNG if is_png else MP4Cover.FORMAT_JPEG
+        audio["covr"] = [MP4Cover(data, imageformat=image_format)]
+        audio.save()
+    else:
+        return False
+    return True
+
+
+class MediaProcessor:
+    """
+    Обработка аудио без блокировки event loop: ffmpeg запускается как
+    asyncio-подпроцесс, одновременно — не больше FFMPEG_WORKERS процессов,
+    остальные ждут в очереди. У каждой задачи свой таймаут.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or Config.FFMPEG_WORKERS or os.cpu_count() or 1
+        self._slots = asyncio.Semaphore(self.workers)
+        self.queued = 0
+        self.running = 0
+        logger.info(f"✅ Пул ffmpeg инициализирован: {self.workers} воркеров")
+
+    async def run_ffmpeg(
+        self,
+        args: list,
+        timeout: Optional[float] = None,
+        duration: Optional[float] = None,
+        progress_callback: Optional[Callable[[float], Awaitable[None]]] = None,
+        expected_size: Optional[int] = None,
+    ):
+        """
+        Запускает ffmpeg в пуле. При ошибке или таймауте бросает MediaError.
+        Прогресс считается по времени выхода (duration) либо по размеру (expected_size).
+        """
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            await self._run(args, timeout or Config.FFMPEG_TIMEOUT, duration, expected_size, progress_callback)
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    async def _run(self, args, timeout, duration, expected_size, progress_callback):
+        track_progress = bool(progress_callback and (duration or expected_size))
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+        if track_progress:
+            # Машиночитаемый прогресс в stdout: строки вида out_time_us=...
+            command += ["-progress", "pipe:1", "-nostats"]
+        process = await asyncio.create_subprocess_exec(
+            *command, *args,
+            stdout=asyncio.subprocess.PIPE if track_progress else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def report(percent: float, last_reported: float) -> float:
+            percent = min(100.0, percent)
+            if percent - last_reported < _PROGRESS_STEP:
+                return last_reported
+            try:
+                await progress_callback(percent)
+            except Exception:
+                pass
+            return percent
+
+        async def read_progress():
+            last_reported = 0.0
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                key, _, value = line.decode("utf-8", errors="ignore").strip().partition("=")
+                if not value.isdigit():
+                    # out_time_us=N/A бывает, когда в выход копируется обложка
+                    continue
+                if key == "out_time_us" and duration:
+                    percent = int(value) / 1_000_000 / duration * 100
+                elif key == "total_size" and expected_size:
+                    percent = int(value) / expected_size * 100
+                else:
+                    continue
+                last_reported = await report(percent, last_reported)
+
+        try:
+            readers = [process.stderr.read()]
+            if track_progress:
+                readers.append(read_progress())
+            results = await asyncio.wait_for(asyncio.gather(*readers, process.wait()), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise MediaError(f"ffmpeg не уложился в {timeout} с")
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        if process.returncode != 0:
+            stderr = results[0].decode("utf-8", errors="ignore").strip()
+            raise MediaError(stderr or f"ffmpeg вернул код {process.returncode}")
+
+    @metrics.timed("embed_cover")
+    async def embed_cover(self, audio_path: Optional[Path], cover_path: Optional[Path], probe: Optional[AudioProbe] = None):
+        if not (audio_path and cover_path and audio_path.exists() and cover_path.exists()):
+            return
+        if probe is not None and await asyncio.to_thread(lambda: probe.has_picture):
+            # rip обычно уже встроил обложку — не переписываем файл
+            logger.info(f"🖼️ Обложка уже встроена в {audio_path.name}")
+            return
+        logger.info(f"🖼️ Встраивание обложки {cover_path.name} в файл {audio_path.name}...")
+        try:
+            # Правка тегов — это только запись метаданных, аудиопоток не трогаем
+            if await asyncio.to_thread(_embed_cover_tags, audio_path, cover_path):
+                logger.info("✅ Обложка встроена в теги.")
+                return
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось встроить обложку через теги, пробую ffmpeg: {e}")
+
+        temp_output_path = audio_path.with_suffix(f".temp{audio_path.suffix}")
+        try:
+            await self.run_ffmpeg([
+                "-i", str(audio_path), "-i", str(cover_path), "-map", "0:a",
+                "-map", "1:v", "-c", "copy", "-disposition:v:0", "attached_pic",
+                "-id3v2_version", "3", str(temp_output_path),
+            ])
+            os.replace(temp_output_path, audio_path)
+            logger.info("✅ Обложка успешно встроена.")
+        except MediaError as e:
+            logger.error(f"❌ Не удалось встроить обложку с помощью ffmpeg: {e}")
+            metrics.error("embed_cover")
+        finally:
+            if temp_output_path.exists():
+                temp_output_path.unlink()
+
+    @metrics.timed("transcode")
+    async def transcode_to_fit(
+        self,
+        file_path: Path,
+        probe: AudioProbe,
+        limit: int,
+        progress_callback: Optional[Callable[[float], Awaitable[None]]] = None,
+    ) -> Optional[Transcoded]:
+        """
+        Перекодирует файл в лучший формат, который влезет в limit байт (см. plan_transcode).
+        Если результат всё же больше лимита (оценка ошиблась), пробует следующий формат.
+        Результат пишется рядом с исходником — в рабочую папку задачи; удаляет его вызывающий.
+        None — если не влезает ничего или ffmpeg завершился с ошибкой.
+        """
+        size = file_path.stat().st_size
+        duration, bit_depth, sample_rate = await asyncio.to_thread(
+            lambda: (probe.duration, probe.bit_depth, probe.sample_rate))
+        plans = transcode_plans(size, limit, duration, bit_depth, sample_rate)
+        if not plans:
+            logger.warning(f"⚠️ {file_path.name} не влезет в лимит ни в одном формате (длительность {duration} с)")
+            metrics.error("transcode")
+            return None
+
+        for plan in plans:
+            logger.info(f"🎵 Перекодирование {file_path.name} в {plan.quality} (оценка {plan.estimated_size / 1024 / 1024:.0f} МБ)...")
+            output_path = file_path.with_name(f"{file_path.stem}.fit{plan.suffix}")
+            args = ["-i", str(file_path), *plan.ffmpeg_args(), str(output_path)]
+            try:
+                # С обложкой ffmpeg не сообщает out_time, поэтому прогресс — и по оценке размера
+                await self.run_ffmpeg(args, duration=duration, progress_callback=progress_callback,
+                                      expected_size=plan.estimated_size)
+            except MediaError as e:
+                logger.error(f"❌ Ошибка перекодирования ffmpeg: {e}")
+                metrics.error("transcode")
+                output_path.unlink(missing_ok=True)
+                return None
+
+            result = Transcoded(plan, output_path)
+            if result.size <= limit:
+                logger.info(f"✅ Файл перекодирован в {plan.quality}: {result.size / 1024 / 1024:.1f} МБ")
+                metrics.add_bytes("transcode", result.size)
+                return result
+            logger.warning(f"⚠️ {file_path.name} в {plan.quality} всё равно больше лимита: {result.size} байт, пробую следующий формат")
+            output_path.unlink(missing_ok=True)
+
+        logger.error(f"❌ {file_path.name} не влез в лимит ни в одном из {len(plans)} форматов")
+        metrics.error("transcode")
+        return None
+
+    @metrics.timed("recognition_snippet")
+    async def extract_recognition_snippet(self, source: Path, dest: Path, duration: Optional[float] = None) -> Path:
+        """Вырезает короткий моно-фрагмент с низким битрейтом — этого достаточно для отпечатка."""
+        window = Config.RECOGNITION_SNIPPET_SECONDS
+        offset = snippet_offset(duration, window)
+        await self.run_ffmpeg([
+            # -ss перед -i: быстрый поиск без декодирования начала файла
+            "-ss", f"{offset:.2f}", "-t", str(window), "-i", str(source),
+            "-vn", "-ac", "1", "-ar", "44100",
+            "-acodec", "libmp3lame", "-b:a", Config.RECOGNITION_BITRATE,
+            str(dest),
+        ], timeout=60)
+        logger.info(f"✂️ Фрагмент для распознавания: {offset:.1f}–{offset + window:.1f} с из {source.name}")
+        return dest
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "running": self.running, "queued": self.queued}
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, TYPE_CHECKING
+import asyncio
+import json
+import logging
+import os
+import time
+
+if TYPE_CHECKING:
+    from services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Как часто (не чаще) сбрасывать кэш на диск при записи
+_SAVE_INTERVAL = 60
+
+
+class TTLCache:
+    """
+    LRU-кэш с временем жизни записей.
+    Параллельные get_or_fetch по одному ключу схлопываются в один запрос.
+    Если указан path, содержимое переживает перезапуск (JSON на диске).
+    С store — записи хранятся в таблице кэшей хранилища состояния под
+    namespace, на диск уходят только изменённые ключи, а JSON из path
+    (старый формат) один раз переносится в хранилище.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600,
+        path: Optional[Path] = None,
+        store: Optional["StateStore"] = None,
+        namespace: Optional[str] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.store = store
+        self.namespace = namespace
+        # Изменения с последнего сброса в хранилище
+        self._changed: Set[str] = set()
+        self._removed: Set[str] = set()
+        # key -> (unix-время истечения, значение)
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._dirty = False
+        self._last_save = time.time()
+        self.hits = 0
+        self.misses = 0
+        if self.store:
+            self._load_store()
+        elif self.path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._data[key]
+            self._forget(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.time() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        self._changed.add(key)
+        self._removed.discard(key)
+        while len(self._data) > self.maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            self._forget(evicted)
+        self._dirty = True
+        self._maybe_save()
+
+    def invalidate(self, key: str):
+        if self._data.pop(key, None) is not None:
+            self._forget(key)
+            self._dirty = True
+
+    def _forget(self, key: str):
+        self._changed.discard(key)
+        self._removed.add(key)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """
+        Значение из кэша или результат fetch(). None не кэшируется.
+        fetch выполняется в отдельной задаче кэша, а не в задаче первого
+        вызвавшего: его отмена (/cancel) не обрывает запрос остальным ждущим.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, fetch, ttl))
+            # Помечаем исключение как полученное, даже если ждущих не осталось
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float]) -> Any:
+        try:
+            value = await fetch()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total * 100) if total else 0.0,
+        }
+
+    def save(self):
+        if not self._dirty:
+            return
+        if self.store:
+            upserts = {key: (self._data[key][1], self._data[key][0]) for key in self._changed if key in self._data}
+            self.store.write_cache(self.namespace, upserts, list(self._removed))
+            self._changed.clear()
+            self._removed.clear()
+            self._dirty = False
+            self._last_save = time.time()
+            return
+        if not self.path:
+            return
+        now = time.time()
+        payload = {k: [exp, v] for k, (exp, v) in self._data.items() if exp > now}
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(json.dumps(payload, ensure_ascii=False))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = now
+        except (OSError, TypeError) as e:
+            logger.warning(f"Не удалось сохранить кэш {self.path.name}: {e}")
+
+    def _maybe_save(self):
+        if (self.path or self.store) and time.time() - self._last_save > _SAVE_INTERVAL:
+            self.save()
+
+    def _load(self):
+        try:
+            if not self.path.exists():
+                return
+            now = time.time()
+            for key, (expires_at, value) in json.loads(self.path.read_text()).items():
+                if expires_at > now:
+                    self._data[key] = (expires_at, value)
+            logger.info(f"✅ Кэш {self.path.name} загружен: {len(self._data)} записей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша {self.path.name}: {e}")
+            self._data.clear()
+
+    def _load_store(self):
+        try:
+            if self.path and self.path.exists():
+                self._load()
+                self._changed.update(self._data)
+                self._dirty = True
+                self.save()
+                os.replace(self.path, self.path.with_suffix(".json.migrated"))
+                logger.info(f"📦 Кэш {self.path.name} перенесён в хранилище состояния")
+            for key, value, expires_at in self.store.load_cache(self.namespace):
+                self._data[key] = (expires_at, value)
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self._forget(evicted)
+            logger.info(f"✅ Кэш {self.namespace} загружен: {len(self._data)} записей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша {self.namespace}: {e}")
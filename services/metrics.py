@@ -0,0 +1,185 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import functools
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы длительностей (секунды)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Сколько последних замеров этапа хранить для p50/p95/p99
+RESERVOIR_SIZE = 1024
+
+# (имя метрики, метки, значение) — так отдают текущие значения сборщики
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "total", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent: Deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+# Этап -> гистограмма длительностей
+_durations: Dict[str, _Histogram] = defaultdict(_Histogram)
+# Этап -> переданные байты
+_bytes: Dict[str, int] = defaultdict(int)
+# Этап -> число ошибок
+_errors: Dict[str, int] = defaultdict(int)
+# Функции, отдающие текущие значения (очереди, кэши)
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+
+def observe(stage: str, seconds: float):
+    _durations[stage].observe(seconds)
+
+
+def add_bytes(stage: str, size: Optional[int]):
+    if size:
+        _bytes[stage] += size
+
+
+def error(stage: str):
+    _errors[stage] += 1
+
+
+@contextmanager
+def timer(stage: str):
+    """Замеряет длительность блока; исключение засчитывается как ошибка этапа."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        error(stage)
+        raise
+    finally:
+        observe(stage, time.monotonic() - started)
+
+
+def timed(stage: str):
+    """Декоратор для корутин: то же, что timer(), на весь вызов."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timer(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector: Callable[[], Iterable[Sample]]):
+    _collectors.append(collector)
+
+
+def summary() -> Dict[str, dict]:
+    """p50/p95/p99 и счётчики по этапам (для /stats)."""
+    stages = sorted(set(_durations) | set(_bytes) | set(_errors))
+    result = {}
+    for stage in stages:
+        hist = _durations.get(stage)
+        result[stage] = {
+            "count": hist.count if hist else 0,
+            "p50": hist.percentile(50) if hist else None,
+            "p95": hist.percentile(95) if hist else None,
+            "p99": hist.percentile(99) if hist else None,
+            "bytes": _bytes.get(stage, 0),
+            "errors": _errors.get(stage, 0),
+        }
+    return result
+
+
+def collect() -> List[Sample]:
+    samples: List[Sample] = []
+    for collector in _collectors:
+        try:
+            samples.extend(collector())
+        except Exception as e:
+            logger.debug(f"Сборщик метрик упал: {e}")
+    return samples
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = [
+        "# HELP musicbot_stage_duration_seconds Длительность этапов обработки",
+        "# TYPE musicbot_stage_duration_seconds histogram",
+    ]
+    for stage, hist in sorted(_durations.items()):
+        for bound, count in zip(DURATION_BUCKETS, hist.buckets):
+            lines.append(f'musicbot_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'musicbot_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+        lines.append(f'musicbot_stage_duration_seconds_sum{{stage="{stage}"}} {hist.total:.6f}')
+        lines.append(f'musicbot_stage_duration_seconds_count{{stage="{stage}"}} {hist.count}')
+
+    lines += ["# TYPE musicbot_stage_bytes_total counter"]
+    lines += [f'musicbot_stage_bytes_total{{stage="{stage}"}} {value}' for stage, value in sorted(_bytes.items())]
+    lines += ["# TYPE musicbot_stage_errors_total counter"]
+    lines += [f'musicbot_stage_errors_total{{stage="{stage}"}} {value}' for stage, value in sorted(_errors.items())]
+
+    declared = set()
+    for name, labels, value in collect():
+        if name not in declared:
+            lines.append(f"# TYPE {name} gauge")
+            declared.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus."""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,354 @@
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple, TYPE_CHECKING
+from config import Config
+from services.downloader import QOBUZ_API, ProgressCallback, QobuzAuthError
+from services import metrics
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import weakref
+import httpx
+
+if TYPE_CHECKING:
+    from services.downloader import QobuzDownloader
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_DIR_NAME = "partial"
+# Данные куска копятся в памяти до такого объёма и пишутся одним pwrite
+_WRITE_BUFFER = 1024 * 1024
+# Повторов на один кусок; каждый продолжает с последнего записанного байта
+_CHUNK_RETRIES = 5
+# CDN отвечает на просроченную подписанную ссылку этими кодами
+_EXPIRED_STATUSES = {401, 403, 410}
+
+
+class QobuzStreamError(Exception):
+    pass
+
+
+def request_signature(track_id: str, format_id: int, timestamp: str) -> str:
+    """Подпись track/getFileUrl: md5 от имени метода, параметров по алфавиту, времени и секрета."""
+    payload = f"trackgetFileUrlformat_id{format_id}intentstreamtrack_id{track_id}{timestamp}{Config.QOBUZ_APP_SECRET}"
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+class _Journal:
+    """
+    Какие куски файла уже на диске. Сохраняется после каждого куска
+    (после fdatasync данных), поэтому переживает обрыв связи и перезапуск бота.
+    """
+
+    __slots__ = ("path", "size", "chunk_size", "done")
+
+    def __init__(self, path: Path, size: int, chunk_size: int, done: Optional[Set[int]] = None):
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.done: Set[int] = done or set()
+
+    @classmethod
+    def load(cls, path: Path, size: int, chunk_size: int) -> "_Journal":
+        try:
+            data = json.loads(path.read_text())
+            if data["size"] == size and data["chunk_size"] == chunk_size:
+                return cls(path, size, chunk_size, set(data["done"]))
+            logger.info(f"♻️ Журнал {path.name} от другого файла — качаем заново")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"⚠️ Повреждённый журнал {path.name}: {e}")
+        return cls(path, size, chunk_size)
+
+    @property
+    def chunks(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def chunk_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.chunk_size
+        return start, min(self.size, start + self.chunk_size) - 1
+
+    def bytes_done(self) -> int:
+        return sum(end - start + 1 for start, end in map(self.chunk_range, self.done))
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"size": self.size, "chunk_size": self.chunk_size, "done": sorted(self.done)}))
+        os.replace(tmp_path, self.path)
+
+
+class _Transfer:
+    """Состояние одной загрузки: ссылка, открытый файл, журнал, счётчик байт."""
+
+    def __init__(self, url: str, fd: int, journal: _Journal, progress_callback: Optional[ProgressCallback]):
+        self.url = url
+        self.fd = fd
+        self.journal = journal
+        self.progress_callback = progress_callback
+        self.downloaded = journal.bytes_done()
+        self.journal_lock = asyncio.Lock()
+        self.url_lock = asyncio.Lock()
+
+    async def write(self, offset: int, data: bytearray):
+        await asyncio.to_thread(os.pwrite, self.fd, data, offset)
+        self.downloaded += len(data)
+        metrics.add_bytes("qobuz_stream", len(data))
+        if self.progress_callback:
+            try:
+                await self.progress_callback(self.downloaded, self.journal.size)
+            except Exception as e:
+                logger.debug(f"Ошибка в progress_callback: {e}")
+
+    async def commit(self, index: int):
+        # Сначала данные на диск, потом отметка в журнале — иначе после сбоя
+        # журнал мог бы считать готовым кусок, которого нет
+        async with self.journal_lock:
+            self.journal.done.add(index)
+            await asyncio.to_thread(self._sync_and_save)
+
+    def _sync_and_save(self):
+        os.fdatasync(self.fd)
+        self.journal.save()
+
+
+class QobuzStreamDownloader:
+    """
+    Загрузка трека Qobuz без rip: подписанная ссылка из track/getFileUrl,
+    файл качается несколькими параллельными Range-запросами через общий
+    пул соединений в заранее выделенный файл. Готовые куски отмечаются
+    в журнале, так что после обрыва или перезапуска загрузка продолжается
+    с места остановки. Теги результат получает от нас же (mutagen).
+    """
+
+    def __init__(self, http: httpx.AsyncClient, qobuz: "QobuzDownloader",
+                 connections: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.http = http
+        self.qobuz = qobuz
+        self.connections = connections or Config.QOBUZ_STREAM_CONNECTIONS
+        self.chunk_size = chunk_size or Config.QOBUZ_STREAM_CHUNK_MB * 1024 * 1024
+        self.partial_dir = Config.DOWNLOAD_DIR / PARTIAL_DIR_NAME
+        # Один файл — одна загрузка: вторая такая же ждёт и продолжает по журналу
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.cleanup_partials()
+        logger.info(f"✅ Загрузка Qobuz по Range-запросам: {self.connections} соединений, куски по {self.chunk_size // 1024 // 1024} МБ")
+
+    def cleanup_partials(self):
+        """Удаляет недокачанные файлы, которые так и не понадобились за QOBUZ_PARTIAL_TTL."""
+        if not self.partial_dir.exists():
+            return
+        deadline = time.time() - Config.QOBUZ_PARTIAL_TTL
+        for item in self.partial_dir.iterdir():
+            try:
+                if item.stat().st_mtime < deadline:
+                    item.unlink()
+                    logger.info(f"🧹 Удалён старый недокачанный файл {item.name}")
+            except OSError:
+                pass
+
+    @metrics.timed("qobuz_api")
+    async def get_file_url(self, track_id: str, format_id: int) -> Optional[Dict]:
+        """{"url", "format_id", "mime_type", ...} или None, если полной версии не дали."""
+        timestamp = str(int(time.time()))
+        r = await self.http.get(
+            f"{QOBUZ_API}/track/getFileUrl",
+            params={
+                "track_id": track_id, "format_id": format_id, "intent": "stream",
+                "request_ts": timestamp, "request_sig": request_signature(track_id, format_id, timestamp),
+                "app_id": Config.QOBUZ_APP_ID,
+            },
+            headers=self.qobuz.auth_headers,
+        )
+        if r.status_code == 401:
+            raise QobuzAuthError("Токен Qobuz истёк или недействителен")
+        if r.status_code != 200:
+            # 400 обычно означает неверную подпись, то есть QOBUZ_APP_SECRET не от этого app_id
+            logger.warning(f"⚠️ track/getFileUrl вернул {r.status_code}: {r.text[:200]}")
+            metrics.error("qobuz_api")
+            return None
+        data = r.json()
+        if not data.get("url") or data.get("sample"):
+            logger.warning(f"⚠️ Qobuz отдал только превью трека {track_id}")
+            return None
+        return data
+
+    @metrics.timed("qobuz_stream")
+    async def download(
+        self,
+        track_id: str,
+        quality_id: int,
+        job_dir: Path,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Tuple[Optional[Path], Optional[Path]]:
+        """
+        Скачивает трек в job_dir: (аудио, обложка). (None, None) — не вышло,
+        вызывающий качает через rip; недокачанное остаётся для докачки.
+        """
+        try:
+            return await self._download(track_id, quality_id, job_dir, progress_callback)
+        except (QobuzAuthError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logger.error(f"❌ Загрузка трека {track_id} по Range-запросам не удалась: {e}")
+            metrics.error("qobuz_stream")
+            return None, None
+
+    async def _download(self, track_id: str, quality_id: int, job_dir: Path,
+                        progress_callback: Optional[ProgressCallback]) -> Tuple[Optional[Path], Optional[Path]]:
+        info = await self.qobuz.get_track_info(track_id) or {}
+        file_info = await self.get_file_url(track_id, quality_id)
+        if not file_info:
+            return None, None
+        format_id = file_info.get("format_id", quality_id)
+        suffix = ".mp3" if "mpeg" in file_info.get("mime_type", "") or format_id == 5 else ".flac"
+
+        # Разные quality_id могут дать один format_id, а файл и журнал названы по нему
+        async with self._lock(f"{track_id}-{format_id}"):
+            return await self._download_file(track_id, format_id, suffix, file_info["url"], info, job_dir, progress_callback)
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def _download_file(self, track_id: str, format_id: int, suffix: str, url: str, info: Dict, job_dir: Path,
+                             progress_callback: Optional[ProgressCallback]) -> Tuple[Optional[Path], Optional[Path]]:
+        size = await self._content_length(url)
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        part_path = self.partial_dir / f"{track_id}-{format_id}{suffix}.part"
+        journal = _Journal.load(self.partial_dir / f"{track_id}-{format_id}.journal", size, self.chunk_size)
+        if journal.done and not part_path.exists():
+            journal.done.clear()
+
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                journal.done.clear()
+                await asyncio.to_thread(_preallocate, fd, size)
+            transfer = _Transfer(url, fd, journal, progress_callback)
+            if journal.done:
+                logger.info(f"▶️ Докачка трека {track_id}: {transfer.downloaded / 1024 / 1024:.1f} из {size / 1024 / 1024:.1f} МБ уже на диске")
+            pending = [index for index in range(journal.chunks) if index not in journal.done]
+            await self._fetch_all(transfer, pending, track_id, format_id)
+        finally:
+            os.close(fd)
+
+        audio_file = job_dir / f"qobuz-{track_id}{suffix}"
+        job_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.move, str(part_path), str(audio_file))
+        journal.path.unlink(missing_ok=True)
+        await asyncio.to_thread(_write_tags, audio_file, info)
+        cover_file = await self.qobuz.download_cover(info.get("cover_url"), job_dir)
+        logger.info(f"✅ Трек {track_id} скачан по Range-запросам ({size / 1024 / 1024:.1f} МБ)")
+        return audio_file, cover_file
+
+    async def _content_length(self, url: str) -> int:
+        # Однобайтовый Range заодно проверяет, что сервер умеет диапазоны
+        async with self.http.stream("GET", url, headers={"Range": "bytes=0-0"}) as r:
+            match = re.match(r"bytes \d+-\d+/(\d+)", r.headers.get("content-range", ""))
+            if r.status_code != 206 or not match:
+                raise QobuzStreamError(f"сервер не поддерживает Range (HTTP {r.status_code})")
+            return int(match.group(1))
+
+    async def _fetch_all(self, transfer: _Transfer, pending: list, track_id: str, format_id: int):
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in pending:
+            queue.put_nowait(index)
+
+        async def connection():
+            while not queue.empty():
+                index = queue.get_nowait()
+                await self._fetch_chunk(transfer, index, track_id, format_id)
+
+        tasks = [asyncio.create_task(connection()) for _ in range(min(self.connections, len(pending)))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Ошибка или отмена — останавливаем остальные соединения; готовые куски уже в журнале
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _fetch_chunk(self, transfer: _Transfer, index: int, track_id: str, format_id: int):
+        offset, end = transfer.journal.chunk_range(index)
+        attempt = 0
+        while True:
+            url = transfer.url
+            try:
+                async with self.http.stream("GET", url, headers={"Range": f"bytes={offset}-{end}"}) as r:
+                    if r.status_code in _EXPIRED_STATUSES:
+                        await self._refresh_url(transfer, url, track_id, format_id)
+                        raise QobuzStreamError(f"ссылка истекла (HTTP {r.status_code})")
+                    if r.status_code != 206:
+                        raise QobuzStreamError(f"HTTP {r.status_code} на Range-запрос")
+                    buffer = bytearray()
+                    async for data in r.aiter_bytes():
+                        buffer += data
+                        if len(buffer) >= _WRITE_BUFFER:
+                            await transfer.write(offset, buffer)
+                            offset += len(buffer)
+                            buffer = bytearray()
+                    if buffer:
+                        await transfer.write(offset, buffer)
+                        offset += len(buffer)
+                if offset <= end:
+                    raise QobuzStreamError(f"ответ оборвался на {offset} из {end + 1} байт")
+                await transfer.commit(index)
+                return
+            except (httpx.HTTPError, QobuzStreamError) as e:
+                attempt += 1
+                if attempt > _CHUNK_RETRIES:
+                    raise QobuzStreamError(f"кусок {index}: {e}") from e
+                logger.warning(f"⚠️ Кусок {index} трека {track_id}: {e}. Продолжаем с байта {offset} (попытка {attempt})")
+                metrics.error("qobuz_stream_retry")
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 10.0))
+
+    async def _refresh_url(self, transfer: _Transfer, stale_url: str, track_id: str, format_id: int):
+        async with transfer.url_lock:
+            # Соседнее соединение могло уже обновить ссылку
+            if transfer.url != stale_url:
+                return
+            file_info = await self.get_file_url(track_id, format_id)
+            if file_info:
+                transfer.url = file_info["url"]
+                logger.info(f"🔗 Ссылка на трек {track_id} обновлена")
+
+
+def _preallocate(fd: int, size: int):
+    os.ftruncate(fd, 0)
+    try:
+        # Место выделяется сразу: диск кончится до загрузки, а не посреди неё
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def _write_tags(path: Path, info: Dict):
+    """Теги из track/get: поток Qobuz приходит без них."""
+    try:
+        import mutagen
+        audio = mutagen.File(path, easy=True)
+        if audio is None:
+            return
+        if audio.tags is None:
+            audio.add_tags()
+        fields = {
+            "title": info.get("title"),
+            "artist": info.get("artist"),
+            "album": info.get("album"),
+            "date": info.get("year"),
+            "tracknumber": info.get("track_number"),
+            "isrc": info.get("isrc"),
+        }
+        for key, value in fields.items():
+            if value:
+                audio[key] = str(value)
+        audio.save()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось записать теги в {path.name}: {e}")
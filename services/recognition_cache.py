@@ -0,0 +1,64 @@
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+from config import Config
+from services.metadata_cache import TTLCache
+import hashlib
+import logging
+
+if TYPE_CHECKING:
+    from services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionCache:
+    """
+    Результаты распознавания: file_unique_id из Telegram или SHA-256
+    нормализованного фрагмента -> {"found", "artist", "title", "track_id"}.
+    Пересланное повторно голосовое не идёт ни в AudD, ни в поиск Qobuz.
+    """
+
+    def __init__(self, path: Optional[Path] = None, store: Optional["StateStore"] = None):
+        self._cache = TTLCache(maxsize=10000, ttl=Config.RECOGNITION_CACHE_TTL, path=path, store=store, namespace="recognition")
+        self.file_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_file(file_path: Path) -> str:
+        return hashlib.sha256(file_path.read_bytes()).hexdigest()
+
+    def get_by_file(self, file_unique_id: str) -> Optional[dict]:
+        entry = self._cache.get(f"file:{file_unique_id}")
+        if entry:
+            self.file_hits += 1
+        return entry
+
+    def get_by_hash(self, content_hash: str) -> Optional[dict]:
+        entry = self._cache.get(f"hash:{content_hash}")
+        if entry:
+            self.hash_hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def put(self, file_unique_id: Optional[str], content_hash: Optional[str], entry: dict):
+        ttl = None if entry.get("found") and entry.get("track_id") else Config.RECOGNITION_NEGATIVE_TTL
+        if file_unique_id:
+            self._cache.set(f"file:{file_unique_id}", entry, ttl)
+        if content_hash:
+            self._cache.set(f"hash:{content_hash}", entry, ttl)
+
+    def save(self):
+        self._cache.save()
+
+    def stats(self) -> dict:
+        hits = self.file_hits + self.hash_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "file_hits": self.file_hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "hit_rate": (hits / total * 100) if total else 0.0,
+        }
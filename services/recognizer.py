@@ -1,49 +1,118 @@
-import requests
+import httpx
+import asyncio
+import itertools
+import json
 import logging
+import random
+from pathlib import Path
 from config import Config
+from services import metrics
 from typing import Optional, Dict
 
 logger = logging.getLogger(__name__)
 
+# Базовая задержка между повторами; реальная — случайная в [0, base * 2^попытка]
+_RETRY_BASE_DELAY = 0.5
+# HTTP-коды, при которых имеет смысл повторить запрос
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RecognitionError(Exception):
+    """AudD не ответил или вернул ошибку — в отличие от «трек не найден», результат не кэшируется."""
+
+
 class AudioRecognizer:
-    def __init__(self):
+    def __init__(self, http: httpx.AsyncClient):
         # Берем токен из нашей стандартной конфигурации
         self.api_token = Config.AUDD_API_TOKEN
-        self.api_url = "https://api.audd.io/"
-        logger.info("Сервис распознавания (на базе requests) инициализирован.")
+        self.api_url = Config.AUDD_API_URL
+        # Общий пул соединений приложения
+        self.http = http
+        self.timeout = httpx.Timeout(Config.AUDD_TIMEOUT, connect=10.0)
+        self.retries = max(0, Config.AUDD_RETRIES)
+        # Ограничиваем число одновременных запросов к AudD
+        self._semaphore = asyncio.Semaphore(max(1, Config.AUDD_MAX_CONCURRENT))
+        self._fixtures = self._load_fixtures(Config.AUDD_FIXTURES_FILE)
+        if self._fixtures:
+            logger.info("Сервис распознавания работает в офлайн-режиме (ответы из фикстур).")
+        else:
+            logger.info(f"Сервис распознавания (на базе httpx) инициализирован: {self.api_url}")
 
-    def recognize(self, file_path: str) -> Optional[Dict[str, str]]:
+    @metrics.timed("audd")
+    async def recognize(self, file_path: str) -> Optional[Dict[str, str]]:
         """
         Распознает аудиофайл, отправляя его напрямую в AudD.io,
-        и возвращает {'artist': ..., 'title': ...} или None.
+        и возвращает {'artist': ..., 'title': ...} или None, если трек не найден.
+        Сетевые и HTTP-ошибки, таймауты и ошибки AudD — RecognitionError.
         """
         logger.info(f"Отправка файла {file_path} на распознавание в AudD.io...")
         try:
-            with open(file_path, 'rb') as f:
+            async with self._semaphore:
+                if self._fixtures:
+                    result_json = next(self._fixtures)
+                else:
+                    result_json = await self._request(Path(file_path))
+            return self._parse_result(result_json)
+        except RecognitionError:
+            raise
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка при распознавании: {e}")
+            metrics.error("audd")
+            raise RecognitionError(str(e)) from e
+
+    async def _request(self, path: Path) -> dict:
+        """POST в AudD с таймаутом и ограниченным числом повторов (экспонента + jitter)."""
+        payload = path.read_bytes()
+        metrics.add_bytes("audd", len(payload))
+        for attempt in range(self.retries + 1):
+            try:
                 # Готовим данные для POST-запроса
-                files = {'file': f}
+                files = {'file': (path.name, payload)}
                 data = {'api_token': self.api_token}
-                
-                # Отправляем запрос
-                response = requests.post(self.api_url, files=files, data=data)
+                response = await self.http.post(self.api_url, files=files, data=data, timeout=self.timeout)
+                if response.status_code in _RETRYABLE_STATUSES and attempt < self.retries:
+                    raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
                 response.raise_for_status()  # Проверяем на HTTP ошибки (4xx, 5xx)
-                result_json = response.json()
-
-            # Обрабатываем ответ, как и раньше
-            if result_json.get('status') == 'success' and result_json.get('result'):
-                track_info = result_json['result']
-                artist = track_info.get('artist')
-                title = track_info.get('title')
-                if artist and title:
-                    logger.info(f"Распознано: {artist} - {title}")
-                    return {'artist': artist, 'title': title}
-
-            logger.warning(f"AudD.io не смог распознать трек. Ответ: {result_json}")
-            return None
+                return response.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = isinstance(e, httpx.TransportError) or e.response.status_code in _RETRYABLE_STATUSES
+                if not retryable or attempt >= self.retries:
+                    logger.error(f"Ошибка сети при обращении к AudD.io: {e}")
+                    metrics.error("audd")
+                    raise RecognitionError(str(e)) from e
+                delay = random.uniform(0, _RETRY_BASE_DELAY * 2 ** attempt)
+                logger.warning(f"AudD.io: {e}. Повтор {attempt + 1}/{self.retries} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        raise RecognitionError("AudD.io не ответил")
+
+    @staticmethod
+    def _parse_result(result_json: dict) -> Optional[Dict[str, str]]:
+        if result_json.get('status') != 'success':
+            # Лимит запросов, неверный токен и т.п. — это не «трек не найден»
+            logger.error(f"AudD.io вернул ошибку: {result_json.get('error')}")
+            metrics.error("audd")
+            raise RecognitionError(f"AudD.io: {result_json.get('error')}")
+        if result_json.get('result'):
+            track_info = result_json['result']
+            artist = track_info.get('artist')
+            title = track_info.get('title')
+            if artist and title:
+                logger.info(f"Распознано: {artist} - {title}")
+                return {'artist': artist, 'title': title}
+
+        logger.warning(f"AudD.io не смог распознать трек. Ответ: {result_json}")
+        return None
 
-        except requests.RequestException as e:
-            logger.error(f"Ошибка сети при обращении к AudD.io: {e}")
+    @staticmethod
+    def _load_fixtures(fixtures_file: Optional[str]):
+        """Бесконечный цикл по ответам из JSON-файла (список объектов в формате AudD)."""
+        if not fixtures_file:
             return None
+        try:
+            responses = json.loads(Path(fixtures_file).read_text())
+            if isinstance(responses, dict):
+                responses = [responses]
+            return itertools.cycle(responses) if responses else None
         except Exception as e:
-            logger.error(f"Непредвиденная ошибка при распознавании: {e}")
-            return None
\ No newline at end of file
+            logger.error(f"Не удалось загрузить фикстуры AudD из {fixtures_file}: {e}")
+            return None
@@ -0,0 +1,164 @@
+from pathlib import Path
+from typing import List, Optional
+from config import Config
+from services import metrics
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).with_name("rip_worker.py")
+# Ответы воркера короткие, но сообщение об ошибке streamrip может быть длинным
+_LINE_LIMIT = 1024 * 1024
+
+
+class RipWorkerError(Exception):
+    """Воркер не запустился, упал или нарушил протокол — нужен запуск rip."""
+
+
+class _RipWorker:
+    """Процесс services/rip_worker.py; выполняет одно задание за раз."""
+
+    def __init__(self, index: int, command: List[str]):
+        self.index = index
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._ids = itertools.count(1)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self, timeout: float):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=_LINE_LIMIT,
+        )
+        try:
+            message = await asyncio.wait_for(self._read(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise RipWorkerError(f"воркер не ответил за {timeout:.0f} с")
+        if message.get("event") != "ready":
+            raise RipWorkerError(message.get("error") or f"неожиданный ответ: {message}")
+        logger.info(f"✅ Воркер streamrip {self.index} запущен (pid {self.process.pid})")
+
+    async def _read(self) -> dict:
+        line = await self.process.stdout.readline()
+        if not line:
+            code = await self.process.wait()
+            raise RipWorkerError(f"воркер завершился с кодом {code}")
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise RipWorkerError(f"не JSON в ответе: {line[:200]!r}")
+
+    async def request(self, payload: dict) -> dict:
+        job_id = next(self._ids)
+        try:
+            self.process.stdin.write((json.dumps({"id": job_id, **payload}) + "\n").encode())
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise RipWorkerError(f"воркер не принимает задания: {e}")
+        while True:
+            message = await self._read()
+            if message.get("id") == job_id:
+                return message
+
+    async def kill(self):
+        if self.alive:
+            self.process.kill()
+            await self.process.wait()
+
+    async def stop(self, timeout: float = 5.0):
+        if not self.alive:
+            return
+        # Закрытый stdin — сигнал воркеру выйти после текущего задания
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self.kill()
+
+
+class RipWorkerPool:
+    """
+    Пул долгоживущих процессов streamrip вместо запуска rip на каждый трек:
+    интерпретатор, импорт streamrip и вход в Qobuz оплачиваются один раз на
+    воркер. Воркеры поднимаются при первой загрузке. Если воркер не запустился
+    или упал, download() возвращает None, и вызывающий качает через rip.
+    """
+
+    def __init__(self, workers: Optional[int] = None, command: Optional[List[str]] = None):
+        self.workers = Config.RIP_WORKERS if workers is None else workers
+        script = Path(Config.RIP_WORKER_PATH) if Config.RIP_WORKER_PATH else WORKER_SCRIPT
+        self.command = command or [sys.executable, str(script)]
+        self._all = [_RipWorker(index, self.command) for index in range(self.workers)]
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for worker in self._all:
+            self._idle.put_nowait(worker)
+        self._retry_at = 0.0
+        self.running = 0
+        if self.workers:
+            logger.info(f"✅ Пул воркеров streamrip: до {self.workers} процессов")
+
+    @property
+    def available(self) -> bool:
+        return self.workers > 0 and time.monotonic() >= self._retry_at
+
+    async def download(self, url: str, quality: int, folder: Path) -> Optional[dict]:
+        """
+        Ответ воркера ({"ok", "error", "auth"}) или None, если воркера нет
+        и трек нужно качать через rip.
+        """
+        if not self.available:
+            return None
+        worker = await self._idle.get()
+        self.running += 1
+        try:
+            if not worker.alive:
+                try:
+                    await worker.start(Config.RIP_WORKER_START_TIMEOUT)
+                except (RipWorkerError, OSError) as e:
+                    logger.warning(f"⚠️ Воркер streamrip не запустился: {e}. {Config.RIP_WORKER_RETRY_SECONDS:.0f} с качаем через rip.")
+                    metrics.error("rip_worker")
+                    self._retry_at = time.monotonic() + Config.RIP_WORKER_RETRY_SECONDS
+                    await worker.kill()
+                    return None
+            try:
+                return await worker.request({
+                    "url": url,
+                    "quality": quality,
+                    "folder": str(folder),
+                    "token": Config.QOBUZ_AUTH_TOKEN,
+                })
+            except RipWorkerError as e:
+                logger.error(f"❌ Воркер streamrip {worker.index} упал: {e}. Повтор через rip.")
+                metrics.error("rip_worker")
+                await worker.kill()
+                return None
+            except asyncio.CancelledError:
+                # Задачу отменили — воркер не должен дописывать в удалённую папку,
+                # следующее задание поднимет новый процесс
+                await worker.kill()
+                raise
+        finally:
+            self.running -= 1
+            self._idle.put_nowait(worker)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(worker.alive for worker in self._all),
+            "running": self.running,
+        }
+
+    async def close(self):
+        await asyncio.gather(*(worker.stop() for worker in self._all), return_exceptions=True)
+        if self.workers:
+            logger.info("🔌 Пул воркеров streamrip остановлен.")
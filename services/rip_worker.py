@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Резидентный воркер streamrip: запускается пулом RipWorkerPool отдельным
+процессом и качает треки по заданиям из stdin, не перезапуская интерпретатор
+и не входя в Qobuz заново на каждую ссылку.
+
+Протокол — по JSON-объекту на строку:
+  воркер -> {"event": "ready"} после импорта streamrip
+            (или {"event": "error", "error": ...} — и выход);
+  бот    -> {"id", "url", "quality", "folder", "token"};
+  воркер -> {"id", "ok": true} или {"id", "ok": false, "error", "auth"}.
+
+Задания выполняются строго по одному: папка и качество задаются в общем
+конфиге streamrip перед каждой загрузкой. Скрипт не импортирует модули бота.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger("rip_worker")
+
+
+def _protocol_stream():
+    # streamrip пишет в stdout сам (rich) — уводим его в stderr, а исходный stdout
+    # оставляем только для ответов боту
+    stream = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1, encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return stream
+
+
+class _Session:
+    """streamrip Main с выполненным входом; пересоздаётся при смене токена."""
+
+    def __init__(self, rip_config, main_cls):
+        self.config = rip_config
+        self.main_cls = main_cls
+        self.main = None
+        self.token = None
+
+    async def ensure(self, token: str):
+        if self.main is not None and token == self.token:
+            return self.main
+        await self.close()
+        self.config.session.qobuz.password_or_token = token
+        main = self.main_cls(self.config)
+        await main.__aenter__()
+        # Вход один раз на сессию: дальше клиент и его пул соединений переиспользуются
+        await main.get_logged_in_client("qobuz")
+        self.main, self.token = main, token
+        return main
+
+    async def close(self):
+        if self.main is not None:
+            main, self.main = self.main, None
+            await main.__aexit__(None, None, None)
+
+    async def download(self, job: dict):
+        main = await self.ensure(job["token"])
+        self.config.session.downloads.folder = job["folder"]
+        self.config.session.qobuz.quality = job["quality"]
+        try:
+            await main.add(job["url"])
+            await main.resolve()
+            await main.rip()
+        finally:
+            # Очередь Main накопительная — следующий запрос начинается с пустой
+            main.pending.clear()
+            main.media.clear()
+
+
+def _is_auth_error(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return "auth" in text or "invalid credentials" in text
+
+
+async def serve(protocol) -> int:
+    def reply(message: dict):
+        protocol.write(json.dumps(message, ensure_ascii=False) + "\n")
+
+    try:
+        from streamrip.config import DEFAULT_CONFIG_PATH, Config as RipConfig
+        from streamrip.rip.main import Main
+        rip_config = RipConfig(DEFAULT_CONFIG_PATH)
+    except Exception as e:
+        reply({"event": "error", "error": f"streamrip недоступен: {e}"})
+        return 1
+    # То же, что флаги rip --no-db --no-progress
+    rip_config.session.database.downloads_enabled = False
+    rip_config.session.cli.progress_bars = False
+    session = _Session(rip_config, Main)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    reply({"event": "ready"})
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                # Бот закрыл stdin — штатная остановка
+                return 0
+            job = json.loads(line)
+            try:
+                await session.download(job)
+                reply({"id": job["id"], "ok": True})
+            except Exception as e:
+                logger.exception(f"Ошибка загрузки {job.get('url')}")
+                reply({"id": job["id"], "ok": False, "error": str(e) or type(e).__name__, "auth": _is_auth_error(e)})
+                if _is_auth_error(e):
+                    # Следующее задание войдёт заново
+                    await session.close()
+    finally:
+        await session.close()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format="rip_worker: %(levelname)s %(message)s")
+    return asyncio.run(serve(_protocol_stream()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
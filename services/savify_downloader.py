@@ -1,85 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from config import Config
+from services import metrics
 # --- ИСПРАВЛЕНИЕ ЗДЕСЬ ---
 from savify import Savify
 from savify.types import Format, Quality
 from savify.utils import PathHolder
 # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
 import logging
-import shutil
 import asyncio
+import os
+import shutil
 
 logger = logging.getLogger(__name__)
 
+
+class _SavifyWorker:
+    """Один экземпляр Savify со своей временной папкой; качает одну ссылку за раз."""
+
+    def __init__(self, index: int, savify: Savify, scratch_dir: Path):
+        self.index = index
+        self.savify = savify
+        self.scratch_dir = scratch_dir
+        self.downloads_dir = scratch_dir / "out"
+
+    def reset(self):
+        """Удаляет остатки прошлой загрузки (в том числе брошенной по таймауту)."""
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        self.downloads_dir.mkdir(parents=True, exist_ok=True)
+
+    def download(self, url: str):
+        # Выполняется в потоке пула: Savify.download() блокирующий
+        self.reset()
+        self.savify.download(url)
+
+
 class SavifyDownloader:
-    def __init__(self):
-        # Создадим отдельную временную папку для скачиваний Savify
-        self.download_dir = Config.DOWNLOAD_DIR / "savify_temp"
-        self.download_dir.mkdir(parents=True, exist_ok=True)
-        
-        api_creds = (Config.SPOTIPY_CLIENT_ID, Config.SPOTIPY_CLIENT_SECRET)
-        if not all(api_creds):
+    """
+    Пул долгоживущих экземпляров Savify. Каждый воркер качает в свою
+    временную папку, блокирующие загрузки идут в собственном пуле потоков
+    (не в executor'е по умолчанию), у каждой загрузки свой таймаут.
+    Клиент Spotify (и его токен) общий для всех воркеров.
+    """
+
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.workers = workers or Config.SAVIFY_WORKERS or min(4, os.cpu_count() or 1)
+        self.timeout = timeout or Config.SAVIFY_TIMEOUT
+        self.scratch_root = Config.DOWNLOAD_DIR / "savify_temp"
+
+        self._api_creds = (Config.SPOTIPY_CLIENT_ID, Config.SPOTIPY_CLIENT_SECRET)
+        if not all(self._api_creds):
             logger.error("!!! Savify не будет работать без SPOTIPY_CLIENT_ID и SPOTIPY_CLIENT_SECRET в .env !!!")
-            api_creds = None
-
-        # Укажем Savify качать все в нашу папку, НЕ создавая подпапки
-        # Теперь `PathHolder` будет найден
-        path_holder = PathHolder(downloads_path=self.download_dir)
-        
-        self.savify = Savify(
-            api_credentials=api_creds,
-            quality=Quality.BEST,
-            download_format=Format.MP3, # Savify лучше всего работает с MP3 для метаданных
-            path_holder=path_holder,
-            group=None # Отключаем группировку по %artist%/%album%
-        )
-        logger.info("✅ Сервис загрузки Savify (Spotify) инициализирован.")
-
-    async def download_track(self, url: str) -> Tuple[Optional[Path], Optional[Path]]:
-        """Скачивает трек по URL."""
-        logger.info(f"⬇️ Запуск скачивания Savify для URL: {url}")
-        
-        # Очищаем временную папку перед новым скачиванием
-        self._clear_temp_dir()
+            self._api_creds = None
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="savify")
+        self._idle: asyncio.Queue = asyncio.Queue()
+        # Воркеры создаются в потоке пула при первой загрузке, а не в event loop
+        self._started: Optional[asyncio.Task] = None
+        self.running = 0
+        self.queued = 0
+
+    def _build_workers(self) -> List[_SavifyWorker]:
+        # Выполняется в потоке пула: конструктор Savify блокирующий
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+        workers = []
+        spotify = None
+        for index in range(self.workers):
+            scratch_dir = self.scratch_root / f"worker-{index}"
+            scratch_dir.mkdir(parents=True, exist_ok=True)
+            savify = Savify(
+                api_credentials=self._api_creds,
+                quality=Quality.BEST,
+                download_format=Format.MP3, # Savify лучше всего работает с MP3 для метаданных
+                path_holder=PathHolder(data_path=str(scratch_dir), downloads_path=str(scratch_dir / "out")),
+                group=None # Отключаем группировку по %artist%/%album%
+            )
+            # Один клиент spotipy на весь пул: токен client credentials
+            # получается один раз и обновляется по истечении, а не на каждую ссылку
+            if spotify is None:
+                spotify = savify.spotify
+            else:
+                savify.spotify = spotify
+            workers.append(_SavifyWorker(index, savify, scratch_dir))
+        return workers
 
+    async def _start(self):
+        loop = asyncio.get_running_loop()
         try:
-            # Savify.download() - это блокирующая I/O операция.
-            # В асинхронном коде ее нужно запускать в executor'е,
-            # чтобы не блокировать весь event-loop.
-            loop = asyncio.get_running_loop()
-            # Запускаем синхронную функцию в отдельном потоке
-            await loop.run_in_executor(None, self.savify.download, url)
-            
+            workers = await loop.run_in_executor(self._executor, self._build_workers)
+        except BaseException:
+            # Следующая ссылка попробует поднять пул заново
+            self._started = None
+            raise
+        for worker in workers:
+            self._idle.put_nowait(worker)
+        logger.info(f"✅ Сервис загрузки Savify (Spotify) инициализирован: {self.workers} воркеров, таймаут {self.timeout:.0f} с.")
+
+    async def _acquire(self) -> _SavifyWorker:
+        if self._started is None:
+            self._started = asyncio.create_task(self._start())
+            self._started.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # shield: отмена одной загрузки не должна обрывать подъём пула для остальных
+        await asyncio.shield(self._started)
+        return await self._idle.get()
+
+    @metrics.timed("spotify_download")
+    async def download_track(self, url: str, job_dir: Path) -> Tuple[Optional[Path], Optional[Path]]:
+        """Скачивает трек по URL и переносит результат в рабочую папку задачи."""
+        self.queued += 1
+        try:
+            worker = await self._acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        logger.info(f"⬇️ Запуск скачивания Savify (воркер {worker.index}) для URL: {url}")
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, worker.download, url)
+        try:
+            # shield: поток нельзя прервать, поэтому при таймауте или отмене
+            # он докачивает сам, а воркер возвращается в пул после этого
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
             logger.info("✅ Скачивание Savify завершено. Поиск файлов...")
-            return self._find_downloaded_files()
-            
+            # Перенос тоже в потоке пула; воркер вернётся в пул, когда перенос закончится
+            future = loop.run_in_executor(self._executor, self._collect_files, worker, job_dir)
+            return await future
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Savify не уложился в {self.timeout:.0f} с: {url}")
+            metrics.error("spotify_download")
+            return None, None
         except Exception as e:
             logger.error(f"❌ Ошибка при скачивании через Savify: {e}")
+            metrics.error("spotify_download")
             return None, None
+        finally:
+            if future.done():
+                self._release(worker, future)
+            else:
+                future.add_done_callback(lambda f: self._release(worker, f))
 
-    def _find_downloaded_files(self) -> Tuple[Optional[Path], Optional[Path]]:
-        """Находит первый скачанный MP3 и его обложку в папке."""
-        for f in self.download_dir.glob("**/*.mp3"):
+    def _release(self, worker: _SavifyWorker, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            # Ошибку брошенной по таймауту загрузки никто не ждёт — только в лог
+            logger.debug(f"Savify воркер {worker.index}: {future.exception()}")
+        self.running -= 1
+        self._idle.put_nowait(worker)
+
+    def _collect_files(self, worker: _SavifyWorker, job_dir: Path) -> Tuple[Optional[Path], Optional[Path]]:
+        """Переносит первый скачанный MP3 и его обложку из папки воркера в папку задачи."""
+        audio_file, cover_file = self._find_downloaded_files(worker.downloads_dir)
+        if not audio_file:
+            return None, None
+        audio_file = Path(shutil.move(str(audio_file), str(job_dir / audio_file.name)))
+        if cover_file:
+            cover_file = Path(shutil.move(str(cover_file), str(job_dir / cover_file.name)))
+        return audio_file, cover_file
+
+    def _find_downloaded_files(self, search_dir: Path) -> Tuple[Optional[Path], Optional[Path]]:
+        """Находит первый скачанный MP3 и его обложку."""
+        for f in sorted(search_dir.glob("**/*.mp3")):
             if f.is_file():
                 # Savify (через youtube-dl) может скачать обложку
                 cover_file = f.with_suffix(".jpg")
                 if not cover_file.exists():
                      cover_file = f.with_suffix(".png") # Пробуем .png
-                
+
                 return f, cover_file if cover_file.exists() else None
         return None, None # Не найдено
 
-    def _clear_temp_dir(self):
-        """Очищает временную директорию Savify."""
-        for item in self.download_dir.glob("**/*"):
-            if item.is_file():
-                try:
-                    item.unlink()
-                except OSError as e:
-                    logger.warning(f"Не удалось удалить {item}: {e}")
-            elif item.is_dir():
-                try:
-                    shutil.rmtree(item)
-                except OSError as e:
-                    logger.warning(f"Не удалось удалить директорию {item}: {e}")
\ No newline at end of file
+    def stats(self) -> dict:
+        return {"workers": self.workers, "running": self.running, "queued": self.queued}
+
+    def close(self):
+        # Зависшие загрузки не ждём: потоки завершатся вместе с процессом
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("🔌 Пул Savify остановлен.")
@@ -0,0 +1,252 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from services import metrics
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+QueueCallback = Callable[[int], Awaitable[None]]
+FinishCallback = Callable[[int, int, str, str, Optional[str], float], None]
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class Job:
+    """Одна пользовательская задача (ссылка, альбом, распознавание) из нескольких этапов."""
+
+    __slots__ = ("id", "user_id", "label", "created", "stage", "cancelled", "_tasks")
+
+    def __init__(self, job_id: int, user_id: int, label: str):
+        self.id = job_id
+        self.user_id = user_id
+        self.label = label
+        self.created = time.monotonic()
+        self.stage: Optional[str] = None
+        self.cancelled = False
+        # Задачи asyncio, выполняющие этапы прямо сейчас (у альбома их несколько)
+        self._tasks: Set[asyncio.Task] = set()
+
+
+class _Waiter:
+    __slots__ = ("job", "granted", "on_queue", "last_position")
+
+    def __init__(self, job: Job, granted: asyncio.Future, on_queue: Optional[QueueCallback]):
+        self.job = job
+        self.granted = granted
+        self.on_queue = on_queue
+        self.last_position = 0
+
+
+class _Pool:
+    """Пул этапа с лимитом одновременных задач и очередями по пользователям."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.running = 0
+        self.queues: Dict[int, Deque[_Waiter]] = {}
+        # Когда пользователь последний раз получал слот: дольше ждавший обслуживается первым
+        self._served: Dict[int, int] = {}
+        self._ticks = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def enqueue(self, waiter: _Waiter):
+        self.queues.setdefault(waiter.job.user_id, deque()).append(waiter)
+
+    def remove(self, waiter: _Waiter):
+        queue = self.queues.get(waiter.job.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.queues[waiter.job.user_id]
+
+    def pop_next(self) -> Optional[_Waiter]:
+        """Слот получает тот пользователь, который дольше всех не обслуживался."""
+        if not self.queues:
+            return None
+        user_id = min(self.queues, key=lambda uid: self._served.get(uid, -1))
+        queue = self.queues[user_id]
+        waiter = queue.popleft()
+        if not queue:
+            del self.queues[user_id]
+        self._served[user_id] = next(self._ticks)
+        return waiter
+
+    def ordered_waiters(self) -> List[_Waiter]:
+        """Порядок, в котором ожидающие получат слот при обходе по кругу."""
+        users = sorted(self.queues, key=lambda uid: self._served.get(uid, -1))
+        order = []
+        for round_items in itertools.zip_longest(*(self.queues[uid] for uid in users)):
+            order.extend(w for w in round_items if w is not None)
+        return order
+
+
+class JobScheduler:
+    """
+    Центральный планировщик: у каждого этапа (загрузка, перекодирование,
+    распознавание, отправка) свой пул с лимитом, а внутри пула пользователи
+    обслуживаются по кругу — один пользователь с альбомами не занимает всё.
+    """
+
+    def __init__(self, limits: Dict[str, int], max_jobs_per_user: int, on_finish: Optional[FinishCallback] = None):
+        self.pools = {name: _Pool(name, limit) for name, limit in limits.items()}
+        self.max_jobs_per_user = max(1, max_jobs_per_user)
+        # Журнал завершённых задач: (id, user_id, label, статус, ошибка, длительность)
+        self.on_finish = on_finish
+        self.jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        # Ссылки на фоновые уведомления о позиции, чтобы их не собрал GC
+        self._notifications: Set[asyncio.Task] = set()
+
+    @asynccontextmanager
+    async def job(self, user_id: int, label: str):
+        """Регистрирует задачу пользователя; бросает QueueFullError при превышении лимита."""
+        if len(self.user_jobs(user_id)) >= self.max_jobs_per_user:
+            raise QueueFullError(f"У пользователя {user_id} уже {self.max_jobs_per_user} задач")
+        job = Job(next(self._ids), user_id, label)
+        self.jobs[job.id] = job
+        logger.info(f"🗂️ Задача #{job.id} ({label}) пользователя {user_id} принята")
+        status, error = "done", None
+        try:
+            yield job
+        except BaseException as e:
+            status, error = "failed", repr(e)
+            raise
+        finally:
+            self.jobs.pop(job.id, None)
+            if job.cancelled:
+                status = "cancelled"
+            if self.on_finish:
+                try:
+                    self.on_finish(job.id, user_id, label, status, error, time.monotonic() - job.created)
+                except Exception as e:
+                    logger.warning(f"Не удалось записать задачу #{job.id} в журнал: {e}")
+
+    async def run(
+        self,
+        job: Job,
+        pool_name: str,
+        coro_factory: Callable[[], Awaitable],
+        on_queue: Optional[QueueCallback] = None,
+    ):
+        """Ждёт слот в пуле этапа и выполняет coro_factory() в текущей задаче."""
+        if job.cancelled:
+            raise JobCancelledError()
+        pool = self.pools[pool_name]
+        waiter = _Waiter(job, asyncio.get_running_loop().create_future(), on_queue)
+        pool.enqueue(waiter)
+        self._dispatch(pool)
+        queued_at = time.monotonic()
+        try:
+            await waiter.granted
+        except asyncio.CancelledError:
+            pool.remove(waiter)
+            if waiter.granted.done() and not waiter.granted.cancelled():
+                # Слот успели выдать — возвращаем его
+                self._release(pool)
+            raise
+
+        metrics.observe(f"queue_wait:{pool_name}", time.monotonic() - queued_at)
+        task = asyncio.current_task()
+        job.stage = pool_name
+        job._tasks.add(task)
+        try:
+            return await coro_factory()
+        except asyncio.CancelledError:
+            if job.cancelled:
+                # Отмену запросил пользователь — превращаем её в обычную ошибку задачи
+                task.uncancel()
+                raise JobCancelledError()
+            raise
+        finally:
+            job._tasks.discard(task)
+            if not job._tasks:
+                job.stage = None
+            self._release(pool)
+
+    async def wait(self, job: Job, awaitable: Awaitable, stage: str = "ожидание"):
+        """Ждёт awaitable без слота в пуле, но так, чтобы /cancel прерывал ожидание."""
+        if job.cancelled:
+            raise JobCancelledError()
+        task = asyncio.current_task()
+        job.stage = stage
+        job._tasks.add(task)
+        try:
+            return await awaitable
+        except asyncio.CancelledError:
+            if job.cancelled:
+                task.uncancel()
+                raise JobCancelledError()
+            raise
+        finally:
+            job._tasks.discard(task)
+            if not job._tasks:
+                job.stage = None
+
+    def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job.cancelled:
+            return False
+        job.cancelled = True
+        for pool in self.pools.values():
+            for waiter in list(itertools.chain.from_iterable(pool.queues.values())):
+                if waiter.job is job:
+                    pool.remove(waiter)
+                    waiter.granted.set_exception(JobCancelledError())
+            self._notify_positions(pool)
+        for task in list(job._tasks):
+            task.cancel()
+        logger.info(f"🚫 Задача #{job.id} ({job.label}) отменена")
+        return True
+
+    def user_jobs(self, user_id: int) -> List[Job]:
+        return [job for job in self.jobs.values() if job.user_id == user_id]
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            name: {"limit": pool.limit, "running": pool.running, "queued": pool.queued}
+            for name, pool in self.pools.items()
+        }
+
+    def _release(self, pool: _Pool):
+        pool.running -= 1
+        self._dispatch(pool)
+
+    def _dispatch(self, pool: _Pool):
+        while pool.running < pool.limit:
+            waiter = pool.pop_next()
+            if waiter is None:
+                break
+            if waiter.granted.done():
+                continue
+            pool.running += 1
+            waiter.granted.set_result(None)
+        self._notify_positions(pool)
+
+    def _notify_positions(self, pool: _Pool):
+        for position, waiter in enumerate(pool.ordered_waiters(), start=1):
+            if waiter.on_queue and waiter.last_position != position:
+                waiter.last_position = position
+                task = asyncio.create_task(self._safe_notify(waiter.on_queue, position))
+                self._notifications.add(task)
+                task.add_done_callback(self._notifications.discard)
+
+    @staticmethod
+    async def _safe_notify(callback: QueueCallback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug(f"Не удалось сообщить позицию в очереди: {e}")
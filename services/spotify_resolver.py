@@ -0,0 +1,161 @@
+from pathlib import Path
+from typing import Dict, Optional, TYPE_CHECKING
+from config import Config
+from services.downloader import QobuzAPIError, QobuzDownloader
+from services.metadata_cache import TTLCache
+from services import metrics
+import asyncio
+import logging
+import re
+import time
+import httpx
+
+if TYPE_CHECKING:
+    from services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY_TOKEN_URL = Config.SPOTIFY_ACCOUNTS_URL
+SPOTIFY_API = Config.SPOTIFY_API_URL
+# Насколько длительность найденного по названию трека может отличаться, секунд
+_DURATION_TOLERANCE = 5
+
+
+class SpotifyResolver:
+    """
+    Spotify-трек -> трек Qobuz, чтобы отдавать lossless вместо MP3 из YouTube.
+    Ищем по ISRC, при промахе — по исполнителю и названию (результат поиска
+    принимается, только если совпали исполнитель, название и длительность). Сопоставления
+    (и промахи, на меньший срок) хранятся на диске: повторная ссылка
+    не делает ни одного внешнего запроса.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, qobuz: QobuzDownloader, path: Optional[Path] = None, store: Optional["StateStore"] = None):
+        self.http = http
+        self.qobuz = qobuz
+        self._cache = TTLCache(maxsize=50000, ttl=Config.SPOTIFY_MAP_TTL, path=path, store=store, namespace="spotify_map")
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    @staticmethod
+    def extract_id(url: str) -> Optional[str]:
+        match = re.search(r"/track/(\w+)", url)
+        return match.group(1) if match else None
+
+    async def resolve(self, spotify_id: str) -> Optional[str]:
+        """ID трека Qobuz для Spotify-трека или None, если на Qobuz его нет (или Qobuz не ответил)."""
+        entry = self._cache.get(spotify_id)
+        if entry is not None:
+            return entry["qobuz_id"]
+
+        track = await self.get_track(spotify_id)
+        if not track:
+            # Spotify не ответил — не запоминаем, попробуем в следующий раз
+            return None
+        qobuz_id = None
+        try:
+            if track["isrc"]:
+                qobuz_id = await self.qobuz.search_isrc(track["isrc"])
+            if not qobuz_id and track["artist"] and track["title"]:
+                candidate = await self.qobuz.search_track(track["artist"], track["title"])
+                if candidate and await self._matches(candidate, track):
+                    qobuz_id = candidate
+        except QobuzAPIError as e:
+            # Qobuz не ответил (сбой, истёкший токен) — не запоминаем, попробуем в следующий раз
+            logger.warning(f"⚠️ Spotify {spotify_id}: поиск на Qobuz не удался ({e}), не запоминаю")
+            return None
+
+        ttl = None if qobuz_id else Config.SPOTIFY_MAP_NEGATIVE_TTL
+        self._cache.set(spotify_id, {"qobuz_id": qobuz_id, **track}, ttl)
+        if qobuz_id:
+            logger.info(f"🔁 Spotify {spotify_id} -> Qobuz {qobuz_id} ({track['artist']} — {track['title']})")
+        return qobuz_id
+
+    async def _matches(self, qobuz_id: str, track: Dict) -> bool:
+        """
+        Первый результат поиска — тот же трек, а не кавер, ремикс или однофамилец.
+        Если track/get не ответил — QobuzAPIError.
+        """
+        info = await self.qobuz.get_track_info(qobuz_id)
+        if not info:
+            # Трек только что нашёлся поиском — пустой ответ значит сбой API, а не «не тот трек»
+            raise QobuzAPIError(f"track/get не ответил для {qobuz_id}")
+        title, artist = _normalize(info.get("title")), _normalize(info.get("artist"))
+        wanted_title, wanted_artist = _normalize(track["title"]), _normalize(track["artist"])
+        same_title = bool(title and wanted_title) and (title in wanted_title or wanted_title in title)
+        same_artist = bool(artist and wanted_artist) and (artist in wanted_artist or wanted_artist in artist)
+        duration, wanted_duration = info.get("duration"), track.get("duration")
+        same_duration = not (duration and wanted_duration) or abs(duration - wanted_duration) <= _DURATION_TOLERANCE
+        if same_title and same_artist and same_duration:
+            return True
+        logger.info(
+            f"🔍 Qobuz {qobuz_id} ({info.get('artist')} — {info.get('title')}, {duration} с) "
+            f"не похож на {track['artist']} — {track['title']} ({wanted_duration} с)"
+        )
+        return False
+
+    @metrics.timed("spotify_api")
+    async def get_track(self, spotify_id: str) -> Optional[Dict]:
+        """{"isrc", "artist", "title", "duration"} трека из Spotify Web API."""
+        token = await self._get_token()
+        if not token:
+            return None
+        try:
+            r = await self.http.get(f"{SPOTIFY_API}/tracks/{spotify_id}", headers={"Authorization": f"Bearer {token}"})
+            if r.status_code == 401:
+                # Токен отозвали раньше срока — получаем новый и повторяем один раз
+                self._token = None
+                token = await self._get_token()
+                if not token:
+                    return None
+                r = await self.http.get(f"{SPOTIFY_API}/tracks/{spotify_id}", headers={"Authorization": f"Bearer {token}"})
+            if r.status_code != 200:
+                logger.warning(f"⚠️ Spotify API вернул {r.status_code} для трека {spotify_id}")
+                metrics.error("spotify_api")
+                return None
+            data = r.json()
+            return {
+                "isrc": data.get("external_ids", {}).get("isrc"),
+                "artist": ", ".join(a["name"] for a in data.get("artists", [])[:1]),
+                "title": data.get("name", ""),
+                "duration": data["duration_ms"] / 1000 if data.get("duration_ms") else None,
+            }
+        except Exception as e:
+            logger.error(f"❌ Ошибка запроса к Spotify API: {e}")
+            metrics.error("spotify_api")
+            return None
+
+    async def _get_token(self) -> Optional[str]:
+        """Токен client credentials; обновляется незадолго до истечения."""
+        if not (Config.SPOTIPY_CLIENT_ID and Config.SPOTIPY_CLIENT_SECRET):
+            return None
+        async with self._token_lock:
+            if self._token and time.time() < self._token_expires:
+                return self._token
+            try:
+                r = await self.http.post(
+                    SPOTIFY_TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    auth=(Config.SPOTIPY_CLIENT_ID, Config.SPOTIPY_CLIENT_SECRET),
+                )
+                r.raise_for_status()
+                data = r.json()
+                self._token = data["access_token"]
+                self._token_expires = time.time() + data.get("expires_in", 3600) - 60
+                return self._token
+            except Exception as e:
+                logger.error(f"❌ Не удалось получить токен Spotify: {e}")
+                return None
+
+    def save(self):
+        self._cache.save()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def _normalize(text: Optional[str]) -> str:
+    """Для сравнения названий: без регистра, скобок (Remastered, feat.) и знаков."""
+    text = re.sub(r"\(.*?\)|\[.*?\]", "", (text or "").lower())
+    return re.sub(r"[\W_]+", "", text)
@@ -0,0 +1,78 @@
+"""
+Замеры холодного старта (флаг --profile-startup) и фоновый прогрев тяжёлых бэкендов.
+Модуль импортируется в main.py первым, поэтому время считается от запуска процесса.
+"""
+from typing import Dict, Iterable, List, Tuple
+import asyncio
+import builtins
+import importlib
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+_enabled = False
+# Имя модуля -> время первого импорта (вместе с его собственными импортами), с
+_imports: Dict[str, float] = {}
+_phases: List[Tuple[str, float]] = []
+
+# Модули, которые нужны только конкретным хендлерам: Spotify, теги
+WARMUP_MODULES = (
+    "services.savify_downloader",
+    "services.recognizer",
+    "mutagen.flac",
+    "mutagen.id3",
+    "mutagen.mp4",
+)
+
+
+def enable():
+    """Включает запись времени импортов и фаз запуска."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        started = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            _imports.setdefault(name, time.perf_counter() - started)
+
+    builtins.__import__ = timed_import
+
+
+def mark(phase: str):
+    """Отмечает окончание фазы запуска (секунды от старта процесса)."""
+    if _enabled:
+        _phases.append((phase, time.perf_counter() - _started))
+
+
+def report(top: int = 15) -> str:
+    lines = ["⏱️ Профиль запуска:"]
+    lines += [f"  {phase:<36}{seconds * 1000:>9.0f} мс" for phase, seconds in _phases]
+    lines.append(f"  Самые долгие импорты (с вложенными), топ-{top}:")
+    slowest = sorted(_imports.items(), key=lambda item: item[1], reverse=True)[:top]
+    lines += [f"  {name:<36}{seconds * 1000:>9.0f} мс" for name, seconds in slowest]
+    return "\n".join(lines)
+
+
+async def warm_up(modules: Iterable[str] = WARMUP_MODULES):
+    """Импортирует тяжёлые модули в фоне, пока бот уже отвечает."""
+    started = time.perf_counter()
+    for name in modules:
+        try:
+            await asyncio.to_thread(importlib.import_module, name)
+        except Exception as e:
+            # Например, savify не установлен — Spotify просто будет недоступен
+            logger.warning(f"⚠️ Прогрев: не удалось импортировать {name}: {e}")
+    logger.info(f"🔥 Бэкенды прогреты за {time.perf_counter() - started:.1f} с")
+    mark("прогрев бэкендов")
+    if _enabled:
+        logger.info(report())
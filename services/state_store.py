@@ -0,0 +1,201 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы хранится в PRAGMA user_version; миграции применяются по порядку
+_MIGRATIONS = (
+    """
+    CREATE TABLE whitelist (
+        user_id INTEGER PRIMARY KEY,
+        added_at REAL NOT NULL
+    );
+    CREATE TABLE settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE cache (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires_at REAL,
+        PRIMARY KEY (namespace, key)
+    ) WITHOUT ROWID;
+    CREATE INDEX cache_expires ON cache (expires_at) WHERE expires_at IS NOT NULL;
+    CREATE TABLE job_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        label TEXT NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        duration REAL NOT NULL,
+        finished_at REAL NOT NULL
+    );
+    CREATE INDEX job_log_user ON job_log (user_id, finished_at);
+    """,
+)
+
+
+class StateStore:
+    """
+    Постоянное состояние бота в одном файле SQLite (режим WAL): whitelist,
+    токены, кэши и журнал задач. Все обращения идут через один фоновый поток,
+    поэтому event loop не ждёт диск, а запросы выполняются строго по порядку.
+    Каждая запись — отдельная транзакция.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.call(self._open)
+
+    # --- Выполнение в потоке хранилища ---
+
+    def _open(self, _conn=None):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL synchronous=NORMAL не теряет целостность, только последние транзакции при сбое питания
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+            conn.executescript(f"BEGIN; {script} PRAGMA user_version={number}; COMMIT;")
+            logger.info(f"🗄️ Схема состояния обновлена до версии {number}")
+        self._conn = conn
+        logger.info(f"✅ Хранилище состояния открыто: {self.path.name}")
+
+    def _transaction(self, fn: Callable, *args):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def call(self, fn: Callable, *args) -> Any:
+        """Синхронно (для запуска и остановки, вне event loop)."""
+        if self._conn is None:
+            return self._executor.submit(fn, None, *args).result()
+        return self._executor.submit(self._transaction, fn, *args).result()
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """fn(conn, *args) в потоке хранилища, в одной транзакции."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._transaction, fn, *args)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Запись «в фоне»: не ждём результата, но порядок записей сохраняется."""
+        future = self._executor.submit(self._transaction, fn, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def close(self):
+        # Дожидаемся записей в очереди и закрываем соединение
+        def close_connection():
+            if self._conn is not None:
+                self._conn.execute("PRAGMA optimize")
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(close_connection).result()
+        self._executor.shutdown(wait=True)
+        logger.info("🔌 Хранилище состояния закрыто.")
+
+    # --- Whitelist ---
+
+    def load_whitelist(self) -> Set[int]:
+        return self.call(lambda conn: {row[0] for row in conn.execute("SELECT user_id FROM whitelist")})
+
+    async def add_user(self, user_id: int):
+        await self.run(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO whitelist (user_id, added_at) VALUES (?, ?)", (user_id, time.time())))
+
+    async def remove_user(self, user_id: int):
+        await self.run(lambda conn: conn.execute("DELETE FROM whitelist WHERE user_id = ?", (user_id,)))
+
+    def import_whitelist(self, user_ids: Iterable[int], marker: str) -> bool:
+        """
+        Разовый перенос старого whitelist: выполняется, только если настройки marker
+        ещё нет, и ставит её в той же транзакции. False — перенос уже был.
+        """
+        def apply(conn):
+            if conn.execute("SELECT 1 FROM settings WHERE key = ?", (marker,)).fetchone():
+                return False
+            now = time.time()
+            conn.executemany("INSERT OR IGNORE INTO whitelist (user_id, added_at) VALUES (?, ?)", [(uid, now) for uid in user_ids])
+            conn.execute("INSERT INTO settings (key, value, updated_at) VALUES (?, '1', ?)", (marker, now))
+            return True
+        return self.call(apply)
+
+    # --- Настройки (токены) ---
+
+    def get_setting(self, key: str) -> Optional[str]:
+        row = self.call(lambda conn: conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone())
+        return row[0] if row else None
+
+    async def set_setting(self, key: str, value: str):
+        await self.run(lambda conn: conn.execute(
+            "INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (key, value, time.time())))
+
+    # --- Кэши: namespace -> key -> JSON ---
+
+    def load_cache(self, namespace: str) -> List[Tuple[str, Any, Optional[float]]]:
+        """Живые записи пространства имён: (key, value, expires_at); просроченные удаляются."""
+        def load(conn):
+            now = time.time()
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (namespace, now))
+            return conn.execute("SELECT key, value, expires_at FROM cache WHERE namespace = ?", (namespace,)).fetchall()
+        return [(key, json.loads(value), expires_at) for key, value, expires_at in self.call(load)]
+
+    def write_cache(self, namespace: str, upserts: Dict[str, Tuple[Any, Optional[float]]], deletes: Iterable[str] = ()) -> Future:
+        """Пакет изменений кэша одной транзакцией, в фоне."""
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), expires_at) for key, (value, expires_at) in upserts.items()]
+        removed = [(namespace, key) for key in deletes]
+
+        def write(conn):
+            if removed:
+                conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", removed)
+            if rows:
+                conn.executemany(
+                    "INSERT INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                    rows)
+        return self.submit(write)
+
+    # --- Журнал задач ---
+
+    def log_job(self, job_id: int, user_id: int, label: str, status: str, error: Optional[str], duration: float):
+        self.submit(lambda conn: conn.execute(
+            "INSERT INTO job_log (job_id, user_id, label, status, error, duration, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, label, status, error, duration, time.time())))
+
+    async def recent_jobs(self, user_id: Optional[int] = None, limit: int = 5) -> List[Dict]:
+        def query(conn):
+            sql = "SELECT job_id, user_id, label, status, error, duration, finished_at FROM job_log"
+            params: tuple = ()
+            if user_id is not None:
+                sql += " WHERE user_id = ?"
+                params = (user_id,)
+            rows = conn.execute(f"{sql} ORDER BY finished_at DESC LIMIT ?", (*params, limit)).fetchall()
+            keys = ("job_id", "user_id", "label", "status", "error", "duration", "finished_at")
+            return [dict(zip(keys, row)) for row in rows]
+        return await self.run(query)
+
+
+def _log_failure(future: Future):
+    if not future.cancelled() and future.exception():
+        logger.error(f"❌ Ошибка записи в хранилище состояния: {future.exception()}")
@@ -1,47 +1,73 @@
 import json
 import logging
-from pathlib import Path
+import os
+from typing import Optional
+
+from config import Config
+from services.state_store import StateStore
 
 logger = logging.getLogger(__name__)
 
-_WHITELIST_FILE = Path(__file__).resolve().parent.parent / "whitelist.json"
+# Настройка-признак: whitelist.json уже перенесён в хранилище
+WHITELIST_IMPORTED_SETTING = "whitelist_json_imported"
+
+# Проверка доступа идёт на каждый апдейт, поэтому множество всегда в памяти,
+# а хранилище — только для записи изменений
 _whitelist: set[int] = set()
+_store: Optional[StateStore] = None
 
 
-def load() -> None:
-    global _whitelist
+def load(store: StateStore) -> None:
+    global _whitelist, _store
+    _store = store
     try:
-        if _WHITELIST_FILE.exists():
-            _whitelist = set(json.loads(_WHITELIST_FILE.read_text()))
-            logger.info(f"✅ Whitelist загружен: {_whitelist}")
-        else:
-            _whitelist = set()
+        _migrate_json(store)
+        _whitelist = store.load_whitelist()
+        logger.info(f"✅ Whitelist загружен: {_whitelist}")
     except Exception as e:
         logger.error(f"❌ Ошибка загрузки whitelist: {e}")
         _whitelist = set()
 
 
-def _save() -> None:
-    _WHITELIST_FILE.write_text(json.dumps(list(_whitelist)))
+def _migrate_json(store: StateStore) -> None:
+    # Старый формат хранения: переносится в хранилище один раз. Признак переноса
+    # хранится в самой базе — файл может вернуться при деплое (git reset/clean),
+    # и повторный импорт вернул бы пользователей, удалённых через /removeuser
+    legacy_file = Config.WHITELIST_FILE
+    if store.get_setting(WHITELIST_IMPORTED_SETTING):
+        return
+    migrated_file = legacy_file.with_suffix(".json.migrated")
+    if migrated_file.exists():
+        # Переносили ещё до появления признака — только отмечаем
+        user_ids = set()
+    elif legacy_file.exists():
+        user_ids = {int(uid) for uid in json.loads(legacy_file.read_text())}
+    else:
+        # Старого файла нет (например, ещё не восстановлен) — признак не ставим,
+        # иначе появившийся позже файл уже никогда не будет перенесён
+        return
+    if store.import_whitelist(user_ids, WHITELIST_IMPORTED_SETTING) and user_ids:
+        os.replace(legacy_file, migrated_file)
+        logger.info(f"📦 whitelist.json перенесён в хранилище состояния ({len(user_ids)} пользователей)")
 
 
 def is_allowed(user_id: int, admin_id: int) -> bool:
     return user_id == admin_id or user_id in _whitelist
 
 
-def add(user_id: int) -> bool:
+async def add(user_id: int) -> bool:
     if user_id in _whitelist:
         return False
     _whitelist.add(user_id)
-    _save()
+    await _store.add_user(user_id)
     return True
 
 
-def remove(user_id: int) -> bool:
+async def remove(user_id: int) -> bool:
     if user_id not in _whitelist:
         return False
     _whitelist.discard(user_id)
-    _save()
+    await _store.remove_user(user_id)
     return True
 
 
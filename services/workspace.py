@@ -0,0 +1,95 @@
+from pathlib import Path
+from typing import Optional
+from config import Config
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR_PREFIX = "job_"
+OUTBOX_DIR_PREFIX = "outbox_"
+
+
+class JobWorkspace:
+    """
+    Изолированная рабочая папка одной загрузки.
+    Создаётся при входе в `async with`, удаляется целиком при выходе.
+    Лимиты параллельности задаёт планировщик (services/scheduler.py).
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = root or Config.DOWNLOAD_DIR
+        self.path: Optional[Path] = None
+        self._keep = False
+
+    def keep(self):
+        """Не удалять папку на выходе: её удалит тот, кому переданы файлы."""
+        self._keep = True
+
+    async def __aenter__(self) -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.path = Path(tempfile.mkdtemp(prefix=JOB_DIR_PREFIX, dir=self.root))
+        logger.debug(f"📁 Создана рабочая папка {self.path}")
+        return self.path
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.path and not self._keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+            logger.debug(f"🧹 Рабочая папка {self.path} удалена")
+
+    @staticmethod
+    def cleanup_stale(root: Optional[Path] = None):
+        """Удаляет рабочие папки, оставшиеся после падения процесса."""
+        root = root or Config.DOWNLOAD_DIR
+        if not root.exists():
+            return
+        for prefix in (JOB_DIR_PREFIX, OUTBOX_DIR_PREFIX):
+            for item in root.glob(f"{prefix}*"):
+                if item.is_dir():
+                    shutil.rmtree(item, ignore_errors=True)
+                    logger.info(f"🧹 Удалена старая рабочая папка {item.name}")
+
+
+class Outbox:
+    """
+    Файлы, которые локальный Bot API сервер (--local) забирает сам по пути.
+    Готовый файл переносится (rename, без копирования) в отдельную папку вне
+    рабочей папки задачи: её удаление не трогает файл, пока сервер его читает.
+    После успешной отправки файл удаляется сразу, после ошибки или таймаута —
+    через grace секунд: сервер мог ещё не дочитать его.
+    """
+
+    def __init__(self, root: Optional[Path] = None, grace: Optional[float] = None):
+        self.root = root or Config.DOWNLOAD_DIR
+        self.grace = grace if grace is not None else Config.OUTBOX_GRACE_SECONDS
+
+    def stage(self, path: Path, filename: str) -> Path:
+        """Переносит файл в outbox под именем, которое увидит пользователь."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        folder = Path(tempfile.mkdtemp(prefix=OUTBOX_DIR_PREFIX, dir=self.root))
+        # Сервер может работать от другого пользователя — ему нужно право чтения
+        os.chmod(folder, 0o755)
+        target = folder / _safe_filename(filename, path.suffix)
+        shutil.move(str(path), str(target))
+        os.chmod(target, 0o644)
+        return target
+
+    def release(self, path: Path, delivered: bool):
+        if delivered:
+            shutil.rmtree(path.parent, ignore_errors=True)
+            return
+        logger.warning(f"⏳ {path.name} удалится через {self.grace:.0f} с: сервер мог не дочитать файл")
+        asyncio.get_running_loop().call_later(self.grace, shutil.rmtree, path.parent, True)
+
+
+def _safe_filename(filename: str, suffix: str) -> str:
+    name = re.sub(r'[\\/\0]', "_", filename).strip() or f"audio{suffix}"
+    # Имя в байтах ограничено файловой системой (обычно 255)
+    while len(name.encode()) > 240:
+        stem, ext = os.path.splitext(name)
+        name = stem[:-1] + ext
+    return name